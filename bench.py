@@ -0,0 +1,285 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Benchmarks of generating, writing and cutting the clock. Each benchmark
+# records the best wall time over a few runs, the peak memory allocated by
+# Python during one run, and the number of bytes of output it wrote. Run
+# with --save to record a baseline, then without to compare against it:
+#
+#     python bench.py --save
+#     python bench.py
+#
+# With --filter, --save only replaces the baseline of the benchmarks that
+# ran. Any number that's more than --threshold worse than the baseline is
+# flagged and makes the program exit with an error. The baseline is specific
+# to the machine, so it's not checked in.
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+
+from config import DPI, MODULE, BEARING_RADIUS
+from vector import Vector
+import clock
+import cut
+import draw
+import gear
+import jobs
+import jsonout
+import lru
+import memo
+import train
+
+DEFAULT_BASELINE = ".bench.json"
+
+# Seconds to spend timing each benchmark, at least.
+MIN_TIME = 0.5
+
+# Tooth counts for the gear benchmarks.
+TOOTH_COUNTS = [8, 16, 32, 64, 128, 256]
+
+# Number of gears in the synthetic trains.
+TRAIN_SIZES = [250, 1000, 2000]
+
+# Tooth counts that the synthetic trains cycle through, as (driver, driven).
+TRAIN_STAGES = [(64, 16), (60, 20), (48, 24), (40, 30), (60, 21), (49, 20)]
+
+# Output stream that only counts what's written to it.
+class ByteCounter:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, s):
+        self.size += len(s)
+
+    def flush(self):
+        pass
+
+# List of (name, function). Each function does the work once and returns
+# the number of bytes of output, or 0.
+BENCHMARKS = []
+
+def benchmark(name):
+    def register(function):
+        BENCHMARKS.append((name, function))
+        return function
+    return register
+
+# Gears at different angles, like in a train. The tooth profile is only
+# computed once.
+def register_gear_benchmark(z):
+    @benchmark("gear.generate z=%d x10" % z)
+    def run():
+        for i in range(10):
+            gear.generate(0, 0, z, BEARING_RADIUS, i*0.1, "#FFFFFF", MODULE)
+        return 0
+
+for z in TOOTH_COUNTS:
+    register_gear_benchmark(z)
+
+@benchmark("draw.add_bezier x1000")
+def bench_add_bezier():
+    p1 = Vector(0, 0)
+    p2 = Vector(DPI, 2*DPI)
+    p3 = Vector(3*DPI, -DPI)
+    p4 = Vector(4*DPI, DPI)
+    for i in range(1000):
+        p = []
+        draw.add_bezier(p, p1, p2, p3, p4, 100)
+    return 0
+
+@benchmark("draw.round_corners x1000")
+def bench_round_corners():
+    P = [Vector(0, 0), Vector(4*DPI, 0), Vector(4*DPI, 3*DPI), Vector(0, 3*DPI)]
+    for i in range(1000):
+        draw.round_corners(P, 0.25*DPI, 32)
+    return 0
+
+@benchmark("clock.py")
+def bench_clock():
+    out = ByteCounter()
+    with redirect(out):
+        clock.main(["--processes", "1"])
+    return out.size
+
+@benchmark("cut.py")
+def bench_cut():
+    out = ByteCounter()
+    with redirect(out):
+        cut.main([clock_json()])
+    return out.size
+
+def register_train_benchmark(gear_count):
+    @benchmark("train of %d gears" % gear_count)
+    def run():
+        data = {"dpi": DPI, "pieces": []}
+        gear_train = train.GearTrain(data, 0, 0, MODULE)
+        directions = [train.EAST, train.SOUTH, train.WEST, train.SOUTH]
+        for i in range(gear_count//2):
+            driver, driven = TRAIN_STAGES[i % len(TRAIN_STAGES)]
+            cz = 2*(i % 2)
+            gear_train.add_gear(driver, None, BEARING_RADIUS, cz=cz)
+            gear_train.add_gear(driven, directions[i % len(directions)], BEARING_RADIUS, cz=cz)
+        jobs.run(data, 1)
+
+        out = ByteCounter()
+        jsonout.write(data, out, precision=3, compact=True)
+        return out.size
+
+for gear_count in TRAIN_SIZES:
+    register_train_benchmark(gear_count)
+
+# Sends stdout to "out" and throws away stderr.
+@contextlib.contextmanager
+def redirect(out):
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(devnull):
+            yield
+
+# Filename of a JSON clock for the cut benchmark, made the first time it's
+# needed.
+CLOCK_JSON = []
+
+def clock_json():
+    if not CLOCK_JSON:
+        fd, filename = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            with redirect(f):
+                clock.main(["--processes", "1"])
+        CLOCK_JSON.append(filename)
+    return CLOCK_JSON[0]
+
+# Start each run with empty in-memory caches and no disk cache, so that runs
+# measure the same work.
+def reset():
+    lru.PROFILE_CACHE.clear()
+    lru.OUTLINE_CACHE.clear()
+    memo.disable()
+
+# Returns a dict of "time" (seconds), "peak" (bytes) and "size" (bytes).
+# The time is the best of at least "repeat" runs, with more runs for fast
+# benchmarks until they've taken MIN_TIME in total.
+def measure(function, repeat):
+    best = None
+    total = 0
+    runs = 0
+    while runs < repeat or total < MIN_TIME:
+        reset()
+        start = time.perf_counter()
+        size = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        total += elapsed
+        runs += 1
+
+    # Memory tracing slows everything down, so do it in a separate run.
+    reset()
+    tracemalloc.start()
+    try:
+        function()
+        # A peak of zero would hide memory regressions.
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("benchmark stopped tracemalloc")
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    return {"time": best, "peak": peak, "size": size}
+
+# Returns the list of metrics that are more than "threshold" (a fraction)
+# worse than the baseline.
+def regressions(result, baseline, threshold):
+    worse = []
+    for metric in ("time", "peak", "size"):
+        if metric in baseline and result[metric] > baseline[metric]*(1 + threshold):
+            worse.append(metric)
+    return worse
+
+def change(value, old):
+    if not old:
+        return ""
+    return "%+.0f%%" % ((float(value)/old - 1)*100)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark clock generation.')
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+            help="baseline file (default: %(default)s)")
+    parser.add_argument("--save", action="store_true",
+            help="save the results as the new baseline of the benchmarks that were run")
+    parser.add_argument("--threshold", type=float, default=0.20,
+            help="fraction worse than the baseline that counts as a regression (default: %(default)g)")
+    parser.add_argument("--repeat", type=int, default=3,
+            help="number of timed runs of each benchmark (default: %(default)d)")
+    parser.add_argument("--filter", default="",
+            help="only run benchmarks whose name contains this string")
+    args = parser.parse_args()
+
+    saved = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            saved = json.load(f)
+    # Nothing to compare against when making a new baseline.
+    baseline = {} if args.save else saved
+
+    out = sys.stdout
+    out.write("%-28s %10s %6s %10s %6s %10s %6s\n" % (
+        "Benchmark", "Time (ms)", "", "Peak (KB)", "", "Output", ""))
+
+    results = {}
+    failed = []
+    try:
+        for name, function in BENCHMARKS:
+            if args.filter not in name:
+                continue
+            result = measure(function, args.repeat)
+            results[name] = result
+
+            old = baseline.get(name, {})
+            worse = regressions(result, old, args.threshold)
+            if worse:
+                failed.append(name)
+            out.write("%-28s %10.2f %6s %10.1f %6s %10d %6s%s\n" % (
+                name,
+                result["time"]*1000, change(result["time"], old.get("time")),
+                result["peak"]/1024.0, change(result["peak"], old.get("peak")),
+                result["size"], change(result["size"], old.get("size")),
+                "  REGRESSION (%s)" % ", ".join(worse) if worse else ""))
+            out.flush()
+    finally:
+        for filename in CLOCK_JSON:
+            os.remove(filename)
+
+    if args.save:
+        # Keep the baseline of the benchmarks that --filter left out.
+        saved.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(saved, f, indent=4, sort_keys=True)
+            f.write("\n")
+        out.write("Saved baseline to %s.\n" % args.baseline)
+    elif not baseline:
+        out.write("No baseline in %s, run with --save to make one.\n" % args.baseline)
+
+    if failed:
+        out.write("%d benchmarks regressed by more than %.0f%%.\n" % (len(failed), args.threshold*100))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
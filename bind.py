@@ -15,18 +15,18 @@
 
 import math
 
-from config import LOOSE_BIND_BOLT_RADIUS, BIND_DISTANCE, BIND_COUNT, TAU
+from config import TAU, DEFAULT_CONFIG
 
 # Add information to a piece to allow the six binding holes to be made
 # that keep gears moving together.
-def add_bind_info(piece):
+def add_bind_info(piece, config=DEFAULT_CONFIG):
     centers = []
-    for i in range(BIND_COUNT):
-        t = float(i)/BIND_COUNT*TAU
-        centers.append((math.cos(t)*BIND_DISTANCE, math.sin(t)*BIND_DISTANCE))
+    for i in range(config.bind_count):
+        t = float(i)/config.bind_count*TAU
+        centers.append((math.cos(t)*config.bind_distance, math.sin(t)*config.bind_distance))
 
     piece["bind"] = {
-        "hole_radius": LOOSE_BIND_BOLT_RADIUS,
+        "hole_radius": config.loose_bind_bolt_radius,
         "centers": centers,
     }
 
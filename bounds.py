@@ -0,0 +1,72 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Bounding boxes and circles of pieces, and a spatial hash for finding
+# nearby points. Round pieces (gears, separators) have an "outer_radius"
+# and their bounds come from that without looking at the points. Otherwise
+# the bounds of the points are computed once and cached in the PointBuffer.
+
+import math
+import collections
+
+# Returns (min x, min y, max x, max y) of the piece relative to its center.
+def local_box(piece):
+    radius = piece.get("outer_radius")
+    if radius is not None:
+        return (-radius, -radius, radius, radius)
+    return piece["points"].bounds()[:4]
+
+# Returns (min x, min y, max x, max y) of the piece in place.
+def box(piece):
+    min_x, min_y, max_x, max_y = local_box(piece)
+    cx = piece["cx"]
+    cy = piece["cy"]
+    return (cx + min_x, cy + min_y, cx + max_x, cy + max_y)
+
+# Radius of the circle around the piece's center that contains it.
+def radius(piece):
+    radius = piece.get("outer_radius")
+    if radius is not None:
+        return radius
+    return piece["points"].bounds()[4]
+
+# Returns (cx, cy, r) of the bounding circle of the piece in place.
+def circle(piece):
+    return (piece["cx"], piece["cy"], radius(piece))
+
+# Points in a grid of square cells, for finding the points within a
+# tolerance of a given point. The cells must be at least as large as the
+# tolerance.
+class SpatialHash:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = collections.defaultdict(list)
+
+    def cell(self, x, y):
+        return (int(math.floor(x/self.cell_size)), int(math.floor(y/self.cell_size)))
+
+    def add(self, x, y, value):
+        self.cells[self.cell(x, y)].append((x, y, value))
+
+    # Returns the value of the first point within "tolerance" of (x, y) in
+    # both x and y, or None.
+    def find(self, x, y, tolerance):
+        i, j = self.cell(x, y)
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                for px, py, value in self.cells.get((i + di, j + dj), ()):
+                    if abs(px - x) <= tolerance and abs(py - y) <= tolerance:
+                        return value
+        return None
@@ -26,6 +26,15 @@ var g_previous_date = null;
 var g_scene = null;
 var g_objects = [];
 
+// Last build id written by "clock.py --watch", and milliseconds between
+// checks for a new one.
+var g_build_id = null;
+var BUILD_POLL_INTERVAL = 250;
+
+// Largest error of an outline on the screen, in pixels, before a finer
+// level of detail is shown.
+var LEVEL_PIXEL_ERROR = 0.5;
+
 // Simulate the motion of the escapement.
 var escapedTime = function (time) {
     var integer = Math.floor(time);
@@ -37,6 +46,20 @@ var escapedTime = function (time) {
     return integer + fraction;
 };
 
+// Angle of a keyframe track from kinematics.py at the given time.
+var evaluateTrack = function (track, time) {
+    var cycles = Math.floor(time/track.period);
+    var t = time - cycles*track.period;
+    var times = track.times;
+    var values = track.values;
+    var i = 1;
+    while (i < times.length - 1 && times[i] < t) {
+        i++;
+    }
+    var f = (t - times[i - 1])/(times[i] - times[i - 1]);
+    return values[i - 1] + f*(values[i] - values[i - 1]) + cycles*track.advance;
+};
+
 var onKeyDown = function (event) {
     // Minute hand goes around in one minute instead of one hour.
     if (event.keyCode === 48) { // "0"
@@ -96,6 +119,63 @@ var findHole = function (holes, x, y) {
     return null;
 }
 
+// Outline of a piece extruded to the material thickness, as three lines.
+var makeOutline = function (points, thickness, material) {
+    // Points from the binary file are a flat typed array.
+    var flat = !$.isArray(points);
+    var pointCount = flat ? points.length/2 : points.length;
+
+    var geometry1 = new THREE.Geometry();
+    var geometry2 = new THREE.Geometry();
+    var geometry3 = new THREE.Geometry();
+    for (var i = 0; i < pointCount; i++) {
+        var x = flat ? points[i*2] : points[i][0];
+        var y = flat ? points[i*2 + 1] : points[i][1];
+        geometry1.vertices.push(new THREE.Vector3(x, -y, 0));
+        geometry2.vertices.push(new THREE.Vector3(x, -y, thickness));
+        geometry3.vertices.push(new THREE.Vector3(x, -y, 0));
+        geometry3.vertices.push(new THREE.Vector3(x, -y, thickness));
+    }
+
+    var outline = new THREE.Object3D();
+    outline.add(new THREE.Line(geometry1, material, THREE.LineStrip));
+    outline.add(new THREE.Line(geometry2, material, THREE.LineStrip));
+    outline.add(new THREE.Line(geometry3, material, THREE.LinePieces));
+    return outline;
+};
+
+// Show the coarsest level of detail of each piece whose error on the
+// screen is under LEVEL_PIXEL_ERROR. Outlines are made the first time
+// they're needed.
+var updateLevels = function (camera) {
+    var pixelsPerUnit = window.innerHeight/(2*Math.tan(camera.fov*Math.PI/360));
+    for (var i = 0; i < g_objects.length; i++) {
+        var object = g_objects[i];
+        if (object.levels === undefined || object.levels.length < 2) {
+            continue;
+        }
+
+        var distance = camera.position.distanceTo(object.object3d.position);
+        var level = 0;
+        for (var j = object.levels.length - 1; j > 0; j--) {
+            if (object.levels[j].tolerance*pixelsPerUnit/distance <= LEVEL_PIXEL_ERROR) {
+                level = j;
+                break;
+            }
+        }
+
+        if (level !== object.level) {
+            var next = object.levels[level];
+            if (next.outline === null) {
+                next.outline = makeOutline(next.points, object.thickness, object.material);
+            }
+            object.object3d.remove(object.levels[object.level].outline);
+            object.object3d.add(next.outline);
+            object.level = level;
+        }
+    }
+};
+
 var initializeThree = function () {
     var renderer = new THREE.WebGLRenderer();
     renderer.setSize(window.innerWidth, window.innerHeight);
@@ -144,7 +224,10 @@ var initializeThree = function () {
             var object3d = object.object3d;
             var theta;
 
-            if (piece.type === "verge" || piece.type === "pendulum") {
+            if (object.track !== undefined) {
+                // Precomputed by kinematics.py.
+                theta = object.track === null ? 0 : evaluateTrack(object.track, g_time);
+            } else if (piece.type === "verge" || piece.type === "pendulum") {
                 // Map two seconds to TAU (one cycle), then Sine that, map to 0 to 1.
                 var span = Math.sin(g_time/2*TAU + 0.6)/2 + 0.5;
                 var left_full_in_angle = piece.left_full_in_angle*TAU/360;
@@ -165,6 +248,7 @@ var initializeThree = function () {
 
         // Update camera position.
         controls.update();
+        updateLevels(camera);
 
         // Render the scene.
         renderer.render(g_scene, camera);
@@ -179,9 +263,12 @@ var startRendering = function (data) {
     // New scene.
     g_scene = new THREE.Scene();
 
-    // Each object has two keys:
+    // Each object has these keys:
     //    object3d: the THREE.Object3D object.
     //    piece: the piece (gear, axle, etc.).
+    //    track: its keyframe track, if the file has them.
+    //    levels, level, material, thickness: its levels of detail and
+    //        the one that's shown, for pieces.
     g_objects = [];
 
     // List of holes we've seen. Each item is an object with keys:
@@ -193,6 +280,22 @@ var startRendering = function (data) {
     // Duplicate (x,y) are removed.
     var holes = [];
 
+    // Keyframe track of each piece, if the file has them. Pieces without
+    // one don't move.
+    var tracks = null;
+    if (data.animation) {
+        tracks = [];
+        for (var i = 0; i < pieces.length; i++) {
+            tracks.push(null);
+        }
+        for (var i = 0; i < data.animation.tracks.length; i++) {
+            var track = data.animation.tracks[i];
+            for (var j = 0; j < track.pieces.length; j++) {
+                tracks[track.pieces[j]] = track;
+            }
+        }
+    }
+
     // Lowest and highest Z value.
     var maxZ = -100000;
     var minZ = 100000;
@@ -200,7 +303,6 @@ var startRendering = function (data) {
     // Draw each gear.
     for (var gear_index in pieces) {
         var gear = pieces[gear_index];
-        var points = gear.points;
         var cx = gear.cx;
         var cy = -gear.cy;
         var cz = gear.cz*data.material_thickness;
@@ -209,20 +311,22 @@ var startRendering = function (data) {
         var material = new THREE.LineBasicMaterial({ color: gear.color });
         var gearObject = new THREE.Object3D();
 
-        var geometry1 = new THREE.Geometry();
-        var geometry2 = new THREE.Geometry();
-        var geometry3 = new THREE.Geometry();
-        for (var i = 0; i < points.length; i++) {
-            var x = points[i][0];
-            var y = points[i][1];
-            geometry1.vertices.push(new THREE.Vector3(x, -y, 0));
-            geometry2.vertices.push(new THREE.Vector3(x, -y, data.material_thickness));
-            geometry3.vertices.push(new THREE.Vector3(x, -y, 0));
-            geometry3.vertices.push(new THREE.Vector3(x, -y, data.material_thickness));
+        // Levels of detail from simplify.add_levels(), finest first, with
+        // tolerances in our units. Start with the coarsest, updateLevels()
+        // refines it.
+        var levels = [{tolerance: 0, points: gear.points, outline: null}];
+        if (gear.levels) {
+            for (var i = 0; i < gear.levels.length; i++) {
+                levels.push({
+                    tolerance: gear.levels[i].tolerance*data.dpi,
+                    points: gear.levels[i].points,
+                    outline: null
+                });
+            }
         }
-        gearObject.add(new THREE.Line(geometry1, material, THREE.LineStrip));
-        gearObject.add(new THREE.Line(geometry2, material, THREE.LineStrip));
-        gearObject.add(new THREE.Line(geometry3, material, THREE.LinePieces));
+        var level = levels.length - 1;
+        levels[level].outline = makeOutline(levels[level].points, data.material_thickness, material);
+        gearObject.add(levels[level].outline);
 
         if (gear.hole_radius) {
             addCylinder(0, 0, 0, data.material_thickness, gear.hole_radius, 20, material, gearObject);
@@ -273,7 +377,12 @@ var startRendering = function (data) {
         g_scene.add(gearObject);
         g_objects.push({
             object3d: gearObject,
-            piece: gear
+            piece: gear,
+            track: tracks === null ? undefined : tracks[gear_index],
+            levels: levels,
+            level: level,
+            material: material,
+            thickness: data.material_thickness
         });
     }
 
@@ -295,16 +404,83 @@ var startRendering = function (data) {
     }
 };
 
-// Fetch the JSON data from the net and display it.
+// Parse the packed binary file written by packed.py. See that file for the
+// format. Points become flat typed arrays that share the buffer.
+var parsePacked = function (buffer) {
+    var view = new DataView(buffer);
+    var magic = String.fromCharCode(view.getUint8(0), view.getUint8(1),
+                                    view.getUint8(2), view.getUint8(3));
+    if (magic !== "CLKB" || view.getUint32(4, true) !== 1) {
+        throw new Error("Not a packed clock file");
+    }
+    var headerLength = view.getUint32(8, true);
+    var start = 12 + headerLength;
+    var headerBytes = new Uint8Array(buffer, 12, headerLength);
+    var header = JSON.parse(new TextDecoder("utf-8").decode(headerBytes));
+    var ArrayType = header.dtype === "float64" ? Float64Array : Float32Array;
+
+    // Points from [offset, count].
+    var unpack = function (reference) {
+        return new ArrayType(buffer,
+                start + reference[0]*2*ArrayType.BYTES_PER_ELEMENT, reference[1]*2);
+    };
+
+    var data = header.data;
+    data.pieces = header.pieces;
+    for (var i = 0; i < data.pieces.length; i++) {
+        var piece = data.pieces[i];
+        piece.points = unpack(piece.points);
+        if (piece.levels) {
+            for (var j = 0; j < piece.levels.length; j++) {
+                piece.levels[j].points = unpack(piece.levels[j].points);
+            }
+        }
+    }
+
+    return data;
+};
+
+// Fetch the data from the net and display it. Add "?bin" to the page URL
+// to load the packed binary file instead of the JSON file.
 var fetchData = function () {
-    $.getJSON("clock.json", function (data) {
-        startRendering(data);
+    if (window.location.search.indexOf("bin") >= 0) {
+        var request = new XMLHttpRequest();
+        request.open("GET", "clock.bin", true);
+        request.responseType = "arraybuffer";
+        request.onload = function () {
+            startRendering(parsePacked(request.response));
+        };
+        request.send();
+    } else {
+        $.getJSON("clock.json", function (data) {
+            startRendering(data);
+        });
+    }
+};
+
+// Reload the data whenever "clock.py --watch" finishes a build. Stops if
+// there's no build id file, since then nothing is watching.
+var pollBuildId = function () {
+    $.ajax({
+        url: "clock.build",
+        cache: false,
+        dataType: "text",
+        success: function (text) {
+            var buildId = parseInt(text, 10);
+            if (g_build_id !== null && buildId !== g_build_id) {
+                console.log("Loading build " + buildId);
+                fetchData();
+            }
+            g_build_id = buildId;
+            setTimeout(pollBuildId, BUILD_POLL_INTERVAL);
+        }
     });
 };
 
 $(function () {
     initializeThree();
     fetchData();
+    pollBuildId();
 });
 
 })();
@@ -14,75 +14,172 @@
 #   limitations under the License.
 
 import sys
-import argparse
 import json
+import argparse
 
-from config import DPI, WIDTH, HEIGHT, MODULE, TIGHT_LARGE_BOLT_RADIUS, MATERIAL_THICKNESS, BEARING_RADIUS
+from config import DPI, DEFAULT_CONFIG, make_config
 import train
 import frame
 import escapement
 import pendulum
+import lru
+import jsonout
+import packed
+import simplify
+import jobs
+import memo
+import mesh
+import kinematics
+import dynamics
+import instrument
+import watch
 from vector import Vector
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Generate gears.')
+    parser.add_argument("--config", metavar="FILENAME",
+            help="JSON file of changes to the parameters in config.py, as for sweep.py")
+    parser.add_argument("--output", metavar="FILENAME",
+            help="write the JSON to this file instead of standard output")
+    parser.add_argument("--watch", action="store_true",
+            help="keep running and build again whenever a source file or the --config file changes")
+    parser.add_argument("--precision", type=int, default=None,
+            help="number of decimal places for point coordinates (default: full precision)")
+    parser.add_argument("--compact", action="store_true",
+            help="write JSON without indentation, one piece per line")
+    parser.add_argument("--simplify", type=float, metavar="INCHES",
+            help="remove vertices that are within this distance of the outline")
+    parser.add_argument("--levels", type=float, nargs="*", metavar="INCHES",
+            help="add coarser outlines for the viewer, simplified to these tolerances (default: %s)" %
+                " ".join("%g" % tolerance for tolerance in simplify.LEVEL_TOLERANCES))
+    parser.add_argument("--binary", metavar="FILENAME",
+            help="also write the packed binary version of the data to this file")
+    parser.add_argument("--binary-dtype", choices=sorted(packed.DTYPES), default="float32",
+            help="coordinate type in the binary file (default: float32)")
+
+    parser.add_argument("--check-mesh", action="store_true",
+            help="turn each pair of meshing gears and check that their teeth don't collide")
+
+    parser.add_argument("--processes", type=int, default=None,
+            help="number of processes that generate pieces (default: one per core "
+                "if there are at least %d pieces, otherwise one)" % jobs.MIN_POOL_PIECES)
+
+    parser.add_argument("--cache", metavar="DIRECTORY",
+            help="keep generated pieces in this directory and reuse them on the next run")
+    parser.add_argument("--cache-size", type=int, default=memo.DEFAULT_MAX_BYTES//(1024*1024),
+            metavar="MB", help="maximum size of the cache directory (default: %(default)d)")
+    instrument.add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    if args.watch and not args.output:
+        parser.error("--watch needs --output")
+
+    if args.watch:
+        watch.run(lambda: generate(args, load_config(args)), args.output,
+                [args.config] if args.config else [])
+
+    with instrument.profiling(args, "clock.py", argv):
+        data = generate(args, load_config(args))
+        instrument.finish(data["pieces"])
+
+# The config of the --config file, or the default one.
+def load_config(args):
+    params = {}
+    if args.config:
+        with open(args.config) as f:
+            params = json.load(f)
+    return make_config(params)
+
+# Makes the clock with the parameters in "config" (a config.ClockConfig) and
+# writes it out as specified by the command-line arguments. Returns the data.
+def generate(args, config=DEFAULT_CONFIG):
+    # With --watch, memo.py may have been reloaded.
+    if args.cache and memo.CACHE is None:
+        memo.enable(args.cache, args.cache_size*1024*1024)
+
+    data, gear_train = build(config, args.processes, args.check_mesh)
+
+    if args.simplify:
+        with instrument.stage("simplify"):
+            simplify.simplify_pieces(data, args.simplify, sys.stderr)
+
+    # Levels of detail, from the final outlines.
+    if args.levels is not None:
+        with instrument.stage("levels"):
+            simplify.add_levels(data, sorted(args.levels) or simplify.LEVEL_TOLERANCES, sys.stderr)
+
+    # Dump JSON output.
+    with instrument.stage("serialization"):
+        if args.output:
+            watch.atomic_write(args.output,
+                    lambda f: jsonout.write(data, f, args.precision, args.compact))
+        else:
+            jsonout.write(data, sys.stdout, args.precision, args.compact)
+        if args.binary:
+            watch.atomic_write(args.binary,
+                    lambda f: packed.write(data, f, args.binary_dtype), "wb")
 
-    args = parser.parse_args()
+    gear_train.dump_statistics(sys.stderr)
+    lru.dump_statistics(sys.stderr)
+    memo.dump_statistics(sys.stderr)
 
+    return data
+
+# Makes the clock with the parameters in "config". Pieces are made by
+# "processes" workers (see jobs.run()). Returns the data and the gear train.
+def build(config=DEFAULT_CONFIG, processes=None, check_mesh=False):
     # Data file we're going to output.
     data = {
-        "material_thickness": MATERIAL_THICKNESS,
+        "material_thickness": config.material_thickness,
         "dpi": DPI,
-        "large_bolt_radius": TIGHT_LARGE_BOLT_RADIUS,
+        "large_bolt_radius": config.tight_large_bolt_radius,
         "pieces": [],
     }
 
     # Full clock in place.
-    gear_train = train.GearTrain(data, 6*DPI, HEIGHT/2, MODULE)
+    gear_train = train.GearTrain(data, 6*DPI, config.height/2, config=config)
     escapement_cz = 0
 
-    # Hour hand:
-    gear_train.add_gear(64, None, BEARING_RADIUS, cz=0)
-    gear_train.add_gear(16, train.WEST, BEARING_RADIUS, cz=0)
-
-    gear_train.add_gear(60, None, BEARING_RADIUS, cz=2)
-    gear_train.add_gear(20, train.EAST, BEARING_RADIUS, cz=2)
+    # Place the gears, separators and escapement. Their outlines are made
+    # in the "tessellation" stage, except for the verge's, and the time of
+    # each piece is in its "piece" event.
+    with instrument.stage("layout"):
+        gear_train.add_stages(config.stages, config.bearing_radius)
 
-    # Minute hand:
-    gear_train.add_gear(60, None, BEARING_RADIUS, cz=4)
-    gear_train.add_gear(20, train.EAST, BEARING_RADIUS, cz=4)
+        # Separator to escapement.
+        gear_train.add_separators(escapement_cz, config.bearing_radius)
 
-    gear_train.add_gear(49, None, BEARING_RADIUS, cz=2)
-    gear_train.add_gear(20, train.EAST, BEARING_RADIUS, cz=2)
+        # Add escapement.
+        ## data["pieces"] = []
+        esc_center = Vector(gear_train.cx, gear_train.cy)
+        verge_center, verge_hole_offset = escapement.generate(data, esc_center,
+                gear_train.speed, config.bearing_radius, cz=escapement_cz, config=config)
 
-    gear_train.add_gear(60, None, BEARING_RADIUS, cz=0)
-    gear_train.add_gear(21, train.EAST, BEARING_RADIUS, cz=0)
+    # Make the gears in parallel. The frame needs their outlines.
+    with instrument.stage("tessellation"):
+        jobs.run(data, processes)
 
-    gear_train.add_gear(60, None, BEARING_RADIUS, cz=4)
-    gear_train.add_gear(21, train.EAST, BEARING_RADIUS, cz=4)
-
-    gear_train.add_gear(40, None, BEARING_RADIUS, cz=2)
-    gear_train.add_gear(20, train.SOUTH, BEARING_RADIUS, cz=2)
-
-    # Separator to escapement.
-    gear_train.add_separators(escapement_cz, BEARING_RADIUS)
-
-    # Add escapement.
-    ## data["pieces"] = []
-    esc_center = Vector(gear_train.cx, gear_train.cy)
-    verge_center, verge_hole_offset = escapement.generate(data, esc_center,
-            gear_train.speed, BEARING_RADIUS, cz=escapement_cz)
+    if check_mesh:
+        with instrument.stage("mesh check"):
+            mesh.dump_results(mesh.check(data, gear_train.meshes), sys.stderr)
 
     # Add frame.
-    frame.generate(data, "#00FF00")
+    with instrument.stage("frame"):
+        frame.generate(data, "#00FF00", config)
 
     # Add pendulum.
-    pendulum.generate(data, verge_center, verge_hole_offset, escapement_cz, gear_train.speed, "#0000FF")
+    with instrument.stage("pendulum"):
+        pendulum.generate(data, verge_center, verge_hole_offset, escapement_cz, gear_train.speed, "#0000FF",
+                config)
 
-    # Dump JSON output. If generating a custom object, call its to_JSON() method.
-    json.dump(data, sys.stdout, indent=4, default=lambda obj: obj.to_JSON())
+    with instrument.stage("dynamics"):
+        dynamics.dump_period(data, sys.stderr, config)
 
-    gear_train.dump_statistics(sys.stderr)
+    # Keyframes of the motion, for the viewer.
+    with instrument.stage("animation"):
+        data["animation"] = kinematics.tracks(data["pieces"])
+
+    return data, gear_train
 
 if __name__ == "__main__":
     main()
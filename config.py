@@ -14,6 +14,7 @@
 #   limitations under the License.
 
 import math
+import collections
 
 DPI = 72
 # For plates or the whole train.
@@ -32,9 +33,38 @@ NUM_POINTS_FILLET = 10
 NUM_POINTS_FLANK = 10
 NUM_POINTS_TOP = 10
 
+# If not None, ignore the NUM_POINTS_* constants above and instead pick the
+# number of points on each part of a gear tooth so that the outline is
+# within this many inches of the true curve.
+GEAR_MAX_ERROR = None
+
+# If not None, curves drawn by draw.py (Bezier curves, rounded corners,
+# circles) use as many points as needed to stay within this many inches of
+# the true curve, instead of a fixed number of points.
+CURVE_TOLERANCE = None
+
 # Space between coupled gears
 GEAR_SPACING = 0.05*DPI
 
+# Directions from the axle of a driver gear to the gear it drives.
+NORTH = 0
+EAST = 1
+SOUTH = 2
+WEST = 3
+
+# Stages of the gear train as (driver teeth, driven teeth, direction, cz), in
+# the form that search.py outputs. The hour hand is on the first driver and
+# the minute hand on the driven gear of the second stage.
+GEAR_STAGES = (
+    (64, 16, WEST, 0),
+    (60, 20, EAST, 2),
+    (60, 20, EAST, 4),
+    (49, 20, EAST, 2),
+    (60, 21, EAST, 0),
+    (60, 21, EAST, 4),
+    (40, 20, SOUTH, 2),
+)
+
 # Size of tooth.
 MODULE = 0.10*DPI
 
@@ -76,5 +106,171 @@ WALL_ANCHOR_OFFSET = 2*DPI
 LEFT_FULL_IN_ANGLE = -2
 RIGHT_FULL_IN_ANGLE = 2
 
+# Escapement wheel size and tooth count.
+ESC_RADIUS = 2*DPI
+ESC_TOOTH_HEIGHT = 0.5*DPI
+ESC_TOOTH_COUNT = 15
+
+# Fillets on the crest and trough of the escapement wheel's teeth.
+ESC_FILLET_POINT_COUNT = 10
+ESC_CREST_FILLET_RADIUS = 0.04*DPI
+ESC_TROUGH_FILLET_RADIUS = 0.06*DPI
+
+# Distance from the escapement center down to the verge center.
+VERGE_DISTANCE = 5*DPI
+
+# Angle around escapement where the verge's points are, in teeth.
+VERGE_TEETH = 5.5
+
+# Distance from center of escapement to the verge's points, relative to its
+# radius.
+VERGE_POINT_SCALE = 1.1
+
+# Height and width of the verge's teeth.
+VERGE_TOOTH_HEIGHT = 0.5*DPI
+VERGE_TOOTH_WIDTH = 1*DPI
+
+# Space between the outermost axles and the edge of the frame.
+FRAME_PADDING = 1*DPI
+
+# The parameters above that can change from one clock to the next, as a
+# single immutable and hashable value. Make variants with _replace(), for
+# example DEFAULT_CONFIG._replace(module=0.12*DPI), and pass them to
+# train.GearTrain, escapement.generate(), frame.generate(),
+# pendulum.generate(), bind.add_bind_info() and cut.py. The pieces that take
+# long to make are cached on only the fields they use, so variants share
+# them.
+ClockConfig = collections.namedtuple("ClockConfig", [
+    "width",
+    "height",
+    "stages",
+    "module",
+    "gear_spacing",
+    "num_points_root",
+    "num_points_fillet",
+    "num_points_flank",
+    "num_points_top",
+    "gear_max_error",
+    "tight_large_bolt_radius",
+    "bearing_radius",
+    "separator_radius",
+    "loose_bind_bolt_radius",
+    "bind_distance",
+    "bind_count",
+    "pendulum_hole_separation",
+    "pendulum_bar_width",
+    "pendulum_bar_height",
+    "pendulum_weight_width",
+    "pendulum_weight_height",
+    "material_thickness",
+    "left_full_in_angle",
+    "right_full_in_angle",
+    "esc_radius",
+    "esc_tooth_height",
+    "esc_tooth_count",
+    "esc_fillet_point_count",
+    "esc_crest_fillet_radius",
+    "esc_trough_fillet_radius",
+    "verge_distance",
+    "verge_teeth",
+    "verge_point_scale",
+    "verge_tooth_height",
+    "verge_tooth_width",
+    "frame_padding",
+    "curve_tolerance",
+])
+
+DEFAULT_CONFIG = ClockConfig(
+    width=WIDTH,
+    height=HEIGHT,
+    stages=GEAR_STAGES,
+    module=MODULE,
+    gear_spacing=GEAR_SPACING,
+    num_points_root=NUM_POINTS_ROOT,
+    num_points_fillet=NUM_POINTS_FILLET,
+    num_points_flank=NUM_POINTS_FLANK,
+    num_points_top=NUM_POINTS_TOP,
+    gear_max_error=GEAR_MAX_ERROR,
+    tight_large_bolt_radius=TIGHT_LARGE_BOLT_RADIUS,
+    bearing_radius=BEARING_RADIUS,
+    separator_radius=SEPARATOR_RADIUS,
+    loose_bind_bolt_radius=LOOSE_BIND_BOLT_RADIUS,
+    bind_distance=BIND_DISTANCE,
+    bind_count=BIND_COUNT,
+    pendulum_hole_separation=PENDULUM_HOLE_SEPARATION,
+    pendulum_bar_width=PENDULUM_BAR_WIDTH,
+    pendulum_bar_height=PENDULUM_BAR_HEIGHT,
+    pendulum_weight_width=PENDULUM_WEIGHT_WIDTH,
+    pendulum_weight_height=PENDULUM_WEIGHT_HEIGHT,
+    material_thickness=MATERIAL_THICKNESS,
+    left_full_in_angle=LEFT_FULL_IN_ANGLE,
+    right_full_in_angle=RIGHT_FULL_IN_ANGLE,
+    esc_radius=ESC_RADIUS,
+    esc_tooth_height=ESC_TOOTH_HEIGHT,
+    esc_tooth_count=ESC_TOOTH_COUNT,
+    esc_fillet_point_count=ESC_FILLET_POINT_COUNT,
+    esc_crest_fillet_radius=ESC_CREST_FILLET_RADIUS,
+    esc_trough_fillet_radius=ESC_TROUGH_FILLET_RADIUS,
+    verge_distance=VERGE_DISTANCE,
+    verge_teeth=VERGE_TEETH,
+    verge_point_scale=VERGE_POINT_SCALE,
+    verge_tooth_height=VERGE_TOOTH_HEIGHT,
+    verge_tooth_width=VERGE_TOOTH_WIDTH,
+    frame_padding=FRAME_PADDING,
+    curve_tolerance=CURVE_TOLERANCE,
+)
+
+# Fields of the config that aren't lengths.
+NOT_LENGTHS = set([
+    "stages",
+    "num_points_root",
+    "num_points_fillet",
+    "num_points_flank",
+    "num_points_top",
+    "gear_max_error",
+    "bind_count",
+    "left_full_in_angle",
+    "right_full_in_angle",
+    "esc_tooth_count",
+    "esc_fillet_point_count",
+    "verge_teeth",
+    "verge_point_scale",
+    "curve_tolerance",
+])
+
+DIRECTION_NAMES = {
+    "N": NORTH,
+    "E": EAST,
+    "S": SOUTH,
+    "W": WEST,
+}
+
+# A direction given as a number (NORTH etc.) or a letter of DIRECTION_NAMES.
+def parse_direction(direction):
+    if isinstance(direction, str):
+        if direction.upper() not in DIRECTION_NAMES:
+            raise ValueError("unknown direction %r" % direction)
+        return DIRECTION_NAMES[direction.upper()]
+    if direction not in DIRECTION_NAMES.values():
+        raise ValueError("unknown direction %r" % direction)
+    return int(direction)
+
+# Returns DEFAULT_CONFIG changed by the fields in "params", a dict as read
+# from a JSON file, with lengths in inches and angles in degrees. Stages are
+# given as in the output of search.py, e.g. [[64, 16, 3, 0], [60, 20, 1, 2],
+# ...], or with letters for the directions, e.g. [[64, 16, "W", 0], ...].
+def make_config(params):
+    changes = {}
+    for key, value in params.items():
+        if key not in DEFAULT_CONFIG._fields:
+            raise ValueError("unknown parameter %s" % key)
+        if key == "stages":
+            value = tuple((int(driver), int(driven), parse_direction(direction), int(cz))
+                    for driver, driven, direction, cz in value)
+        elif key not in NOT_LENGTHS:
+            value = value*DPI
+        changes[key] = value
+    return DEFAULT_CONFIG._replace(**changes)
+
 # References:
 # [1]: http://us.mt.com/dam/mt_ext_files/Editorial/Generic/5/bolt_thread_types_dimensions_0x0002464400026aa20006025d_files/bolt.pdf
@@ -16,65 +16,190 @@
 # Generate SVG for cutting.
 
 import sys
+import time
 import argparse
 import json
 
-from config import DPI, WIDTH, HEIGHT
+from config import DPI, DEFAULT_CONFIG
 import svg
+import packed
+import simplify
+import nest
+import toolpath
+import instrument
 
 # Generates an SVG from a JSON clock description.
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Generate gears.')
-    parser.add_argument("input", help="JSON filename to read")
-    args = parser.parse_args()
-
-    data = json.load(open(args.input))
-    pieces = data["pieces"]
-
-    out = sys.stdout
-    x_multiplier = 1.0
-    cz_vertical_offset = 5*DPI*0
-
-    svg.header(out, WIDTH*x_multiplier, HEIGHT*7)
-
-    # Make cuts.
+    parser.add_argument("input", help="JSON or packed binary filename to read")
+    parser.add_argument("--compact", action="store_true",
+            help="write outlines as relative <path> elements, one group per piece")
+    parser.add_argument("--precision", type=int, default=None,
+            help="decimal places for coordinates, in points (1/%d inch). Default is 3 with --compact, otherwise %%%%g" % DPI)
+    parser.add_argument("--simplify", type=float, metavar="INCHES",
+            help="remove vertices that are within this distance of the outline")
+    parser.add_argument("--nest", metavar="PREFIX",
+            help="lay the pieces out on sheets and write one SVG per sheet, named PREFIX-1.svg and so on")
+    parser.add_argument("--sheet", default="%gx%g" % (nest.SHEET_WIDTH/DPI, nest.SHEET_HEIGHT/DPI),
+            metavar="WxH", help="with --nest, size of the sheets in inches (default: %(default)s)")
+    parser.add_argument("--spacing", type=float, default=nest.SPACING/DPI, metavar="INCHES",
+            help="with --nest, space between pieces (default: %(default)g)")
+    parser.add_argument("--rotations", type=int, default=nest.ROTATIONS,
+            help="with --nest, number of angles to try for each piece (default: %(default)d)")
+    parser.add_argument("--copies", type=int, default=1,
+            help="with --nest, number of clocks to cut (default: %(default)d)")
+    parser.add_argument("--order", action="store_true",
+            help="cut holes before the outlines around them, and order the cuts to reduce travel")
+    instrument.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with instrument.profiling(args, "cut.py", argv):
+        data = generate(args)
+        instrument.finish(data["pieces"])
+
+# Writes the SVG to stdout. The page is the size in "config" (a
+# config.ClockConfig). Returns the data.
+def generate(args, config=DEFAULT_CONFIG):
+    with instrument.stage("load"):
+        if packed.is_packed(args.input):
+            data = packed.read(args.input)
+        else:
+            data = json.load(open(args.input))
+
+    # Always cut the finest level of detail, which is "points".
+    for piece in data["pieces"]:
+        piece.pop("levels", None)
+
+    if args.simplify:
+        with instrument.stage("simplify"):
+            simplify.simplify_pieces(data, args.simplify, sys.stderr)
+
+    precision = args.precision
+    if args.compact and precision is None:
+        precision = 3
+
+    if args.nest:
+        write_sheets(data, args, precision)
+        return data
+
+    with instrument.stage("svg"):
+        out = svg.BufferedWriter(sys.stdout)
+        x_multiplier = 1.0
+        cz_vertical_offset = 5*DPI*0
+
+        svg.header(out, config.width*x_multiplier, config.height*7)
+
+        # Make cuts.
+        if args.order:
+            placements = []
+            names = []
+            for piece_index, piece in enumerate(data["pieces"]):
+                cx = piece["cx"]*x_multiplier
+                cy = piece["cy"] + piece["cz"]*cz_vertical_offset
+                placements.append(nest.Placement(piece, cx, cy, 0))
+                names.append("%s_%d" % (piece["type"], piece_index))
+            write_ordered(out, placements, names, args.compact, precision)
+        else:
+            for piece_index, piece in enumerate(data["pieces"]):
+                start = time.perf_counter()
+                cx = piece["cx"]*x_multiplier
+                cy = piece["cy"] + piece["cz"]*cz_vertical_offset
+                name = "%s_%d" % (piece["type"], piece_index)
+                write_piece(out, piece, name, cx, cy, args.compact, precision)
+                instrument.piece_time(piece, time.perf_counter() - start)
+
+        svg.footer(out)
+        out.flush()
+
+    return data
+
+# Lays out "copies" of all the pieces on sheets and writes one SVG file per
+# sheet.
+def write_sheets(data, args, precision):
+    width, height = [float(v)*DPI for v in args.sheet.split("x")]
+
+    with instrument.stage("nest"):
+        pieces = data["pieces"]*args.copies
+        sheets, unplaced = nest.nest(pieces, width, height, args.spacing*DPI, args.rotations)
+
+    # Names are by index in the original list, so copies have the same name.
+    names = {}
+    areas = {}
     for piece_index, piece in enumerate(data["pieces"]):
-        cx = piece["cx"]*x_multiplier
-        cy = piece["cy"] + piece["cz"]*cz_vertical_offset
-        color = piece["color"]
-
-        # Always use black for cut, it makes it easier to see in AI.
-        color = "black"
-
-        name = "%s_%d" % (piece["type"], piece_index)
-        svg.start_group(out, name, cx, cy)
-
-        p = piece["points"]
-        svg.start_group(out, name + "_body")
-        svg.polyline(out, p, color)
+        names[id(piece)] = "%s_%d" % (piece["type"], piece_index)
+        areas[id(piece)] = nest.outline_area(piece)
+
+    with instrument.stage("svg"):
+        for sheet_index, placements in enumerate(sheets):
+            filename = "%s-%d.svg" % (args.nest, sheet_index + 1)
+            with open(filename, "w") as f:
+                out = svg.BufferedWriter(f)
+                svg.header(out, width, height)
+                sheet_names = ["%s_%d" % (names[id(placement.piece)], index)
+                        for index, placement in enumerate(placements)]
+                if args.order:
+                    write_ordered(out, placements, sheet_names, args.compact, precision)
+                else:
+                    for name, placement in zip(sheet_names, placements):
+                        write_piece(out, placement.piece, name, placement.x, placement.y,
+                                args.compact, precision, placement.angle)
+                svg.footer(out)
+                out.flush()
+
+            area = sum(areas[id(placement.piece)] for placement in placements)
+            sys.stderr.write("%s: %d pieces, %.0f%% of the sheet.\n" % (
+                filename, len(placements), area*100/(width*height)))
+
+    instrument.record("nest", sheets=len(sheets), pieces=len(pieces), unplaced=len(unplaced))
+    for piece in unplaced:
+        sys.stderr.write("Piece %s doesn't fit on a sheet.\n" % names[id(piece)])
+
+# Writes the cuts of the placements (see nest.Placement) in the order from
+# toolpath.py, each in its own group named after its piece.
+def write_ordered(out, placements, names, compact, precision):
+    with instrument.stage("toolpath"):
+        cuts = toolpath.cuts(placements)
+        before = toolpath.travel(placements, cuts)
+        cuts = toolpath.order(placements, cuts)
+        after = toolpath.travel(placements, cuts)
+    sys.stderr.write("Rapid travel is %.1f inches, %.1f before ordering.\n" % (after/DPI, before/DPI))
+    instrument.record("toolpath", cuts=len(cuts), before=before/DPI, after=after/DPI)
+
+    for cut in cuts:
+        placement = placements[cut.item]
+        svg.start_group(out, "%s%s_%d" % (names[cut.item], cut.suffix, cut.index),
+                placement.x, placement.y, placement.angle)
+        shape = cut.shape
+        if not isinstance(shape, toolpath.Circle):
+            shape = toolpath.rotate_ring(shape, cut.start)
+        write_shape(out, shape, compact, precision)
         svg.end_group(out)
 
-        if "hole_radius" in piece:
-            svg.start_group(out, name + "_hole")
-            svg.circle(out, 0, 0, piece["hole_radius"], color)
-            svg.end_group(out)
-        if "bind" in piece:
-            bind = piece["bind"]
-            bind_radius = bind["hole_radius"]
-            svg.start_group(out, name + "_bind")
-            for center in bind["centers"]:
-                svg.circle(out, center[0], center[1], bind_radius, color)
-            svg.end_group(out)
-        if "holes" in piece:
-            # Also cut holes from all the axles.
-            svg.start_group(out, name + "_holes")
-            for hole in piece["holes"]:
-                svg.circle(out, hole["cx"], hole["cy"], hole["r"], color)
+# Writes the cuts of a piece as a group named "name" at (cx, cy), turned
+# "angle" degrees clockwise. In compact mode all the parts of a piece go into
+# its one group.
+def write_piece(out, piece, name, cx, cy, compact, precision, angle=0):
+    svg.start_group(out, name, cx, cy, angle)
+    for suffix, shapes in toolpath.parts(piece):
+        if not compact:
+            svg.start_group(out, name + suffix)
+        for shape in shapes:
+            write_shape(out, shape, compact, precision)
+        if not compact:
             svg.end_group(out)
-
-        svg.end_group(out)
-
-    svg.footer(out)
+    svg.end_group(out)
+
+# Writes an outline (points) or a toolpath.Circle.
+def write_shape(out, shape, compact, precision):
+    # Always use black for cut, it makes it easier to see in AI.
+    color = "black"
+
+    if isinstance(shape, toolpath.Circle):
+        svg.circle(out, shape.x, shape.y, shape.r, color, precision)
+    elif compact:
+        svg.path(out, shape, color, precision)
+    else:
+        svg.polyline(out, shape, color, precision)
 
 if __name__ == "__main__":
     main()
@@ -15,8 +15,15 @@
 
 import argparse, math
 
-from config import TAU
+import numpy as np
+
+from config import DPI, TAU
 from vector import Vector
+from points import PointBuffer
+
+# Smallest parameter step when flattening a Bezier curve, so that degenerate
+# curves can't recurse forever.
+MIN_BEZIER_STEP = 1.0/4096
 
 # Draw shapes into array of points.
 
@@ -26,30 +33,107 @@ def add_arc(p, begin_deg, end_deg, radius):
         rad = deg*DEG_TO_RAD
         p.append(Vector(cos(rad), sin(rad))*radius)
 
-# Specify four points.
-def add_bezier(p, p1, p2, p3, p4, point_count):
-    for i in range(point_count):
-        t = float(i) / (point_count - 1)
-
-        # Interpolate the primary segments.
-        pp1 = p1 + (p2 - p1)*t
-        pp2 = p2 + (p3 - p2)*t
-        pp3 = p3 + (p4 - p3)*t
-
-        # Interpolate the secondary segments.
-        ppp1 = pp1 + (pp2 - pp1)*t
-        ppp2 = pp2 + (pp3 - pp2)*t
-
-        # Interpolate the tertiary segments.
-        pppp1 = ppp1 + (ppp2 - ppp1)*t
-
-        p.append(pppp1)
+# Curve tolerance of the config (see config.CURVE_TOLERANCE) in points, or
+# None to use the caller's fixed point count.
+def config_tolerance(config):
+    if config.curve_tolerance is None:
+        return None
+    return config.curve_tolerance*DPI
+
+# Number of segments needed for an arc of "angle" radians so that the chords
+# stay within "tolerance" of the circle.
+def arc_segment_count(radius, angle, tolerance):
+    if tolerance >= radius:
+        return 1
+    step = 2*math.acos(1 - tolerance/float(radius))
+    return max(1, int(math.ceil(abs(angle)/step)))
+
+# Evaluate the Bezier curve with control points p1 to p4 (Vectors) at each
+# parameter in the array "t", using the same interpolations as de Casteljau.
+# Returns an (N, 2) array.
+def bezier_points(p1, p2, p3, p4, t):
+    t = np.asarray(t, dtype=float)[:, np.newaxis]
+    p1, p2, p3, p4 = [np.array([p.x, p.y]) for p in (p1, p2, p3, p4)]
+
+    # Interpolate the primary segments.
+    pp1 = p1 + (p2 - p1)*t
+    pp2 = p2 + (p3 - p2)*t
+    pp3 = p3 + (p4 - p3)*t
+
+    # Interpolate the secondary segments.
+    ppp1 = pp1 + (pp2 - pp1)*t
+    ppp2 = pp2 + (pp3 - pp2)*t
+
+    # Interpolate the tertiary segments.
+    return ppp1 + (ppp2 - ppp1)*t
+
+# Parameters at which to sample the Bezier curve so that it's within
+# "tolerance" of the chords. Recursively splits the curve in half with de
+# Casteljau's algorithm until both inner control points are within the
+# tolerance of the line between the end points.
+def bezier_parameters(p1, p2, p3, p4, tolerance):
+    params = [0.0]
+
+    # Stack of (t0, t1, control points), leftmost on top.
+    stack = [(0.0, 1.0, (p1, p2, p3, p4))]
+    while stack:
+        t0, t1, (q1, q2, q3, q4) = stack.pop()
+        if is_flat(q1, q2, q3, q4, tolerance) or t1 - t0 < MIN_BEZIER_STEP:
+            params.append(t1)
+        else:
+            q12 = (q1 + q2)*0.5
+            q23 = (q2 + q3)*0.5
+            q34 = (q3 + q4)*0.5
+            q123 = (q12 + q23)*0.5
+            q234 = (q23 + q34)*0.5
+            middle = (q123 + q234)*0.5
+            tm = (t0 + t1)/2
+            stack.append((tm, t1, (middle, q234, q34, q4)))
+            stack.append((t0, tm, (q1, q12, q123, middle)))
+
+    return params
+
+# Whether the curve is within "tolerance" of the segment from q1 to q4. The
+# curve is inside the hull of its control points, so it's enough to check
+# the two inner ones.
+def is_flat(q1, q2, q3, q4, tolerance):
+    return max(line_distance(q2, q1, q4), line_distance(q3, q1, q4)) <= tolerance
+
+# Distance from "p" to the segment from "a" to "b".
+def line_distance(p, a, b):
+    ab = b - a
+    length2 = ab.x**2 + ab.y**2
+    if length2 == 0:
+        return (p - a).length()
+    t = min(1.0, max(0.0, ((p.x - a.x)*ab.x + (p.y - a.y)*ab.y)/length2))
+    return (p - (a + ab*t)).length()
+
+# Specify four points. Appends Vectors to "p". If "tolerance" (in points,
+# see config_tolerance()) is not None, uses as many points as needed to stay
+# within that distance of the curve instead of "point_count".
+def add_bezier(p, p1, p2, p3, p4, point_count, tolerance=None):
+    if tolerance is None:
+        t = np.arange(point_count, dtype=float)/(point_count - 1)
+    else:
+        t = bezier_parameters(p1, p2, p3, p4, tolerance)
+
+    p.extend(Vector(x, y) for x, y in bezier_points(p1, p2, p3, p4, t).tolist())
 
 # Generate a new sequence of points with the corners rounded to "radius". Do
-# not close the original path. Points must be in (x,y) tuple format.
-def round_corners(P, radius, point_count):
+# not close the original path. Points must be Vectors. Returns a PointBuffer.
+# As with add_bezier(), a tolerance overrides "point_count", the number of
+# points inside each quarter circle.
+def round_corners(P, radius, point_count, tolerance=None):
+    if tolerance is not None:
+        point_count = arc_segment_count(radius, TAU/4, tolerance) - 1
+
     newP = []
 
+    # Quarter circle angles.
+    t = (np.arange(point_count) + 1.0)/(point_count + 1)*TAU/4
+    sin_t = np.sin(t)
+    cos_t = np.cos(t)
+
     # For each point in P (which is open), draw a line from P to the next point,
     # and the following quarter circle.
     for i in range(len(P)):
@@ -65,16 +149,17 @@ def round_corners(P, radius, point_count):
         dp1 = (p2 - p1).normalized()
 
         # Straight line.
-        newP.append(p0 + dp0*radius)
-        newP.append(p1 - dp0*radius)
+        start = p0 + dp0*radius
+        end = p1 - dp0*radius
+        newP.append((start.x, start.y))
+        newP.append((end.x, end.y))
 
         # Quarter circle.
         c = p1 - dp0*radius + dp1*radius
-        for j in range(point_count):
-            t = (j + 1.0)/(point_count + 1)*TAU/4
-            newP.append(c + (dp0*math.sin(t) - dp1*math.cos(t))*radius)
+        newP.extend(zip(c.x + (dp0.x*sin_t - dp1.x*cos_t)*radius,
+                        c.y + (dp0.y*sin_t - dp1.y*cos_t)*radius))
 
     # Close path.
     newP.append(newP[0])
 
-    return newP
+    return PointBuffer(newP)
@@ -0,0 +1,271 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Period of the pendulum and how well the clock keeps time. The verge and
+# the pendulum pieces swing together around the verge's axle as a compound
+# pendulum. Their mass properties come from the piece outlines (minus the
+# holes), all cut from the same acrylic. The swing is integrated with RK4
+# without the small-angle approximation, for a whole batch of variations at
+# once:
+#
+#     weight shift    how far the weight plates are moved down the bar
+#     weight plates   how many weight plates are bolted on
+#     amplitude       half the swing, in degrees
+#
+# The escapement wheel lets one tooth go per swing (there and back), so the
+# pendulum must take SECONDS_PER_TURN/(|speed|*esc_tooth_count) seconds per
+# swing. Any difference is reported as seconds gained per day. Run with the
+# output of clock.py:
+#
+#     python dynamics.py clock.json
+
+import sys
+import json
+import math
+import argparse
+
+import numpy as np
+
+from config import DPI, DEFAULT_CONFIG
+from kinematics import SECONDS_PER_TURN
+import packed
+
+# Meters per point.
+METERS = 0.0254/DPI
+
+# Standard gravity, in m/s^2.
+GRAVITY = 9.80665
+
+SECONDS_PER_DAY = 86400
+
+# RK4 steps per quarter swing.
+STEPS = 1000
+
+# Default ranges of the batch.
+SHIFTS = np.linspace(-6, 18, 241)
+PLATES = np.arange(0, 9)
+AMPLITUDES = [1.0, 2.0, 4.0, 8.0]
+
+# Area, first moments and polar second moment about the origin of a
+# polygon, as an array (A, Sx, Sy, J). The sign depends on the winding, so
+# the result is flipped to have a positive area.
+def polygon_moments(points):
+    p = np.asarray(points, dtype=float).reshape(-1, 2)
+    x0 = p[:, 0]
+    y0 = p[:, 1]
+    x1 = np.roll(x0, -1)
+    y1 = np.roll(y0, -1)
+    cross = x0*y1 - x1*y0
+    area = cross.sum()/2
+    sx = ((x0 + x1)*cross).sum()/6
+    sy = ((y0 + y1)*cross).sum()/6
+    j = ((x0*x0 + x0*x1 + x1*x1 + y0*y0 + y0*y1 + y1*y1)*cross).sum()/12
+    moments = np.array([area, sx, sy, j])
+    return -moments if area < 0 else moments
+
+def circle_moments(cx, cy, r):
+    area = math.pi*r*r
+    return np.array([area, area*cx, area*cy, area*(r*r/2 + cx*cx + cy*cy)])
+
+# Moments (see polygon_moments()) of a piece's outline minus its holes, in
+# meters, about the piece's center.
+def piece_moments(piece):
+    moments = polygon_moments(piece["points"])
+    if "hole_radius" in piece:
+        moments -= circle_moments(0, 0, piece["hole_radius"])
+    for hole in piece.get("holes", []):
+        moments -= circle_moments(hole["cx"], hole["cy"], hole["r"])
+    if "bind" in piece:
+        for center in piece["bind"]["centers"]:
+            moments -= circle_moments(center[0], center[1], piece["bind"]["hole_radius"])
+    return moments*np.array([METERS**2, METERS**3, METERS**3, METERS**4])
+
+# Moments about a point that's (dx, dy) meters from the one they're about,
+# by the parallel axis theorem.
+def translate_moments(moments, dx, dy):
+    area, sx, sy, j = moments
+    return np.array([area, sx + area*dx, sy + area*dy,
+        j + 2*(dx*sx + dy*sy) + area*(dx*dx + dy*dy)])
+
+# Moments of a piece about the pivot at (pivot_x, pivot_y), in points.
+def pivot_moments(piece, pivot_x, pivot_y):
+    return translate_moments(piece_moments(piece),
+            (piece["cx"] - pivot_x)*METERS, (piece["cy"] - pivot_y)*METERS)
+
+# The verge's axle, which everything swings around.
+def pivot(data):
+    for piece in data["pieces"]:
+        if piece["type"] == "verge":
+            return piece["cx"], piece["cy"]
+    raise ValueError("no verge")
+
+# Weight plates are the pendulum pieces wider than the bar.
+def is_weight(piece, config=DEFAULT_CONFIG):
+    p = np.asarray(piece["points"], dtype=float).reshape(-1, 2)
+    return p[:, 0].max() - p[:, 0].min() > config.pendulum_bar_width*1.01
+
+# Returns the moments about the pivot of the swinging pieces other than the
+# weight plates, the moments of one weight plate, and the number of plates.
+def pendulum_moments(data, config=DEFAULT_CONFIG):
+    pivot_x, pivot_y = pivot(data)
+    fixed = np.zeros(4)
+    weight = None
+    plates = 0
+    for piece in data["pieces"]:
+        if piece["type"] == "verge" or (piece["type"] == "pendulum" and not is_weight(piece, config)):
+            fixed += pivot_moments(piece, pivot_x, pivot_y)
+        elif piece["type"] == "pendulum":
+            weight = pivot_moments(piece, pivot_x, pivot_y)
+            plates += 1
+    if weight is None:
+        weight = np.zeros(4)
+    return fixed, weight, plates
+
+# Swing period required by the escapement, in seconds.
+def required_period(data, config=DEFAULT_CONFIG):
+    for piece in data["pieces"]:
+        if piece["type"] == "escapement_wheel":
+            return SECONDS_PER_TURN/(abs(piece["speed"])*config.esc_tooth_count)
+    raise ValueError("no escapement wheel")
+
+# Square of the small-angle angular frequency for each combination, with
+# the weight plates moved down by "shifts" meters.
+def omega_squared(fixed, weight, shifts, plates):
+    area, sx, sy, j = weight
+    shifted_sx = sx
+    shifted_sy = sy + area*shifts
+    shifted_j = j + 2*shifts*sy + area*shifts*shifts
+    total_sx = fixed[1] + plates*shifted_sx
+    total_sy = fixed[2] + plates*shifted_sy
+    total_j = fixed[3] + plates*shifted_j
+    # Density and thickness cancel out.
+    return GRAVITY*np.hypot(total_sx, total_sy)/total_j
+
+# Period of a pendulum with theta'' = -omega2*sin(theta) swinging from
+# +amplitude (radians), for arrays of omega2 and amplitude. Integrates a
+# quarter swing with RK4 and finds where theta crosses zero.
+def period(omega2, amplitude):
+    omega2, amplitude = np.broadcast_arrays(np.asarray(omega2, dtype=float),
+            np.asarray(amplitude, dtype=float))
+    dt = math.pi/2/np.sqrt(omega2)/STEPS
+    theta = amplitude.copy()
+    velocity = np.zeros_like(theta)
+    quarter = np.full(theta.shape, np.nan)
+    active = np.ones(theta.shape, dtype=bool)
+
+    def acceleration(theta):
+        return -omega2*np.sin(theta)
+
+    step = 0
+    while active.any():
+        k1v = acceleration(theta)
+        k1x = velocity
+        k2v = acceleration(theta + dt/2*k1x)
+        k2x = velocity + dt/2*k1v
+        k3v = acceleration(theta + dt/2*k2x)
+        k3x = velocity + dt/2*k2v
+        k4v = acceleration(theta + dt*k3x)
+        k4x = velocity + dt*k3v
+        new_theta = theta + dt/6*(k1x + 2*k2x + 2*k3x + k4x)
+        velocity = velocity + dt/6*(k1v + 2*k2v + 2*k3v + k4v)
+
+        # Linear interpolation is good here since theta'' is zero at the
+        # crossing.
+        crossed = active & (new_theta <= 0)
+        fraction = theta[crossed]/(theta[crossed] - new_theta[crossed])
+        quarter[crossed] = (step + fraction)*dt[crossed]
+        active &= ~crossed
+
+        theta = new_theta
+        step += 1
+        if step > 4*STEPS:
+            raise ValueError("pendulum doesn't swing back")
+
+    return 4*quarter
+
+# Seconds the clock gains per day with this period.
+def daily_error(period, required):
+    return (required/period - 1)*SECONDS_PER_DAY
+
+# Simulate every combination of the shifts (inches), plate counts and
+# amplitudes (degrees). Returns a list of dicts.
+def sweep(data, shifts, plates, amplitudes, config=DEFAULT_CONFIG):
+    fixed, weight, _ = pendulum_moments(data, config)
+    required = required_period(data, config)
+
+    s, n, a = [x.ravel() for x in np.meshgrid(np.asarray(shifts, dtype=float),
+            np.asarray(plates, dtype=float), np.asarray(amplitudes, dtype=float), indexing="ij")]
+    periods = period(omega_squared(fixed, weight, s*DPI*METERS, n), np.radians(a))
+    errors = daily_error(periods, required)
+
+    results = []
+    for i in range(len(s)):
+        results.append({
+            "weight_shift": float(s[i]),
+            "weight_plates": int(n[i]),
+            "amplitude": float(a[i]),
+            "period": float(periods[i]),
+            "error": float(errors[i]),
+        })
+    return results
+
+# Period and error of the clock as built.
+def simulate(data, config=DEFAULT_CONFIG):
+    fixed, weight, plates = pendulum_moments(data, config)
+    amplitude = 0
+    for piece in data["pieces"]:
+        if piece["type"] == "verge":
+            amplitude = math.radians(abs(piece["left_full_in_angle"] - piece["right_full_in_angle"])/2)
+    required = required_period(data, config)
+    actual = float(period(omega_squared(fixed, weight, 0, plates), amplitude))
+    return required, actual, daily_error(actual, required)
+
+def dump_period(data, out, config=DEFAULT_CONFIG):
+    required, actual, error = simulate(data, config)
+    out.write("Pendulum period is %.4f seconds, needs %.4f (%+.0f seconds per day).\n" % (
+        actual, required, error))
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate the pendulum.')
+    parser.add_argument("input", help="JSON or packed binary filename to read")
+    parser.add_argument("--shifts", type=float, nargs=3, metavar=("MIN", "MAX", "COUNT"),
+            help="range of weight shifts in inches (default: %g %g %d)" % (SHIFTS[0], SHIFTS[-1], len(SHIFTS)))
+    parser.add_argument("--plates", type=int, nargs="+",
+            help="weight plate counts (default: %d to %d)" % (PLATES[0], PLATES[-1]))
+    parser.add_argument("--amplitudes", type=float, nargs="+",
+            help="amplitudes in degrees (default: %s)" % " ".join("%g" % a for a in AMPLITUDES))
+    args = parser.parse_args()
+
+    if packed.is_packed(args.input):
+        data = packed.read(args.input)
+    else:
+        data = json.load(open(args.input))
+
+    shifts = SHIFTS if args.shifts is None else np.linspace(args.shifts[0], args.shifts[1], int(args.shifts[2]))
+    plates = PLATES if args.plates is None else args.plates
+    amplitudes = AMPLITUDES if args.amplitudes is None else args.amplitudes
+
+    dump_period(data, sys.stderr)
+
+    results = sweep(data, shifts, plates, amplitudes)
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write("\n")
+
+    best = min(results, key=lambda result: abs(result["error"]))
+    sys.stderr.write("Simulated %d combinations. Best: %d plates moved %.2f inches at %g degrees (%+.1f seconds per day).\n" % (
+        len(results), best["weight_plates"], best["weight_shift"], best["amplitude"], best["error"]))
+
+if __name__ == "__main__":
+    main()
@@ -14,40 +14,25 @@
 #   limitations under the License.
 
 from math import sin, cos, tan, sqrt, pi, atan, floor, acos
+import time
+
+import numpy as np
 
 from vector import Vector
-from config import DPI, TAU, TIGHT_LARGE_BOLT_RADIUS, PENDULUM_HOLE_SEPARATION, LEFT_FULL_IN_ANGLE, RIGHT_FULL_IN_ANGLE
+from config import DPI, TAU, DEFAULT_CONFIG
 import bind
 import draw
+import instrument
+import jobs
+import lru
+import memo
+from points import PointBuffer
 
 DEG_TO_RAD = pi/180
 RAD_TO_DEG = 1/DEG_TO_RAD
 
-# Escapement wheel parameters.
-ESC_RADIUS = 2*DPI
-ESC_TOOTH_HEIGHT = 0.5*DPI
-ESC_TOOTH_COUNT = 15
-ESC_TOOTH_ANGLE = TAU/ESC_TOOTH_COUNT
-ESC_FILLET_POINT_COUNT = 10
-ESC_CREST_FILLET_RADIUS = 0.04*DPI
-ESC_TROUGH_FILLET_RADIUS = 0.06*DPI
-
-# Offset of verge center from escapement center.
-VERGE_OFFSET = Vector(0, 5*DPI)
-
-# Angle around escapement where the points are.
-VERGE_ANGLE = ESC_TOOTH_ANGLE*5.5
-VERGE_LEFT_ANGLE = TAU/4 + VERGE_ANGLE/2
-VERGE_RIGHT_ANGLE = TAU/4 - VERGE_ANGLE/2
-
-# Distance from center of escapement to points.
-VERGE_POINT_RADIUS = ESC_RADIUS*1.1
-
-# Height of verge tooth.
-VERGE_TOOTH_HEIGHT = 0.5*DPI
-
-# Width of verge tooth.
-VERGE_TOOTH_WIDTH = 1*DPI
+# The shape of the verge below its teeth. The rest of the escapement's
+# parameters are in the config.
 
 # Length of control vectors between the teeth.
 VERGE_CTRL = 1.5*DPI
@@ -60,18 +45,31 @@ VERGE_MIDDLE_CTRL = Vector(1*DPI, -1*DPI)
 VERGE_BOTTOM_OFFSET = Vector(0, 8*DPI)
 VERGE_BOTTOM_CTRL = Vector(1*DPI, 0)
 
-def generate_escapement_wheel(color, center, angle_offset_deg, speed, hole_radius, cz):
+# Size of the escapement wheel as (radius, tooth height, tooth count, fillet
+# point count, crest fillet radius, trough fillet radius).
+def wheel_size(config):
+    return (config.esc_radius, config.esc_tooth_height, config.esc_tooth_count,
+            config.esc_fillet_point_count, config.esc_crest_fillet_radius,
+            config.esc_trough_fillet_radius)
+
+# Single tooth of the escapement wheel of size "wheel" (see wheel_size()),
+# unrotated, as an (N, 2) array.
+def compute_escapement_tooth(wheel):
+    (radius, tooth_height, tooth_count, fillet_point_count, crest_fillet_radius,
+            trough_fillet_radius) = wheel
+    tooth_angle = TAU/tooth_count
+
     # We're making a triangle tooth but with fillets on both the crest and the
     # trough. Throughout this code, variables that end with "c" are for the
     # crest, those that end with "t" are for the trough.
 
     # Radial distance to crest and trough fillet circle centers.
-    rdc = ESC_RADIUS + (ESC_TOOTH_HEIGHT - ESC_CREST_FILLET_RADIUS)/2;
-    rdt = ESC_RADIUS - (ESC_TOOTH_HEIGHT - ESC_TROUGH_FILLET_RADIUS)/2;
+    rdc = radius + (tooth_height - crest_fillet_radius)/2;
+    rdt = radius - (tooth_height - trough_fillet_radius)/2;
 
     # Centers of the crest and trough circles.
     cc = Vector(rdc, 0)
-    ct = Vector(rdt, 0).rotated(ESC_TOOTH_ANGLE/2)
+    ct = Vector(rdt, 0).rotated(tooth_angle/2)
 
     # Now we need to know how much of these circles to draw. We need to draw
     # just enough so that the remaining line segment between them is tangent
@@ -79,7 +77,7 @@ def generate_escapement_wheel(color, center, angle_offset_deg, speed, hole_radiu
     # to determine a line between the center of one circle and an imaginary
     # circle that's centered on the other circle and the sum of the two
     # radii. This pretend circle will have the suffix "p".
-    rp = ESC_CREST_FILLET_RADIUS + ESC_TROUGH_FILLET_RADIUS
+    rp = crest_fillet_radius + trough_fillet_radius
 
     # If our pretend circle is centered on the crest fillet, then we have a
     # triangle with these three points: (1) The center of the trough triangle,
@@ -98,31 +96,49 @@ def generate_escapement_wheel(color, center, angle_offset_deg, speed, hole_radiu
     tooth_points = []
 
     # Fillet for the crest.
-    for i in range(ESC_FILLET_POINT_COUNT):
-        t = float(i)/(ESC_FILLET_POINT_COUNT - 1)
+    for i in range(fillet_point_count):
+        t = float(i)/(fillet_point_count - 1)
         theta = -angle + t*angle*2
-        tooth_points.append(cc + Vector.circle(theta)*ESC_CREST_FILLET_RADIUS)
+        tooth_points.append(cc + Vector.circle(theta)*crest_fillet_radius)
 
     # Fillet for the trough.
-    for i in range(ESC_FILLET_POINT_COUNT):
-        t = float(i)/(ESC_FILLET_POINT_COUNT - 1)
+    for i in range(fillet_point_count):
+        t = float(i)/(fillet_point_count - 1)
         # We have to subtract tooth_angle here because the math above
         # does not take into account that the two circles repeat
         # in a circle.
-        theta = angle - t*(angle*2 - ESC_TOOTH_ANGLE) + pi
-        tooth_points.append(ct + Vector.circle(theta)*ESC_TROUGH_FILLET_RADIUS)
+        theta = angle - t*(angle*2 - tooth_angle) + pi
+        tooth_points.append(ct + Vector.circle(theta)*trough_fillet_radius)
 
-    # Stamp each tooth.
-    p = []
-    for tooth in range(ESC_TOOTH_COUNT):
-        # Transform to tooth position.
-        phi = tooth*ESC_TOOTH_ANGLE + angle_offset_deg*DEG_TO_RAD
+    return np.array([tuple(v) for v in tooth_points])
+
+# Key of the escapement tooth shape in the profile and outline caches.
+def escapement_key(wheel):
+    return ("escapement",) + tuple(wheel)
+
+# Closed outline of the whole wheel, as a read-only (N, 2) array. Cached.
+def escapement_outline(angle_offset_deg, wheel):
+    def compute():
+        tooth_points = lru.PROFILE_CACHE.get(escapement_key(wheel),
+                lambda: compute_escapement_tooth(wheel))
+
+        # Stamp each tooth.
+        tooth_count = wheel[2]
+        phi = np.arange(tooth_count)*TAU/tooth_count + angle_offset_deg*DEG_TO_RAD
+        c = np.cos(phi)[:, np.newaxis]
+        s = np.sin(phi)[:, np.newaxis]
+        x = tooth_points[:, 0]
+        y = tooth_points[:, 1]
+        p = np.column_stack(((x*c - y*s).ravel(), (x*s + y*c).ravel()))
 
-        for v in tooth_points:
-            p.append(v.rotated(phi))
+        # Close curve.
+        return np.vstack((p, p[:1]))
 
-    # Close curve.
-    p.append(p[0])
+    return lru.OUTLINE_CACHE.get(escapement_key(wheel) + (angle_offset_deg,), compute)
+
+@memo.cached
+def generate_escapement_wheel(color, center, angle_offset_deg, speed, hole_radius, cz, wheel):
+    p = PointBuffer(escapement_outline(angle_offset_deg, wheel))
 
     piece = {
         "type": "escapement_wheel",
@@ -136,19 +152,38 @@ def generate_escapement_wheel(color, center, angle_offset_deg, speed, hole_radiu
     }
     return piece
 
-def generate_verge(color, verge_center, esc_center, speed, hole_radius, cz):
-    zero = Vector(VERGE_POINT_RADIUS, 0)
-    left_point = esc_center + zero.rotated(VERGE_LEFT_ANGLE)
-    right_point = esc_center + zero.rotated(VERGE_RIGHT_ANGLE)
-
-    left_base = (left_point - esc_center).normalized()*VERGE_TOOTH_HEIGHT
-    right_base = (right_point - esc_center).normalized()*VERGE_TOOTH_HEIGHT
-
-    left_out = left_point + left_base + left_base.reciprocal().normalized()*VERGE_TOOTH_WIDTH/2
-    left_in = left_point + left_base - left_base.reciprocal().normalized()*VERGE_TOOTH_WIDTH/2
-
-    right_out = right_point + right_base - right_base.reciprocal().normalized()*VERGE_TOOTH_WIDTH/2
-    right_in = right_point + right_base + right_base.reciprocal().normalized()*VERGE_TOOTH_WIDTH/2
+# The fields of the config that the verge uses, so that it's only cached on
+# those, as (escapement wheel radius, escapement tooth count, bolt radius,
+# pendulum hole separation, left angle, right angle, verge teeth, point
+# scale, tooth height, tooth width, curve tolerance in points).
+def verge_params(config):
+    return (config.esc_radius, config.esc_tooth_count, config.tight_large_bolt_radius,
+            config.pendulum_hole_separation, config.left_full_in_angle,
+            config.right_full_in_angle, config.verge_teeth, config.verge_point_scale,
+            config.verge_tooth_height, config.verge_tooth_width,
+            draw.config_tolerance(config))
+
+# "verge" is the verge_params() of the config.
+@memo.cached
+def generate_verge(color, verge_center, esc_center, speed, hole_radius, cz, verge):
+    (esc_radius, esc_tooth_count, bolt_radius, hole_separation, left_full_in_angle,
+            right_full_in_angle, verge_teeth, point_scale, tooth_height, tooth_width,
+            tolerance) = verge
+
+    # Angle around escapement where the points are.
+    verge_angle = TAU/esc_tooth_count*verge_teeth
+    zero = Vector(esc_radius*point_scale, 0)
+    left_point = esc_center + zero.rotated(TAU/4 + verge_angle/2)
+    right_point = esc_center + zero.rotated(TAU/4 - verge_angle/2)
+
+    left_base = (left_point - esc_center).normalized()*tooth_height
+    right_base = (right_point - esc_center).normalized()*tooth_height
+
+    left_out = left_point + left_base + left_base.reciprocal().normalized()*tooth_width/2
+    left_in = left_point + left_base - left_base.reciprocal().normalized()*tooth_width/2
+
+    right_out = right_point + right_base - right_base.reciprocal().normalized()*tooth_width/2
+    right_in = right_point + right_base + right_base.reciprocal().normalized()*tooth_width/2
 
     p = []
 
@@ -160,7 +195,7 @@ def generate_verge(color, verge_center, esc_center, speed, hole_radius, cz):
     # Between teeth.
     left_ctrl = left_in + (left_in - left_point).normalized()*VERGE_CTRL
     right_ctrl = right_in + (right_in - right_point).normalized()*VERGE_CTRL
-    draw.add_bezier(p, left_in, left_ctrl, right_ctrl, right_in, 100)
+    draw.add_bezier(p, left_in, left_ctrl, right_ctrl, right_in, 100, tolerance)
 
     # Right tooth.
     p.append(right_in)
@@ -170,22 +205,23 @@ def generate_verge(color, verge_center, esc_center, speed, hole_radius, cz):
     # Path to right of right tooth.
     ctrl = right_out + (right_out - right_point).normalized()*VERGE_CTRL
     middle = verge_center + VERGE_MIDDLE_OFFSET
-    draw.add_bezier(p, right_out, ctrl, middle + VERGE_MIDDLE_CTRL, middle, 100)
+    draw.add_bezier(p, right_out, ctrl, middle + VERGE_MIDDLE_CTRL, middle, 100, tolerance)
 
     # Path to bottom.
     bottom = verge_center + VERGE_BOTTOM_OFFSET
-    draw.add_bezier(p, middle, middle - VERGE_MIDDLE_CTRL, bottom + VERGE_BOTTOM_CTRL, bottom, 100)
+    draw.add_bezier(p, middle, middle - VERGE_MIDDLE_CTRL, bottom + VERGE_BOTTOM_CTRL, bottom, 100, tolerance)
 
     # Path back from bottom on left.
     middle = verge_center + VERGE_MIDDLE_OFFSET.flipX()
-    draw.add_bezier(p, bottom, bottom - VERGE_BOTTOM_CTRL, middle - VERGE_MIDDLE_CTRL.flipX(), middle, 100)
+    draw.add_bezier(p, bottom, bottom - VERGE_BOTTOM_CTRL, middle - VERGE_MIDDLE_CTRL.flipX(), middle, 100, tolerance)
 
     # Path to the left of left tooth.
     ctrl = left_out + (left_out - left_point).normalized()*VERGE_CTRL
-    draw.add_bezier(p, middle, middle + VERGE_MIDDLE_CTRL.flipX(), ctrl, left_out, 100)
+    draw.add_bezier(p, middle, middle + VERGE_MIDDLE_CTRL.flipX(), ctrl, left_out, 100, tolerance)
 
     # Normalize to our own center.
-    p = [v - verge_center for v in p]
+    p = PointBuffer.from_vectors(p)
+    p.translate(-verge_center.x, -verge_center.y)
 
     # Add holes at the bottom for attaching the pendulum.
     offset = 4.5*DPI
@@ -193,12 +229,12 @@ def generate_verge(color, verge_center, esc_center, speed, hole_radius, cz):
         {
             "cx": 0,
             "cy": offset,
-            "r": TIGHT_LARGE_BOLT_RADIUS,
+            "r": bolt_radius,
         },
         {
             "cx": 0,
-            "cy": PENDULUM_HOLE_SEPARATION*2 + offset,
-            "r": TIGHT_LARGE_BOLT_RADIUS,
+            "cy": hole_separation*2 + offset,
+            "r": bolt_radius,
         },
     ]
 
@@ -211,26 +247,29 @@ def generate_verge(color, verge_center, esc_center, speed, hole_radius, cz):
         "cz": cz,
         "speed": speed,
         "hole_radius": hole_radius,
-        "left_full_in_angle": LEFT_FULL_IN_ANGLE,
-        "right_full_in_angle": RIGHT_FULL_IN_ANGLE,
+        "left_full_in_angle": left_full_in_angle,
+        "right_full_in_angle": right_full_in_angle,
         "holes": holes,
     }
     return piece, offset
 
 # "esc_center" is the center of the escapement wheel.
-def generate(data, esc_center, speed, hole_radius, cz=0):
+def generate(data, esc_center, speed, hole_radius, cz=0, config=DEFAULT_CONFIG):
     # Home.
     escapement_angle_offset = 4.0
 
-    # Escapement wheel.
-    piece = generate_escapement_wheel("#FF6666", esc_center,
-            escapement_angle_offset, speed, hole_radius, cz)
-    bind.add_bind_info(piece)
+    # Escapement wheel, made later by jobs.run().
+    piece = jobs.Deferred(generate_escapement_wheel, "#FF6666", esc_center,
+            escapement_angle_offset, speed, hole_radius, cz, wheel_size(config))
+    bind.add_bind_info(piece, config)
     data["pieces"].append(piece)
 
     # Verge.
-    verge_center = esc_center + VERGE_OFFSET
-    piece, verge_hole_offset = generate_verge("#FF0000", verge_center, esc_center, speed, hole_radius, cz)
+    verge_center = esc_center + Vector(0, config.verge_distance)
+    start = time.perf_counter()
+    piece, verge_hole_offset = generate_verge("#FF0000", verge_center, esc_center, speed,
+            hole_radius, cz, verge_params(config))
     data["pieces"].append(piece)
+    instrument.piece_time(piece, time.perf_counter() - start)
 
     return verge_center, verge_hole_offset
@@ -17,17 +17,20 @@ import sys
 import math
 
 from vector import Vector
-from config import DPI, TAU, TIGHT_LARGE_BOLT_RADIUS, WALL_ANCHOR_RADIUS, WALL_ANCHOR_OFFSET
+from config import DPI, TAU, WALL_ANCHOR_RADIUS, WALL_ANCHOR_OFFSET, DEFAULT_CONFIG
 import draw
+import bounds
+import instrument
 
-PADDING = DPI*1
 CORNER_RADIUS = DPI*0.25
 CORNER_POINTS = 32
-FOOT_WIDTH = PADDING - 2*CORNER_RADIUS
 ADD_FEET = False
 ADD_WALL_ANCHOR_HOLES = False
 
-def generate(data, color):
+# Axles closer than this are the same axle.
+AXLE_TOLERANCE = DPI*0.001
+
+def generate(data, color, config=DEFAULT_CONFIG):
     # Deduce size and position of frame, and its holes, from the existing data.
     minX = DPI*100
     minY = DPI*100
@@ -36,6 +39,7 @@ def generate(data, color):
     floorY = -DPI*100
 
     holes = []
+    axles = bounds.SpatialHash(AXLE_TOLERANCE)
     for piece in data["pieces"]:
         cx = piece["cx"]
         cy = piece["cy"]
@@ -43,31 +47,30 @@ def generate(data, color):
         minY = min(minY, cy)
         maxX = max(maxX, cx)
         maxY = max(maxY, cy)
-        for v in piece["points"]:
-            floorY = max(floorY, cy + v.y)
-        for hole in holes:
-            if hole["cx"] == cx and hole["cy"] == cy:
-                break
-        else:
+        floorY = max(floorY, bounds.box(piece)[3])
+        if axles.find(cx, cy, AXLE_TOLERANCE) is None:
+            axles.add(cx, cy, len(holes))
             holes.append({
                 "cx": cx,
                 "cy": cy,
-                "r": TIGHT_LARGE_BOLT_RADIUS,
+                "r": config.tight_large_bolt_radius,
             })
     # Add hole in lower-left since there are no axles there.
     holes.append({
         "cx": minX,
         "cy": maxY,
-        "r": TIGHT_LARGE_BOLT_RADIUS,
+        "r": config.tight_large_bolt_radius,
     })
     sys.stderr.write("The frame has %d holes.\n" % len(holes))
 
     # Expand margin.
-    minX -= PADDING
-    minY -= PADDING
-    maxX += PADDING
-    maxY += PADDING
-    floorY += PADDING
+    padding = config.frame_padding
+    foot_width = padding - 2*CORNER_RADIUS
+    minX -= padding
+    minY -= padding
+    maxX += padding
+    maxY += padding
+    floorY += padding
 
     # Draw frame.
     P = []
@@ -75,21 +78,22 @@ def generate(data, color):
     P.append(Vector(maxX, minY))
     if ADD_FEET:
         P.append(Vector(maxX, floorY))
-        P.append(Vector(maxX - FOOT_WIDTH, floorY))
-        P.append(Vector(maxX - FOOT_WIDTH, maxY))
-        P.append(Vector(minX + FOOT_WIDTH, maxY))
-        P.append(Vector(minX + FOOT_WIDTH, floorY))
+        P.append(Vector(maxX - foot_width, floorY))
+        P.append(Vector(maxX - foot_width, maxY))
+        P.append(Vector(minX + foot_width, maxY))
+        P.append(Vector(minX + foot_width, floorY))
         P.append(Vector(minX, floorY))
     else:
         P.append(Vector(maxX, maxY))
         P.append(Vector(minX, maxY))
     # Do not close this, the round_corners() function does it.
 
-    P = draw.round_corners(P, CORNER_RADIUS, CORNER_POINTS)
+    P = draw.round_corners(P, CORNER_RADIUS, CORNER_POINTS, draw.config_tolerance(config))
 
     width = (maxX - minX)/DPI
     height = ((floorY if ADD_FEET else maxY) - minY)/DPI
     sys.stderr.write("Frame is %.1fx%.1f inches\n" % (width, height))
+    instrument.record("frame", holes=len(holes), width=width, height=height)
     if width > 24 or height > 18:
         sys.stderr.write("------------------ FRAME TOO LARGE -----------------------\n")
 
@@ -115,23 +119,23 @@ def generate(data, color):
         # XXX Can probably delete this.
         piece["holes"] = holes
         holes.append({
-            "cx": minX + WALL_ANCHOR_OFFSET + PADDING,
-            "cy": minY + PADDING,
+            "cx": minX + WALL_ANCHOR_OFFSET + padding,
+            "cy": minY + padding,
             "r": WALL_ANCHOR_RADIUS,
         })
         holes.append({
-            "cx": maxX - WALL_ANCHOR_OFFSET - PADDING,
-            "cy": minY + PADDING,
+            "cx": maxX - WALL_ANCHOR_OFFSET - padding,
+            "cy": minY + padding,
             "r": WALL_ANCHOR_RADIUS,
         })
         holes.append({
-            "cx": minX + WALL_ANCHOR_OFFSET + PADDING,
-            "cy": maxY - PADDING,
+            "cx": minX + WALL_ANCHOR_OFFSET + padding,
+            "cy": maxY - padding,
             "r": WALL_ANCHOR_RADIUS,
         })
         holes.append({
-            "cx": maxX - WALL_ANCHOR_OFFSET - PADDING,
-            "cy": maxY - PADDING,
+            "cx": maxX - WALL_ANCHOR_OFFSET - padding,
+            "cy": maxY - padding,
             "r": WALL_ANCHOR_RADIUS,
         })
 
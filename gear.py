@@ -14,10 +14,31 @@
 #   limitations under the License.
 
 import sys
-from math import sin, cos, tan, sqrt, pi, atan
+from math import sin, cos, tan, sqrt, pi, atan, ceil
 
-from config import NUM_POINTS_ROOT, NUM_POINTS_FILLET, NUM_POINTS_FLANK, NUM_POINTS_TOP
-from vector import Vector
+import numpy as np
+
+from config import DPI, NUM_POINTS_ROOT, NUM_POINTS_FILLET, NUM_POINTS_FLANK, NUM_POINTS_TOP, GEAR_MAX_ERROR
+import lru
+import memo
+from points import PointBuffer
+
+# Pressure angle.
+ALPHA = 20 * (pi / 180)
+
+# Default number of points on the root, fillet, flank and top of each half
+# tooth.
+NUM_POINTS = (NUM_POINTS_ROOT, NUM_POINTS_FILLET, NUM_POINTS_FLANK, NUM_POINTS_TOP)
+
+# Height of the teeth above the pitch circle, for a module of 1.
+ADDENDUM = 1
+
+# For adaptive sampling: number of points used to integrate the sample
+# density, number of points within each chord to measure the error, and a
+# limit on the number of chords per part of the tooth.
+DENSE_SAMPLES = 256
+SUBSAMPLES = 8
+MAX_ADAPTIVE_SEGMENTS = 1000
 
 def inv(a):
     return tan(a) - a
@@ -31,11 +52,32 @@ def cot(a):
 def sec(a):
     return 1/cos(a)
 
-def generate(cx, cy, z, hole_radius, angle_offset, color, module):
+# Copy a single tooth (in units of module, pointing up) to all "z" positions
+# around the gear with one broadcast rotation. Returns an (N, 2) array in
+# SVG coordinates (Y down).
+def stamp(p, z, angle_offset, module):
+    phi = -2*(np.arange(z)*pi + angle_offset)/z
+    c = np.cos(phi)[:, np.newaxis]
+    s = np.sin(phi)[:, np.newaxis]
+    x = p[:, 0]
+    y = p[:, 1]
+
+    P = np.empty((z, len(p), 2))
+    P[:, :, 0] = (x*c - y*s)*module
+    P[:, :, 1] = -(x*s + y*c)*module
+
+    return P.reshape(-1, 2)
+
+# Single tooth for a module of 1, pointing up (Y up), as an (N, 2) array.
+# If "max_error" is None, uses "num_points" (root, fillet, flank, top) for
+# the number of points on each part of the tooth, otherwise picks the number
+# of points to keep the chordal error below "max_error". Returns the points
+# and the largest chordal error.
+def compute_tooth_profile(z, max_error=None, num_points=NUM_POINTS):
     # Basic ratio.
-    alpha = 20 * (pi / 180)
+    alpha = ALPHA
     h = pi / 4
-    a = 1
+    a = ADDENDUM
     b = 1.25
     e = 0.38
 
@@ -63,7 +105,7 @@ def generate(cx, cy, z, hole_radius, angle_offset, color, module):
         s_lo = b - R*(sin(alpha)**2) - e*(1 - sin(alpha))
         s_hi = (R*(psi_max - atan(psi_max) - inv(alpha)) - h) * cot(alpha)
         psi_max = sqrt((r_a / R0)**2 - 1)
-        print s_lo, s, s_hi
+        sys.stderr.write("%g %g %g\n" % (s_lo, s, s_hi))
 
     # Assume s between s_lo and s_hi.
     psi_min = tan(alpha) + (s + e*(1 - sin(alpha)) - b) / (R0 * sin(alpha)) # XXX sin in denum?
@@ -82,67 +124,166 @@ def generate(cx, cy, z, hole_radius, angle_offset, color, module):
         sys.stderr.write("Range of top: %g %g\n" % (psi_max, 0.0))
         sys.stderr.write("Gamma: %g\n" % (gamma,))
 
+    # The tooth is made of four curves. For each we have a function that
+    # evaluates it over an array of parameters, the range of parameters, the
+    # fixed number of points, and functions giving the speed (ds/dt) and
+    # curvature for adaptive sampling. The involute has a cusp at the base
+    # circle (psi = 0), which small gears dip below, so adaptive sampling
+    # always puts a point there.
+
+    # Root, a circle at the dedendum.
+    def root(theta):
+        x = np.sin(theta)*r_b
+        y = np.cos(theta)*r_b
+        return np.column_stack((x, y))
+
+    # Fillet, traced by the rounded corner of the rack. It's the curve at
+    # distance "e" from the trochoid traced by the center of the corner.
+    def fillet(phi):
+        Lambda = 1 + e/np.sqrt((R*phi + u_c)**2 + (s + v_c)**2)
+        X = Lambda*(R*phi + u_c)
+        Y = R + Lambda*(s + v_c)
+        x = X*np.cos(phi) - Y*np.sin(phi)
+        y = X*np.sin(phi) + Y*np.cos(phi)
+        return np.column_stack((-x, y))
+
+    # Curvature of the trochoid. Its speed is "rho".
+    def trochoid_curvature(phi):
+        A = R*phi + u_c
+        B = s + v_c
+        rho = np.sqrt(A**2 + B**2)
+        return (rho**2 - B*R)/rho**3, rho
+
+    def fillet_speed(phi):
+        k, rho = trochoid_curvature(phi)
+        return np.abs(1 + e*k)*rho
+
+    def fillet_curvature(phi):
+        k, rho = trochoid_curvature(phi)
+        return np.abs(k/(1 + e*k))
+
+    # Flank, the involute of the base circle.
+    def flank(psi):
+        r = R0*np.sqrt(1 + psi**2)
+        theta = gamma + np.arctan(psi) - psi
+        x = np.sin(theta)*r
+        y = np.cos(theta)*r
+        return np.column_stack((-x, y))
+
+    # Top, a circle at the addendum.
+    def top(theta):
+        x = np.sin(theta)*r_a
+        y = np.cos(theta)*r_a
+        return np.column_stack((x, y))
+
+    num_root, num_fillet, num_flank, num_top = num_points
+    segments = [
+        (root, tooth_begin, phi_max, num_root,
+            lambda theta: np.full_like(theta, r_b),
+            lambda theta: np.full_like(theta, 1/r_b)),
+        (fillet, phi_max, phi_min, num_fillet,
+            fillet_speed, fillet_curvature),
+        (flank, psi_min, psi_max, num_flank,
+            lambda psi: R0*np.abs(psi),
+            lambda psi: 1/np.maximum(R0*np.abs(psi), 1e-12)),
+        (top, -(gamma + involute(psi_max)), 0.0, num_top,
+            lambda theta: np.full_like(theta, r_a),
+            lambda theta: np.full_like(theta, 1/r_a)),
+    ]
+
     # Single tooth.
     p = []
-
-    # Root.
-    if True:
-        theta_begin = tooth_begin
-        theta_end = phi_max
-        for i in range(NUM_POINTS_ROOT):
-            theta = theta_begin + (theta_end - theta_begin)*i/(NUM_POINTS_ROOT - 1)
-            x = sin(theta)*r_b
-            y = cos(theta)*r_b
-            p.append( (x, y) )
-
-    # Fillet.
-    if True:
-        phi_begin = phi_max
-        phi_end = phi_min
-        for i in range(NUM_POINTS_FILLET):
-            phi = phi_begin + (phi_end - phi_begin)*i/(NUM_POINTS_FILLET - 1)
-            Lambda = 1 + e/sqrt((R*phi + u_c)**2 + (s + v_c)**2)
-            X = Lambda*(R*phi + u_c)
-            Y = R + Lambda*(s + v_c)
-            x = X*cos(phi) - Y*sin(phi)
-            y = X*sin(phi) + Y*cos(phi)
-            p.append( (-x, y) )
-
-    # Flank.
-    if True:
-        psi_begin = psi_min
-        psi_end = psi_max
-        for i in range(NUM_POINTS_FLANK):
-            psi = psi_begin + (psi_end - psi_begin)*i/(NUM_POINTS_FLANK - 1)
-            r = R0*sqrt(1 + psi**2)
-            theta = gamma + involute(psi)
-            x = sin(theta)*r
-            y = cos(theta)*r
-            p.append( (-x, y) )
-
-    # Top.
-    if True:
-        theta_begin = -(gamma + involute(psi_max))
-        theta_end = 0.0
-        for i in range(NUM_POINTS_TOP):
-            theta = theta_begin + (theta_end - theta_begin)*i/(NUM_POINTS_TOP - 1)
-            x = sin(theta)*r_a
-            y = cos(theta)*r_a
-            p.append( (x, y) )
+    error = 0.0
+    for evaluate, begin, end, count, speed, curvature in segments:
+        if max_error is None:
+            t = np.linspace(begin, end, count)
+        elif evaluate is flank and psi_min < 0 < psi_max:
+            t = np.concatenate((
+                adaptive_parameters(evaluate, begin, 0.0, speed, curvature, max_error)[:-1],
+                adaptive_parameters(evaluate, 0.0, end, speed, curvature, max_error)))
+        else:
+            t = adaptive_parameters(evaluate, begin, end, speed, curvature, max_error)
+        p.append(evaluate(t))
+        error = max(error, chordal_error(evaluate, t))
 
     # Mirror the tooth.
-    mirror_p = [(-x,y) for x,y in p]
-    p.extend(reversed(mirror_p))
+    p = np.concatenate(p)
+    p = np.concatenate((p, p[::-1]*(-1.0, 1.0)))
+
+    return p, error
+
+# Largest distance between the curve and the chords between consecutive
+# parameters "t", measured at SUBSAMPLES points within each chord.
+def chordal_error(evaluate, t):
+    if len(t) < 2:
+        return 0.0
+    f = np.arange(1, SUBSAMPLES)/float(SUBSAMPLES)
+    sub_t = t[:-1, np.newaxis] + (t[1:] - t[:-1])[:, np.newaxis]*f
+    curve = evaluate(sub_t.ravel()).reshape(len(t) - 1, len(f), 2)
+
+    a = evaluate(t)
+    ab = (a[1:] - a[:-1])[:, np.newaxis, :]
+    ap = curve - a[:-1, np.newaxis, :]
+    length2 = np.maximum(np.sum(ab**2, axis=2), 1e-300)
+    u = np.clip(np.sum(ap*ab, axis=2)/length2, 0, 1)
+    d = ap - u[:, :, np.newaxis]*ab
+
+    return float(np.sqrt(np.sum(d**2, axis=2)).max())
+
+# Parameters between "begin" and "end" such that the chords stay within
+# "max_error" of the curve, with as few points as possible. A chord of
+# length L on a curve of curvature k deviates from it by about k*L^2/8, so
+# the points are spaced evenly in the integral of sqrt(k/(8*max_error)) over
+# arc length. The count is then raised until the measured error is in bounds.
+def adaptive_parameters(evaluate, begin, end, speed, curvature, max_error):
+    t = np.linspace(begin, end, DENSE_SAMPLES)
+    g = speed(t)*np.sqrt(curvature(t)/(8*max_error))
+    G = np.concatenate(([0.0], np.cumsum((g[1:] + g[:-1])/2*np.abs(np.diff(t)))))
+
+    if G[-1] <= 0:
+        return np.array([begin, end], dtype=float)
+
+    n = max(1, int(ceil(G[-1])))
+    while True:
+        params = np.interp(np.linspace(0, G[-1], n + 1), G, t)
+        if n >= MAX_ADAPTIVE_SEGMENTS or chordal_error(evaluate, params) <= max_error:
+            return params
+        n = int(ceil(n*1.25))
+
+# Cached version of compute_tooth_profile(). The profile only depends on the
+# tooth count and the sampling settings. Returns the profile and its
+# maximum chordal error, both for a module of 1.
+def tooth_profile(z, max_error=None, num_points=NUM_POINTS):
+    key = (z, sampling_key(max_error, num_points))
+    return lru.PROFILE_CACHE.get(key, lambda: compute_tooth_profile(z, max_error, num_points))
+
+# All teeth of the gear for a module of 1, in SVG coordinates. Cached.
+def outline(z, angle_offset, max_error=None, num_points=NUM_POINTS):
+    key = ("gear", z, sampling_key(max_error, num_points), angle_offset)
+    return lru.OUTLINE_CACHE.get(key,
+            lambda: stamp(tooth_profile(z, max_error, num_points)[0], z, angle_offset, 1.0))
+
+def sampling_key(max_error, num_points=NUM_POINTS):
+    if max_error is None:
+        return tuple(num_points)
+    return ("adaptive", max_error)
+
+# If "max_error" (in inches) is specified, the number of points on each part
+# of the tooth is picked to stay within that distance of the true curve, and
+# the piece gets a "max_error" key with the error actually achieved.
+# Otherwise "num_points" are used (see compute_tooth_profile()).
+@memo.cached
+def generate(cx, cy, z, hole_radius, angle_offset, color, module, max_error=GEAR_MAX_ERROR,
+        num_points=NUM_POINTS):
+    # Standard pitch radius and base circle radius.
+    R = z/2.0
+    R0 = R*cos(ALPHA)
 
-    # Draw each tooth.
-    P = []
-    for tooth in range(z):
-        # Transform to tooth position.
-        phi = -2*(tooth*pi + angle_offset)/z
+    # Profiles are computed for a module of 1.
+    if max_error is not None:
+        max_error = max_error*DPI/module
 
-        for x, y in p:
-            P.append(Vector((x*cos(phi) - y*sin(phi))*module,
-                           -(x*sin(phi) + y*cos(phi))*module))
+    P = PointBuffer(outline(z, angle_offset, max_error, num_points)*module)
 
     piece = {
         "cx": cx,
@@ -152,6 +293,9 @@ def generate(cx, cy, z, hole_radius, angle_offset, color, module):
         "points": P,
         "touch_radius": R*module,
         "base_radius": R0*module,
+        "outer_radius": (R + ADDENDUM)*module,
         "hole_radius": hole_radius,
     }
+    if max_error is not None:
+        piece["max_error"] = tooth_profile(z, max_error, num_points)[1]*module/DPI
     return piece
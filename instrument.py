@@ -0,0 +1,230 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Profiling of clock.py and cut.py. When enabled, writes one JSON object per
+# line to a file:
+#
+#     {"event": "run", ...}       program, arguments and start time
+#     {"event": "stage", ...}     wall time and net change in allocated memory
+#                                 blocks of a stage, and with tracemalloc its
+#                                 allocations, memory and peak
+#     {"event": "piece", ...}     vertex count and generation time of a piece
+#     {"event": "allocation", ...} top allocation sites (with tracemalloc)
+#     {"event": "summary", ...}   totals
+#
+# The stages of clock.py are "layout" (placing the gear train, separators
+# and escapement, and making the verge), "tessellation" (the outlines of the
+# gears, separators and escapement wheel, in parallel), "mesh check",
+# "frame", "pendulum", "dynamics", "animation", "simplify", "levels" and
+# "serialization". The gear train, separators and escapement don't have
+# stages of their own because their outlines are made together by a pool
+# of workers; their generation time is in their "piece" events and in
+# "piece_time_by_type" of the summary. The allocations of worker processes
+# aren't traced. Those of cut.py are "load",
+# "simplify", "nest", "toolpath" and "svg" (the SVG emission).
+#
+# Other modules can add their own events with record(). Everything here does
+# nothing until enable() is called.
+
+import sys
+import json
+import time
+import cProfile
+import contextlib
+import collections
+import tracemalloc
+
+# Number of allocation sites to report with tracemalloc.
+TOP_ALLOCATIONS = 20
+
+# Leave out the snapshots' own memory.
+SNAPSHOT_FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__)]
+
+class Profiler:
+    def __init__(self, out, program, trace_memory=False):
+        self.out = out
+        self.program = program
+        self.trace_memory = trace_memory
+        self.start_time = time.perf_counter()
+        self.stages = []
+        # Generation time of pieces, by id().
+        self.piece_times = {}
+
+        # Only stop tracing if we started it, since the caller (such as
+        # bench.py) may be tracing too.
+        self.started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    def record(self, event, **fields):
+        fields["event"] = event
+        fields["program"] = self.program
+        self.out.write(json.dumps(fields, sort_keys=True) + "\n")
+        self.out.flush()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        parent = self.stages[-1] if self.stages else None
+        self.stages.append(name)
+        if self.trace_memory:
+            snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+            memory, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            fields = {
+                "name": name,
+                "time": time.perf_counter() - start,
+                "net_blocks": sys.getallocatedblocks() - blocks,
+            }
+            if parent is not None:
+                fields["parent"] = parent
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                fields["memory"] = current - memory
+                fields["peak"] = peak - memory
+                fields["allocations"], fields["allocated"] = allocations(snapshot)
+            self.stages.pop()
+            self.record("stage", **fields)
+
+    def piece_time(self, piece, seconds):
+        self.piece_times[id(piece)] = seconds
+
+    # One event per piece, and totals by type.
+    def record_pieces(self, pieces):
+        vertices_by_type = collections.defaultdict(int)
+        time_by_type = collections.defaultdict(float)
+        for index, piece in enumerate(pieces):
+            vertices = len(piece["points"])
+            seconds = self.piece_times.get(id(piece))
+            self.record("piece", index=index, type=piece["type"], cz=piece["cz"],
+                    vertices=vertices, time=seconds)
+            vertices_by_type[piece["type"]] += vertices
+            if seconds is not None:
+                time_by_type[piece["type"]] += seconds
+        return vertices_by_type, time_by_type
+
+    def finish(self, pieces=None):
+        fields = {"time": time.perf_counter() - self.start_time}
+        if pieces is not None:
+            vertices, times = self.record_pieces(pieces)
+            fields["pieces"] = len(pieces)
+            fields["vertices"] = sum(vertices.values())
+            fields["vertices_by_type"] = vertices
+            fields["piece_time_by_type"] = times
+
+        if self.trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, fields["peak"] = tracemalloc.get_traced_memory()
+            self.stop_tracing()
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                frame = stat.traceback[0]
+                self.record("allocation", file=frame.filename, line=frame.lineno,
+                        size=stat.size, count=stat.count)
+
+        self.record("summary", **fields)
+
+    def stop_tracing(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+# Number and total size of the memory blocks allocated since "before" (a
+# tracemalloc snapshot) that are still allocated, added up over the lines
+# that allocated them. Blocks allocated and freed in between aren't seen.
+def allocations(before):
+    after = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+    count = 0
+    size = 0
+    for stat in after.compare_to(before, "lineno"):
+        if stat.count_diff > 0:
+            count += stat.count_diff
+            size += max(0, stat.size_diff)
+    return count, size
+
+PROFILER = None
+
+def enable(out, program, argv, trace_memory=False):
+    global PROFILER
+    PROFILER = Profiler(out, program, trace_memory)
+    PROFILER.record("run", argv=argv, timestamp=time.time())
+
+def disable():
+    global PROFILER
+    if PROFILER is not None:
+        PROFILER.stop_tracing()
+    PROFILER = None
+
+def record(event, **fields):
+    if PROFILER is not None:
+        PROFILER.record(event, **fields)
+
+def stage(name):
+    if PROFILER is None:
+        return contextlib.nullcontext()
+    return PROFILER.stage(name)
+
+def piece_time(piece, seconds):
+    if PROFILER is not None:
+        PROFILER.piece_time(piece, seconds)
+
+# Write the piece and summary events and stop profiling.
+def finish(pieces=None):
+    global PROFILER
+    if PROFILER is not None:
+        PROFILER.finish(pieces)
+        PROFILER = None
+
+# Command-line options shared by clock.py and cut.py.
+def add_arguments(parser):
+    parser.add_argument("--profile", metavar="FILENAME",
+            help="append JSON lines of timing and allocation data to this file (- for stderr)")
+    parser.add_argument("--tracemalloc", action="store_true",
+            help="with --profile, also trace memory per stage and report the top allocation sites")
+    parser.add_argument("--cprofile", metavar="FILENAME",
+            help="write cProfile statistics to this file, for use with pstats")
+
+# Profile the body of the "with" according to the options from
+# add_arguments(). The body should call finish().
+@contextlib.contextmanager
+def profiling(args, program, argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    out = None
+    if args.profile == "-":
+        out = sys.stderr
+    elif args.profile:
+        out = open(args.profile, "a")
+    if out is not None:
+        enable(out, program, argv, args.tracemalloc)
+
+    profiler = None
+    if args.cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+        disable()
+        if out is not None and out is not sys.stderr:
+            out.close()
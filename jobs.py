@@ -0,0 +1,147 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Generate the geometry of pieces in a pool of worker processes. The layout
+# code puts a Deferred in data["pieces"] where it would have put the piece,
+# and run() later replaces each one with the real piece. The pieces stay in
+# the same order, so the output is the same as generating them in place.
+#
+# Each worker has its own in-memory caches (lru.py), so pieces that can
+# share cache entries are given the same "group" and made by one worker.
+# Workers send back how much their cache counters (lru.py and memo.py) went
+# up, so that the statistics printed by this process include their work.
+
+import time
+import multiprocessing
+
+import instrument
+import lru
+import memo
+
+# With the default number of processes, fewer pieces than this are made in
+# this process, since starting the workers would take longer than making
+# them (the clock has about 30).
+MIN_POOL_PIECES = 200
+
+# Placeholder for a piece that's made by calling "function" with the given
+# arguments. The function must be at the top level of its module so that
+# workers can find it. Keys set on the placeholder are set on the piece
+# once it's made, in the same order, and callbacks are then called with the
+# piece in this process.
+class Deferred:
+    def __init__(self, function, *args, **kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.fields = []
+        self.callbacks = []
+        # Pieces with the same group (if not None) are made by the same
+        # worker, in order.
+        self.group = None
+
+    def __setitem__(self, key, value):
+        self.fields.append((key, value))
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def call(self):
+        return (self.function, self.args, self.kwargs)
+
+    def finish(self, piece):
+        for key, value in self.fields:
+            piece[key] = value
+        for callback in self.callbacks:
+            callback(piece)
+        return piece
+
+# Returns the piece and the time it took to make it.
+def make_piece(call):
+    function, args, kwargs = call
+    start = time.perf_counter()
+    piece = function(*args, **kwargs)
+    return piece, time.perf_counter() - start
+
+# Hits, misses and evictions of the caches in this process, by name.
+def counters():
+    result = lru.counters()
+    result.update(memo.counters())
+    return result
+
+def add_counters(counters):
+    lru.add_counters(counters)
+    memo.add_counters(counters)
+
+# Runs in a worker. Returns the list of (piece, seconds) for the calls and
+# how much the cache counters went up.
+def make_pieces(calls):
+    before = counters()
+    results = [make_piece(call) for call in calls]
+    return results, counter_increase(counters(), before)
+
+# Counters are dicts of name to a tuple of numbers.
+def counter_increase(after, before):
+    increase = {}
+    for name, values in after.items():
+        old = before.get(name, (0,)*len(values))
+        increase[name] = tuple(value - old_value for value, old_value in zip(values, old))
+    return increase
+
+# Replace all Deferred pieces in data["pieces"] with the pieces they make.
+# Uses "processes" workers. If None, uses one per core when there are at
+# least MIN_POOL_PIECES pieces to make, and otherwise makes them here, as
+# with one process.
+def run(data, processes=None):
+    pieces = data["pieces"]
+    indices = [i for i, piece in enumerate(pieces) if isinstance(piece, Deferred)]
+
+    if processes is None and len(indices) < MIN_POOL_PIECES:
+        processes = 1
+
+    # Lists of indices that are made together, in the order of their first
+    # piece.
+    batches = []
+    by_group = {}
+    for i in indices:
+        group = pieces[i].group
+        if group is None:
+            batches.append([i])
+        elif group in by_group:
+            by_group[group].append(i)
+        else:
+            by_group[group] = [i]
+            batches.append(by_group[group])
+
+    if processes == 1 or len(batches) < 2:
+        results = [make_piece(pieces[i].call()) for i in indices]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            # map() keeps the order of the batches.
+            batch_results = pool.map(make_pieces,
+                    [[pieces[i].call() for i in batch] for batch in batches], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        by_index = {}
+        for batch, (batch_pieces, counters) in zip(batches, batch_results):
+            by_index.update(zip(batch, batch_pieces))
+            add_counters(counters)
+        results = [by_index[i] for i in indices]
+
+    for i, (piece, seconds) in zip(indices, results):
+        pieces[i] = pieces[i].finish(piece)
+        instrument.piece_time(pieces[i], seconds)
@@ -0,0 +1,125 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Write the clock data as JSON, one piece at a time. Point lists are written
+# as a single run of numbers instead of one coordinate per line, so the file
+# is much smaller and faster to write and parse than json.dump(indent=4).
+# The output is still plain JSON that cut.py and clock.js can load.
+
+import json
+
+import numpy as np
+
+from points import PointBuffer
+
+INDENT = "    "
+
+class Writer:
+    # "precision" is the number of decimal places for point coordinates, or
+    # None to keep full precision. In "compact" mode there's no indentation
+    # and each piece is on its own line.
+    def __init__(self, out, precision=None, compact=False):
+        self.out = out
+        self.precision = precision
+        self.compact = compact
+        if compact:
+            self.separators = (",", ":")
+        else:
+            self.separators = (", ", ": ")
+
+    def write(self, data):
+        out = self.out
+        newline = "\n" if not self.compact else ""
+
+        out.write("{" + newline)
+        for key, value in data.items():
+            if key == "pieces":
+                continue
+            out.write(self.indent(1) + self.dumps(key) + self.separators[1] +
+                      self.dumps_value(value, 1) + "," + newline)
+
+        out.write(self.indent(1) + self.dumps("pieces") + self.separators[1] + "[\n")
+        pieces = data["pieces"]
+        for index, piece in enumerate(pieces):
+            self.write_piece(piece)
+            out.write(",\n" if index < len(pieces) - 1 else "\n")
+        out.write(self.indent(1) + "]" + newline + "}\n")
+
+    def write_piece(self, piece):
+        newline = "\n" if not self.compact else ""
+
+        fields = []
+        for key, value in piece.items():
+            fields.append(self.indent(3) + self.dumps(key) + self.separators[1] +
+                          self.dumps_value(value, 3))
+
+        self.out.write(self.indent(2) + "{" + newline +
+                       ("," + newline).join(fields) +
+                       newline + self.indent(2) + "}")
+
+    def indent(self, level):
+        return "" if self.compact else INDENT*level
+
+    def dumps(self, value):
+        return json.dumps(value, separators=self.separators)
+
+    # Value at the given indentation level.
+    def dumps_value(self, value, level):
+        if isinstance(value, PointBuffer):
+            return self.dumps_points(value.array)
+        if isinstance(value, np.ndarray):
+            return self.dumps_points(value)
+        if contains_points(value):
+            return self.dumps_container(value, level)
+
+        if self.compact:
+            return json.dumps(value, separators=self.separators,
+                              default=lambda obj: obj.to_JSON())
+
+        s = json.dumps(value, indent=4, separators=(",", ": "),
+                       default=lambda obj: obj.to_JSON())
+        return s.replace("\n", "\n" + self.indent(level))
+
+    # List or dict with points somewhere inside, such as a piece's "levels".
+    def dumps_container(self, value, level):
+        newline = "\n" if not self.compact else ""
+        if isinstance(value, dict):
+            items = [self.indent(level + 1) + self.dumps(key) + self.separators[1] +
+                     self.dumps_value(item, level + 1) for key, item in value.items()]
+            brackets = "{}"
+        else:
+            items = [self.indent(level + 1) + self.dumps_value(item, level + 1) for item in value]
+            brackets = "[]"
+        return (brackets[0] + newline + ("," + newline).join(items) +
+                newline + self.indent(level) + brackets[1])
+
+    # All points on one line.
+    def dumps_points(self, array):
+        if self.precision is not None:
+            array = np.round(array, self.precision)
+        return json.dumps(array.tolist(), separators=(",", ":"))
+
+def contains_points(value):
+    if isinstance(value, (PointBuffer, np.ndarray)):
+        return True
+    if isinstance(value, dict):
+        return any(contains_points(item) for item in value.values())
+    if isinstance(value, list):
+        return any(isinstance(item, (dict, list)) and contains_points(item) for item in value)
+    return False
+
+# Convenience function for writing the whole file.
+def write(data, out, precision=None, compact=False):
+    Writer(out, precision, compact).write(data)
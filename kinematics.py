@@ -0,0 +1,151 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Motion of the pieces over time. Gears turn at their "speed" (turns per 12
+# hours) but only move during the last part of each second, when the
+# escapement lets go. The verge and pendulum swing between their
+# "left_full_in_angle" and "right_full_in_angle" once every two seconds.
+#
+# angles() computes the angles of all pieces at many times at once. tracks()
+# turns the same motion into keyframes for the output file, so that the
+# viewer doesn't have to know the rules. Each track is periodic:
+#
+#     angle(t) = interpolate(t mod period, times, values) + floor(t/period)*advance
+#
+# with linear interpolation, and is shared by all pieces that move the same
+# way. Angles are in radians, counterclockwise in SVG coordinates (Y down),
+# and times are in seconds.
+
+import math
+
+import numpy as np
+
+from config import TAU
+
+# Seconds in 12 hours, the unit of "speed".
+SECONDS_PER_TURN = 43200
+
+# Fraction of each second during which the escapement moves.
+ESCAPEMENT_STEP = 1/16.0
+
+# Seconds subtracted from the time so that the verge matches up with the
+# escapement wheel.
+TIME_OFFSET = 0.4
+
+# The swing of the verge and pendulum.
+SWING_PERIOD = 2.0
+SWING_PHASE = 0.6
+
+# Number of keyframes for one swing.
+SWING_KEYFRAMES = 32
+
+SWINGING_TYPES = ("verge", "pendulum")
+
+# Time as moved by the escapement: stopped for most of each second, then
+# catching up. Works on arrays.
+def escaped_time(t):
+    t = np.asarray(t, dtype=float)
+    integer = np.floor(t)
+    fraction = np.maximum(0, (t - integer)/ESCAPEMENT_STEP - (1/ESCAPEMENT_STEP - 1))
+    return integer + fraction
+
+# Angle of a swinging piece at times "t", from 0 at the right to 1 at the
+# left.
+def swing_span(t):
+    return np.sin(np.asarray(t, dtype=float)/SWING_PERIOD*TAU + SWING_PHASE)/2 + 0.5
+
+def swing_range(piece):
+    return (math.radians(piece["right_full_in_angle"]),
+            math.radians(piece["left_full_in_angle"]))
+
+# Angles of the pieces at the times, as a (pieces, times) array.
+def angles(pieces, times):
+    times = np.asarray(times, dtype=float)
+    speeds = np.array([piece.get("speed", 0) for piece in pieces], dtype=float)
+    result = np.outer(speeds, (escaped_time(times) - TIME_OFFSET)*TAU/SECONDS_PER_TURN)
+
+    swinging = [i for i, piece in enumerate(pieces) if piece["type"] in SWINGING_TYPES]
+    if swinging:
+        span = swing_span(times)
+        for i in swinging:
+            right, left = swing_range(pieces[i])
+            result[i] = span*(left - right) + right
+
+    return result
+
+# Keyframe track of a gear turning at "speed".
+def turning_track(speed):
+    step = TAU/SECONDS_PER_TURN*speed
+    start = -TIME_OFFSET*step
+    return {
+        "period": 1.0,
+        "times": [0.0, 1 - ESCAPEMENT_STEP, 1.0],
+        "values": [start, start, start + step],
+        "advance": step,
+    }
+
+# Keyframe track of a swinging piece.
+def swinging_track(piece):
+    right, left = swing_range(piece)
+    times = np.linspace(0, SWING_PERIOD, SWING_KEYFRAMES + 1)
+    return {
+        "period": SWING_PERIOD,
+        "times": times.tolist(),
+        "values": (swing_span(times)*(left - right) + right).tolist(),
+        "advance": 0.0,
+    }
+
+# Keyframe tracks of all the moving pieces, for data["animation"]. Each
+# track has the indices of its pieces in "pieces".
+def tracks(pieces):
+    result = []
+    by_motion = {}
+    for index, piece in enumerate(pieces):
+        if piece["type"] in SWINGING_TYPES:
+            motion = ("swing", piece["right_full_in_angle"], piece["left_full_in_angle"])
+        elif piece.get("speed"):
+            motion = ("turn", piece["speed"])
+        else:
+            continue
+
+        if motion not in by_motion:
+            if motion[0] == "swing":
+                track = swinging_track(piece)
+            else:
+                track = turning_track(piece["speed"])
+            track["pieces"] = []
+            by_motion[motion] = track
+            result.append(track)
+        by_motion[motion]["pieces"].append(index)
+
+    return {"tracks": result}
+
+# Evaluate one track at the times.
+def evaluate(track, times):
+    times = np.asarray(times, dtype=float)
+    period = track["period"]
+    cycles = np.floor(times/period)
+    return (np.interp(times - cycles*period, track["times"], track["values"]) +
+            cycles*track["advance"])
+
+# Angles of "count" pieces at the times from the tracks of
+# data["animation"], as a (count, times) array. Pieces without a track don't
+# move.
+def evaluate_tracks(animation, count, times):
+    times = np.asarray(times, dtype=float)
+    result = np.zeros((count, len(times)))
+    for track in animation["tracks"]:
+        result[track["pieces"]] = evaluate(track, times)
+    return result
@@ -0,0 +1,115 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Bounded in-memory caches of point arrays, evicting the least recently used
+# entry when the total size goes over budget.
+
+import sys
+import collections
+
+import numpy as np
+
+class LruCache:
+    def __init__(self, name, max_bytes):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Key to (value, size in bytes), oldest first.
+        self.entries = collections.OrderedDict()
+
+    # Returns the value for "key", calling compute() to make it if it's not
+    # in the cache. Arrays are made read-only since they're shared between
+    # callers; copy them before modifying.
+    def get(self, key, compute):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+        self.misses += 1
+        value = compute()
+        freeze(value)
+        size = sizeof(value) + sys.getsizeof(key)
+
+        # Don't let a single huge value flush everything else.
+        if size <= self.max_bytes:
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, old_size) = self.entries.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    # The entries and bytes are those of this process, not of workers.
+    def dump_statistics(self, out):
+        out.write("%s cache: %d hits, %d misses, %d evictions, %d entries, %d bytes here.\n" % (
+            self.name, self.hits, self.misses, self.evictions, len(self.entries), self.size))
+
+# Make arrays in the value read-only.
+def freeze(value):
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, tuple):
+        for item in value:
+            freeze(item)
+
+# Approximate memory used by a cached value. Arrays that are views don't
+# count their data in getsizeof().
+def sizeof(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, np.ndarray) and value.base is not None:
+        size += value.nbytes
+    elif isinstance(value, tuple):
+        size += sum(sizeof(item) for item in value)
+    return size
+
+# Single-tooth profiles, normalized to a module of 1 and unrotated.
+PROFILE_CACHE = LruCache("Tooth profile", 4*1024*1024)
+
+# Full outlines (all teeth stamped), normalized to a module of 1.
+OUTLINE_CACHE = LruCache("Outline", 32*1024*1024)
+
+CACHES = [PROFILE_CACHE, OUTLINE_CACHE]
+
+def clear():
+    for cache in CACHES:
+        cache.clear()
+
+# Hits, misses and evictions of each cache, by name. Workers of jobs.py send
+# back how much these went up, and add_counters() adds that here.
+def counters():
+    return dict((cache.name, (cache.hits, cache.misses, cache.evictions)) for cache in CACHES)
+
+def add_counters(counters):
+    for cache in CACHES:
+        if cache.name in counters:
+            hits, misses, evictions = counters[cache.name]
+            cache.hits += hits
+            cache.misses += misses
+            cache.evictions += evictions
+
+def dump_statistics(out):
+    for cache in CACHES:
+        cache.dump_statistics(out)
@@ -0,0 +1,257 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# On-disk cache of generated pieces, so that a rebuild only makes the pieces
+# whose inputs changed. Functions wrapped with @cached are keyed on a hash of
+# their arguments and a fingerprint of their module: its source, the
+# constants it uses (including the ones imported from config.py), and the
+# same for every module of ours that it uses, except config.py itself. Entries are pickle files named
+# by the hash. The least recently used ones are removed when the directory
+# goes over its size limit.
+#
+# The cache does nothing until enable() is called.
+
+import os
+import sys
+import types
+import pickle
+import hashlib
+import tempfile
+import functools
+
+from vector import Vector
+
+DEFAULT_MAX_BYTES = 256*1024*1024
+SUFFIX = ".pickle"
+
+# Directory of this program. Only modules in here are fingerprinted.
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Types of module globals that are hashed as constants.
+CONSTANT_TYPES = (bool, int, float, str, tuple, list, type(None))
+
+# Modules whose globals are the state of this run (such as whether the cache
+# or profiling is on), not inputs of the pieces. Hashing them would give the
+# same piece a different key depending on when it was first made.
+NOT_INPUTS = set(["memo", "instrument"])
+
+# Modules of parameters. The cached functions get the ones they use as
+# arguments (the fields of a ClockConfig they need) or as constants imported
+# by name, which are hashed with the module that imports them. Hashing the
+# whole of config.py would rebuild every piece when any parameter changes.
+PARAMETER_MODULES = set(["config"])
+
+class DiskCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.size = sum(size for _, size, _ in self.entries())
+
+    def filename(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    # Returns the value for "key", calling compute() to make it if it's not
+    # in the cache.
+    def get(self, key, compute):
+        filename = self.filename(key)
+        try:
+            with open(filename, "rb") as f:
+                value = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            value = None
+        else:
+            self.hits += 1
+            # Mark as recently used.
+            try:
+                os.utime(filename, None)
+            except OSError:
+                pass
+            return value
+
+        self.misses += 1
+        value = compute()
+        self.put(filename, value)
+        return value
+
+    # Write to a temporary file and rename, so other processes never see a
+    # partial entry.
+    def put(self, filename, value):
+        fd, temp_filename = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_filename, filename)
+        except:
+            os.remove(temp_filename)
+            raise
+
+        self.size += os.path.getsize(filename)
+        if self.size > self.max_bytes:
+            self.trim()
+
+    # Returns (filename, size, mtime) for each entry.
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                filename = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                entries.append((filename, st.st_size, st.st_mtime))
+        return entries
+
+    # Remove the least recently used entries until we're under the limit.
+    def trim(self):
+        entries = self.entries()
+        entries.sort(key=lambda entry: entry[2])
+        self.size = sum(size for _, size, _ in entries)
+        for filename, size, _ in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            self.size -= size
+            self.evictions += 1
+
+    def dump_statistics(self, out):
+        # Workers of jobs.py may have added entries.
+        self.size = sum(size for _, size, _ in self.entries())
+        out.write("Disk cache: %d hits, %d misses, %d evictions, %d bytes in %s.\n" % (
+            self.hits, self.misses, self.evictions, self.size, self.directory))
+
+CACHE = None
+
+def enable(directory, max_bytes=DEFAULT_MAX_BYTES):
+    global CACHE
+    CACHE = DiskCache(directory, max_bytes)
+
+def disable():
+    global CACHE
+    CACHE = None
+
+# Hits, misses and evictions by name, as for lru.counters().
+def counters():
+    if CACHE is None:
+        return {}
+    return {"Disk": (CACHE.hits, CACHE.misses, CACHE.evictions)}
+
+def add_counters(counters):
+    if CACHE is not None and "Disk" in counters:
+        hits, misses, evictions = counters["Disk"]
+        CACHE.hits += hits
+        CACHE.misses += misses
+        CACHE.evictions += evictions
+
+def dump_statistics(out):
+    if CACHE is not None:
+        CACHE.dump_statistics(out)
+
+# Decorator for functions whose result only depends on their arguments and
+# the code and constants of their module.
+def cached(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if CACHE is None:
+            return function(*args, **kwargs)
+        key = make_key(function, args, kwargs)
+        return CACHE.get(key, lambda: function(*args, **kwargs))
+    return wrapper
+
+def make_key(function, args, kwargs):
+    h = hashlib.sha1()
+    h.update(("%s.%s\n" % (function.__module__, function.__name__)).encode("utf-8"))
+    h.update(fingerprint(sys.modules[function.__module__]).encode("utf-8"))
+    h.update(canonical((args, sorted(kwargs.items()))).encode("utf-8"))
+    return h.hexdigest()
+
+# Exact string version of a value. repr() of Vector rounds.
+def canonical(value):
+    if isinstance(value, Vector):
+        return "Vector(%r,%r)" % (value.x, value.y)
+    if hasattr(value, "_asdict"):
+        # Named tuple, such as config.ClockConfig.
+        return "%s%s" % (type(value).__name__, canonical(value._asdict()))
+    if isinstance(value, (tuple, list)):
+        return "(%s)" % ",".join(canonical(item) for item in value)
+    if isinstance(value, dict):
+        return "{%s}" % ",".join("%s:%s" % (canonical(k), canonical(v))
+                for k, v in sorted(value.items()))
+    return repr(value)
+
+# Module name to fingerprint.
+FINGERPRINTS = {}
+
+# Hash of the module's source and constants and those of the modules it
+# uses, as a hex string.
+def fingerprint(module):
+    name = module.__name__
+    if name not in FINGERPRINTS:
+        h = hashlib.sha1()
+        for dependency in sorted(dependencies(module), key=lambda m: m.__name__):
+            h.update(("%s\n" % dependency.__name__).encode("utf-8"))
+            with open(dependency.__file__, "rb") as f:
+                h.update(f.read())
+            for key, value in sorted(vars(dependency).items()):
+                if key.isupper() and is_constant(value):
+                    h.update(("%s=%s\n" % (key, canonical(value))).encode("utf-8"))
+        FINGERPRINTS[name] = h.hexdigest()
+    return FINGERPRINTS[name]
+
+# Whether the value is made only of CONSTANT_TYPES. A list of objects (such
+# as lru.CACHES) would hash their addresses, which change on every run. Named
+# tuples such as config.DEFAULT_CONFIG aren't constants either: it's only
+# the default of arguments, and the cached functions get the fields they use.
+def is_constant(value):
+    if hasattr(value, "_fields"):
+        return False
+    if isinstance(value, (tuple, list)):
+        return all(is_constant(item) for item in value)
+    return isinstance(value, CONSTANT_TYPES)
+
+def is_ours(module):
+    filename = getattr(module, "__file__", None)
+    return (filename is not None and
+            os.path.dirname(os.path.abspath(filename)) == SOURCE_DIR)
+
+# Set of our modules that "module" uses, directly or not, including itself.
+def dependencies(module):
+    found = set()
+    pending = [module]
+    while pending:
+        module = pending.pop()
+        if module in found:
+            continue
+        found.add(module)
+        for value in vars(module).values():
+            if isinstance(value, types.ModuleType):
+                other = value
+            else:
+                other_name = getattr(value, "__module__", None)
+                other = sys.modules.get(other_name) if isinstance(other_name, str) else None
+            if (other is not None and other not in found and is_ours(other) and
+                    other.__name__ not in NOT_INPUTS and
+                    other.__name__ not in PARAMETER_MODULES):
+                pending.append(other)
+    return found
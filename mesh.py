@@ -0,0 +1,233 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Check that meshing gears don't run into each other as they turn. The angle
+# that GearTrain gives each gear is only right at time zero, so here we turn
+# both gears of each meshing pair at the ratio of their speeds and test the
+# tooth outlines at every position: the vertices of each gear mustn't be
+# inside the other gear, and we report how close they come.
+#
+# The outlines are stamped from a single tooth, so the pair is back where it
+# started (tooth for tooth) after the driver turns by one tooth. Checking
+# that one tooth covers the whole revolution.
+
+import numpy as np
+
+from config import DPI, TAU
+import instrument
+
+# Number of positions checked per tooth of the driver.
+STEPS_PER_TOOTH = 32
+
+# Number of vertices tested at once, to limit memory use.
+CHUNK_SIZE = 4096
+
+# Number of ranges of angle that each tooth is split into, to limit the
+# number of edges that each vertex is tested against.
+BINS = 16
+
+# Coordinate of the edges used for padding.
+FAR = 1e9
+
+# Wrap angles to [-pi, pi).
+def wrap(angle):
+    return (angle + TAU/2) % TAU - TAU/2
+
+# A gear outline, with the edges of one tooth in polar form so that any
+# point can be tested against it after rotating it onto that tooth.
+class Outline:
+    def __init__(self, piece, teeth):
+        self.center = np.array([piece["cx"], piece["cy"]], dtype=float)
+        self.speed = piece["speed"]
+        self.period = TAU/teeth
+        self.points = np.asarray(piece["points"], dtype=float)
+        self.radii = np.hypot(self.points[:, 0], self.points[:, 1])
+        # Bounding circle.
+        self.radius = self.radii.max()
+
+        # Split one tooth into BINS ranges of angle and keep, for each range,
+        # the edges that are within an eighth of a tooth of it. That's every
+        # edge that a ray in the range can cross, and the nearest edge to
+        # any point that's closer than an eighth of a tooth. The lists are
+        # padded with far away edges that cover no angle.
+        p1 = self.points
+        p2 = np.roll(p1, -1, axis=0)
+        a1 = np.arctan2(p1[:, 1], p1[:, 0])
+        a2 = a1 + wrap(np.arctan2(p2[:, 1], p2[:, 0]) - a1)
+        low = np.minimum(a1, a2)
+        high = np.maximum(a1, a2)
+        width = self.period/BINS
+        margin = self.period/8
+        edges = []
+        for i in range(BINS):
+            edges.append(np.nonzero((high >= i*width - margin) &
+                (low < (i + 1)*width + margin))[0])
+        count = max(len(e) for e in edges)
+        self.x1 = np.full((BINS, count), FAR)
+        self.y1 = np.full((BINS, count), FAR)
+        self.x2 = np.full((BINS, count), FAR)
+        self.y2 = np.full((BINS, count), FAR)
+        self.a1 = np.full((BINS, count), np.inf)
+        self.a2 = np.full((BINS, count), np.inf)
+        for i, e in enumerate(edges):
+            self.x1[i, :len(e)] = p1[e, 0]
+            self.y1[i, :len(e)] = p1[e, 1]
+            self.x2[i, :len(e)] = p2[e, 0]
+            self.y2[i, :len(e)] = p2[e, 1]
+            self.a1[i, :len(e)] = a1[e]
+            self.a2[i, :len(e)] = a2[e]
+
+    # Rotate the vertices whose radius is at least "min_radius" by each of
+    # the "angles" and move them into place. Returns an (S, N, 2) array.
+    def place(self, angles, min_radius):
+        points = self.points[self.radii >= min_radius]
+        c = np.cos(angles)[:, np.newaxis]
+        s = np.sin(angles)[:, np.newaxis]
+        x = points[:, 0]
+        y = points[:, 1]
+        P = np.empty((len(angles), len(points), 2))
+        P[:, :, 0] = x*c - y*s + self.center[0]
+        P[:, :, 1] = x*s + y*c + self.center[1]
+        return P
+
+    # For (K, 2) points when the gear is turned by the (K,) angles, returns
+    # whether each point is inside the outline and its distance to the
+    # outline.
+    def locate(self, points, angles):
+        d = points - self.center
+        rho = np.hypot(d[:, 0], d[:, 1])
+        # Angle in the gear's own frame, moved onto the first tooth.
+        alpha = (np.arctan2(d[:, 1], d[:, 0]) - angles) % self.period
+        ux = np.cos(alpha)[:, np.newaxis]
+        uy = np.sin(alpha)[:, np.newaxis]
+        rho = rho[:, np.newaxis]
+
+        # Edges near each point's angle.
+        b = np.minimum((alpha/self.period*BINS).astype(int), BINS - 1)
+        x1 = self.x1[b]
+        y1 = self.y1[b]
+        dx = self.x2[b] - x1
+        dy = self.y2[b] - y1
+        alpha = alpha[:, np.newaxis]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Count the edges that the ray from the point away from the
+            # center crosses. An odd count means the point is inside.
+            spans = (self.a1[b] <= alpha) != (self.a2[b] <= alpha)
+            c1 = ux*y1 - uy*x1
+            c2 = ux*(y1 + dy) - uy*(x1 + dx)
+            t = c1/(c1 - c2)
+            r = ux*(x1 + t*dx) + uy*(y1 + t*dy)
+            inside = np.count_nonzero(spans & (r > rho), axis=1) % 2 == 1
+
+            # Distance to the nearest edge.
+            px = rho*ux - x1
+            py = rho*uy - y1
+            length2 = dx*dx + dy*dy
+            t = np.clip((px*dx + py*dy)/length2, 0, 1)
+        t[length2 == 0] = 0
+        ex = px - t*dx
+        ey = py - t*dy
+        distance = np.sqrt((ex*ex + ey*ey).min(axis=1))
+
+        return inside, distance
+
+# Test the vertices of "moving" against "fixed" at each position. Returns the
+# smallest distance and the set of positions at which they overlap.
+def check_vertices(moving, moving_angles, fixed, fixed_angles):
+    distance = np.linalg.norm(fixed.center - moving.center)
+
+    # Only vertices that can reach into the other gear's bounding circle.
+    P = moving.place(moving_angles, distance - fixed.radius)
+    d = P - fixed.center
+    near = d[:, :, 0]**2 + d[:, :, 1]**2 < fixed.radius**2
+    steps, indices = np.nonzero(near)
+    points = P[steps, indices]
+
+    clearance = np.inf
+    collisions = set()
+    for start in range(0, len(points), CHUNK_SIZE):
+        end = start + CHUNK_SIZE
+        inside, distance = fixed.locate(points[start:end], fixed_angles[steps[start:end]])
+        if np.any(~inside):
+            clearance = min(clearance, distance[~inside].min())
+        collisions.update(steps[start:end][inside].tolist())
+
+    return clearance, collisions
+
+# Check one pair of meshing gear pieces. Returns a dict with the smallest
+# clearance between the teeth, in inches, and the number of positions (out
+# of "steps") at which the teeth overlap.
+def check_pair(driver_piece, driver_teeth, driven_piece, driven_teeth, steps=STEPS_PER_TOOTH):
+    driver = Outline(driver_piece, driver_teeth)
+    driven = Outline(driven_piece, driven_teeth)
+
+    result = {
+        "positions": steps,
+        "clearance": None,
+        "collisions": 0,
+    }
+
+    # Bounding circles that don't touch can't collide.
+    if np.linalg.norm(driven.center - driver.center) >= driver.radius + driven.radius:
+        return result
+
+    driver_angles = np.arange(steps)*driver.period/steps
+    driven_angles = driver_angles*driven.speed/driver.speed
+
+    clearance1, collisions1 = check_vertices(driver, driver_angles, driven, driven_angles)
+    clearance2, collisions2 = check_vertices(driven, driven_angles, driver, driver_angles)
+
+    clearance = min(clearance1, clearance2)
+    if clearance != np.inf:
+        result["clearance"] = float(clearance)/DPI
+    result["collisions"] = len(collisions1 | collisions2)
+    return result
+
+# Check every meshing pair of a gear train, given as tuples of (driver piece
+# index, driven piece index, driver teeth, driven teeth). Returns a list of
+# results from check_pair() with the indices and teeth added.
+def check(data, meshes, steps=STEPS_PER_TOOTH):
+    pieces = data["pieces"]
+    results = []
+    for driver_index, driven_index, driver_teeth, driven_teeth in meshes:
+        result = check_pair(pieces[driver_index], driver_teeth,
+                pieces[driven_index], driven_teeth, steps)
+        result["driver"] = driver_index
+        result["driven"] = driven_index
+        result["driver_teeth"] = driver_teeth
+        result["driven_teeth"] = driven_teeth
+        results.append(result)
+    return results
+
+# Write one line per pair, and a warning if any of them collide. Returns
+# whether all pairs are clear.
+def dump_results(results, out):
+    ok = True
+    for result in results:
+        instrument.record("mesh", **result)
+        out.write("Gears %d (%d teeth) and %d (%d teeth): " % (
+            result["driver"], result["driver_teeth"], result["driven"], result["driven_teeth"]))
+        if result["clearance"] is not None:
+            out.write("clearance %.4f inches" % result["clearance"])
+        else:
+            out.write("not touching")
+        if result["collisions"]:
+            out.write(", COLLIDE at %d of %d positions" % (result["collisions"], result["positions"]))
+            ok = False
+        out.write(".\n")
+    if not ok:
+        out.write("------------------ GEARS COLLIDE -----------------------\n")
+    return ok
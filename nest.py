@@ -0,0 +1,179 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Lay out pieces on sheets of stock for cutting. Each piece is turned by
+# each of a few fixed angles and placed by its bounding box at that angle,
+# as close to the top-left corner of a sheet as it fits (the "bottom-left"
+# rule, with Y down). Pieces go in from largest to smallest, onto the first
+# sheet with room, and a new sheet is started when none has room.
+
+import bisect
+import collections
+
+import numpy as np
+
+from config import DPI
+
+# Size of the stock, in points.
+SHEET_WIDTH = 24*DPI
+SHEET_HEIGHT = 18*DPI
+
+# Space between pieces and around the edge of the sheet, in points.
+SPACING = 0.125*DPI
+
+# Number of angles to try for each piece, evenly spaced around the circle.
+ROTATIONS = 4
+
+# Size of the cells of the index of placed boxes, in points.
+CELL_SIZE = 1*DPI
+
+# Where a piece goes on a sheet: its origin is moved to (x, y) after it's
+# turned by "angle" degrees clockwise (as in an SVG "rotate" transform).
+Placement = collections.namedtuple("Placement", ["piece", "x", "y", "angle"])
+
+# Bounding boxes of the piece's outline turned by each of the "angles" (in
+# degrees), as a list of (min x, min y, max x, max y) relative to its origin.
+def rotated_boxes(piece, angles):
+    p = np.asarray(piece["points"], dtype=float).reshape(-1, 2)
+    t = np.radians(angles)
+    c = np.cos(t)
+    s = np.sin(t)
+    x = np.outer(p[:, 0], c) - np.outer(p[:, 1], s)
+    y = np.outer(p[:, 0], s) + np.outer(p[:, 1], c)
+    return list(zip(x.min(axis=0).tolist(), y.min(axis=0).tolist(),
+            x.max(axis=0).tolist(), y.max(axis=0).tolist()))
+
+# Area inside the piece's outline, in square points.
+def outline_area(piece):
+    p = np.asarray(piece["points"], dtype=float).reshape(-1, 2)
+    x = p[:, 0]
+    y = p[:, 1]
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))/2
+
+class Sheet:
+    def __init__(self, width, height, spacing):
+        self.width = width
+        self.height = height
+        self.spacing = spacing
+        self.placements = []
+        # Boxes of the placed pieces, and the indices of the boxes that
+        # touch each cell.
+        self.boxes = []
+        self.cells = collections.defaultdict(list)
+        # Top-left corners to try, sorted by (y, x).
+        self.corners = [(spacing, spacing)]
+        self.area = 0
+        # Sizes of boxes that didn't fit since the last piece was added.
+        # Anything at least as large won't fit either.
+        self.failed = []
+
+    def cell_range(self, x0, y0, x1, y1):
+        for i in range(int(x0//CELL_SIZE), int(x1//CELL_SIZE) + 1):
+            for j in range(int(y0//CELL_SIZE), int(y1//CELL_SIZE) + 1):
+                yield (i, j)
+
+    # Whether the box comes within the spacing of any placed box.
+    def overlaps(self, x0, y0, x1, y1):
+        x0 -= self.spacing
+        y0 -= self.spacing
+        x1 += self.spacing
+        y1 += self.spacing
+        for cell in self.cell_range(x0, y0, x1, y1):
+            for index in self.cells.get(cell, ()):
+                bx0, by0, bx1, by1 = self.boxes[index]
+                if x0 < bx1 and bx0 < x1 and y0 < by1 and by0 < y1:
+                    return True
+        return False
+
+    # Returns the top-left corner of the first place that a box of this
+    # width and height fits, as (y, x), or None.
+    def fit(self, width, height):
+        for failed_width, failed_height in self.failed:
+            if width >= failed_width and height >= failed_height:
+                return None
+        for y, x in self.corners:
+            if (x + width <= self.width - self.spacing and
+                    y + height <= self.height - self.spacing and
+                    not self.overlaps(x, y, x + width, y + height)):
+                return y, x
+        self.failed.append((width, height))
+        return None
+
+    def add(self, placement, x0, y0, x1, y1):
+        index = len(self.boxes)
+        self.boxes.append((x0, y0, x1, y1))
+        for cell in self.cell_range(x0, y0, x1, y1):
+            self.cells[cell].append(index)
+        self.placements.append(placement)
+        self.area += (x1 - x0)*(y1 - y0)
+        self.failed = []
+
+        # New corners to the right of the box and below it.
+        for corner in ((y0, x1 + self.spacing), (y1 + self.spacing, x0),
+                (self.spacing, x1 + self.spacing), (y1 + self.spacing, self.spacing)):
+            i = bisect.bisect_left(self.corners, corner)
+            if i == len(self.corners) or self.corners[i] != corner:
+                self.corners.insert(i, corner)
+
+    # Place the piece, given its boxes at each angle. Returns whether it fit.
+    def place(self, piece, angles, boxes):
+        best = None
+        for angle, (min_x, min_y, max_x, max_y) in zip(angles, boxes):
+            width = max_x - min_x
+            height = max_y - min_y
+            corner = self.fit(width, height)
+            if corner is not None and (best is None or corner < best[0]):
+                best = (corner, angle, width, height, min_x, min_y)
+        if best is None:
+            return False
+
+        (y, x), angle, width, height, min_x, min_y = best
+        self.add(Placement(piece, x - min_x, y - min_y, angle), x, y, x + width, y + height)
+        return True
+
+# Lay out the pieces. Returns the list of sheets, each a list of
+# Placement, and the list of pieces that don't fit on an empty sheet.
+def nest(pieces, width=SHEET_WIDTH, height=SHEET_HEIGHT, spacing=SPACING, rotations=ROTATIONS):
+    angles = [360.0*i/rotations for i in range(rotations)]
+
+    # Boxes are the same for copies of a piece.
+    boxes_by_id = {}
+    items = []
+    for piece in pieces:
+        key = id(piece["points"])
+        if key not in boxes_by_id:
+            boxes_by_id[key] = rotated_boxes(piece, angles)
+        boxes = boxes_by_id[key]
+        area = min((x1 - x0)*(y1 - y0) for x0, y0, x1, y1 in boxes)
+        items.append((area, piece, boxes))
+
+    # Largest first. The sort is stable so equal pieces stay in order.
+    items.sort(key=lambda item: -item[0])
+
+    sheets = []
+    unplaced = []
+    usable = (width - 2*spacing)*(height - 2*spacing)
+    for area, piece, boxes in items:
+        for sheet in sheets:
+            if sheet.area + area <= usable and sheet.place(piece, angles, boxes):
+                break
+        else:
+            sheet = Sheet(width, height, spacing)
+            if sheet.place(piece, angles, boxes):
+                sheets.append(sheet)
+            else:
+                unplaced.append(piece)
+
+    return [sheet.placements for sheet in sheets], unplaced
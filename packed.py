@@ -0,0 +1,116 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Binary version of the clock data. The layout is:
+#
+#     "CLKB"                  magic
+#     uint32                  version
+#     uint32                  length of the header in bytes
+#     header                  UTF-8 JSON, padded with spaces to 8 bytes
+#     coordinates             packed little-endian floats, x,y,x,y,...
+#
+# The header has the top-level keys of the JSON file under "data" and the
+# pieces under "pieces". Each piece has all its usual keys except that
+# "points" is replaced by [offset, count], in points from the start of the
+# coordinates, and so are the "points" of each of its "levels" (see
+# simplify.add_levels()). All integers are little-endian.
+
+import json
+import mmap
+import struct
+
+import numpy as np
+
+MAGIC = b"CLKB"
+VERSION = 1
+PREAMBLE = struct.Struct("<4sII")
+ALIGNMENT = 8
+
+DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float64": np.dtype("<f8"),
+}
+
+def write(data, out, dtype="float32"):
+    np_dtype = DTYPES[dtype]
+
+    # Build header and list of coordinate arrays.
+    arrays = []
+    offset = 0
+    pieces = []
+
+    # Adds the points to the coordinates and returns their [offset, count].
+    def add(points):
+        nonlocal offset
+        points = np.asarray(points, dtype=np_dtype).reshape(-1, 2)
+        arrays.append(points)
+        offset += len(points)
+        return [offset - len(points), len(points)]
+
+    for piece in data["pieces"]:
+        meta = dict(piece)
+        meta["points"] = add(piece["points"])
+        if "levels" in piece:
+            meta["levels"] = [dict(level, points=add(level["points"])) for level in piece["levels"]]
+        pieces.append(meta)
+
+    header = {
+        "dtype": dtype,
+        "data": dict((key, value) for key, value in data.items() if key != "pieces"),
+        "pieces": pieces,
+    }
+    header = json.dumps(header, separators=(",", ":"),
+            default=lambda obj: obj.to_JSON()).encode("utf-8")
+    header += b" "*(-(PREAMBLE.size + len(header)) % ALIGNMENT)
+
+    out.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+    out.write(header)
+    for points in arrays:
+        out.write(points.tobytes())
+
+def is_packed(filename):
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+# Returns the data in the same form as the JSON file, except that each
+# piece's "points" is a read-only (N, 2) array that maps directly onto the
+# file.
+def read(filename):
+    with open(filename, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, header_length = PREAMBLE.unpack_from(mm, 0)
+    if magic != MAGIC:
+        raise ValueError("%s is not a packed clock file" % filename)
+    if version != VERSION:
+        raise ValueError("%s has unsupported version %d" % (filename, version))
+
+    start = PREAMBLE.size + header_length
+    header = json.loads(mm[PREAMBLE.size:start].decode("utf-8"))
+    np_dtype = DTYPES[header["dtype"]]
+
+    data = header["data"]
+    data["pieces"] = header["pieces"]
+    def points(reference):
+        offset, count = reference
+        return np.frombuffer(mm, dtype=np_dtype, count=count*2,
+                offset=start + offset*2*np_dtype.itemsize).reshape(-1, 2)
+
+    for piece in data["pieces"]:
+        piece["points"] = points(piece["points"])
+        for level in piece.get("levels", []):
+            level["points"] = points(level["points"])
+
+    return data
@@ -17,29 +17,42 @@ import sys
 import math
 
 from vector import Vector
-from config import DPI, TAU, TIGHT_LARGE_BOLT_RADIUS, PENDULUM_HOLE_SEPARATION, PENDULUM_BAR_WIDTH, PENDULUM_BAR_HEIGHT, PENDULUM_WEIGHT_WIDTH, PENDULUM_WEIGHT_HEIGHT, LEFT_FULL_IN_ANGLE, RIGHT_FULL_IN_ANGLE
+from config import DPI, TAU, DEFAULT_CONFIG
 import draw
+import memo
 
 CORNER_RADIUS = DPI*0.25
 CORNER_POINTS = 32
 
-def add_holed_rectangle(data, origin, y_offset, cz, width, height, speed, color):
+# The fields of the config that holed_rectangle() uses, so that it's only
+# cached on those, as (hole separation, hole radius, left angle, right angle,
+# curve tolerance in points).
+def rectangle_params(config):
+    return (config.pendulum_hole_separation, config.tight_large_bolt_radius,
+            config.left_full_in_angle, config.right_full_in_angle,
+            draw.config_tolerance(config))
+
+# "params" is the rectangle_params() of the config.
+@memo.cached
+def holed_rectangle(origin, y_offset, cz, width, height, speed, color, params):
+    separation, hole_radius, left_full_in_angle, right_full_in_angle, tolerance = params
+
     P = []
     P.append(Vector(-width/2, y_offset))
     P.append(Vector(width/2, y_offset))
     P.append(Vector(width/2, y_offset + height))
     P.append(Vector(-width/2, y_offset + height))
-    P = draw.round_corners(P, CORNER_RADIUS, CORNER_POINTS)
+    P = draw.round_corners(P, CORNER_RADIUS, CORNER_POINTS, tolerance)
 
     holes = []
-    y = PENDULUM_HOLE_SEPARATION
-    while y < height - PENDULUM_HOLE_SEPARATION/2:
+    y = separation
+    while y < height - separation/2:
         holes.append({
             "cx": 0,
             "cy": y_offset + y,
-            "r": TIGHT_LARGE_BOLT_RADIUS,
+            "r": hole_radius,
         })
-        y += PENDULUM_HOLE_SEPARATION
+        y += separation
 
     piece = {
         "cx": origin.x,
@@ -50,26 +63,37 @@ def add_holed_rectangle(data, origin, y_offset, cz, width, height, speed, color)
         "speed": speed,
         "points": P,
         "holes": holes,
-        "left_full_in_angle": LEFT_FULL_IN_ANGLE,
-        "right_full_in_angle": RIGHT_FULL_IN_ANGLE,
+        "left_full_in_angle": left_full_in_angle,
+        "right_full_in_angle": right_full_in_angle,
     }
-    data["pieces"].append(piece)
+    return piece
+
+def add_holed_rectangle(data, origin, y_offset, cz, width, height, speed, color, config):
+    data["pieces"].append(holed_rectangle(origin, y_offset, cz, width, height, speed, color,
+        rectangle_params(config)))
+
+def add_bar(data, origin, y_offset, cz, speed, color, config):
+    add_holed_rectangle(data, origin, y_offset, cz, config.pendulum_bar_width,
+            config.pendulum_bar_height, speed, color, config)
+
+def add_weight(data, origin, y_offset, cz, speed, color, config):
+    add_holed_rectangle(data, origin, y_offset, cz, config.pendulum_weight_width,
+            config.pendulum_weight_height, speed, color, config)
 
-def add_bar(data, origin, y_offset, cz, speed, color):
-    add_holed_rectangle(data, origin, y_offset, cz, PENDULUM_BAR_WIDTH, PENDULUM_BAR_HEIGHT, speed, color)
+def generate(data, verge_center, y_offset, cz, speed, color, config=DEFAULT_CONFIG):
+    separation = config.pendulum_hole_separation
 
-def add_weight(data, origin, y_offset, cz, speed, color):
-    add_holed_rectangle(data, origin, y_offset, cz, PENDULUM_WEIGHT_WIDTH, PENDULUM_WEIGHT_HEIGHT, speed, color)
+    # Each bar overlaps the piece above it by four hole separations.
+    step = separation*(int(round(config.pendulum_bar_height/separation)) - 4)
 
-def generate(data, verge_center, y_offset, cz, speed, color):
-    y_offset -= PENDULUM_HOLE_SEPARATION
-    add_bar(data, verge_center, y_offset, cz + 1, speed, color)
+    y_offset -= separation
+    add_bar(data, verge_center, y_offset, cz + 1, speed, color, config)
 
-    y_offset += PENDULUM_HOLE_SEPARATION*13
-    add_bar(data, verge_center, y_offset, cz, speed, color)
+    y_offset += step
+    add_bar(data, verge_center, y_offset, cz, speed, color, config)
 
-    y_offset += PENDULUM_HOLE_SEPARATION*13
-    add_weight(data, verge_center, y_offset, cz + 1, speed, color)
-    add_weight(data, verge_center, y_offset, cz + 2, speed, color)
-    add_weight(data, verge_center, y_offset, cz - 1, speed, color)
-    add_weight(data, verge_center, y_offset, cz - 2, speed, color)
+    y_offset += step
+    add_weight(data, verge_center, y_offset, cz + 1, speed, color, config)
+    add_weight(data, verge_center, y_offset, cz + 2, speed, color, config)
+    add_weight(data, verge_center, y_offset, cz - 1, speed, color, config)
+    add_weight(data, verge_center, y_offset, cz - 2, speed, color, config)
@@ -0,0 +1,120 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from math import sin, cos
+
+import numpy as np
+
+# Contiguous list of 2D points, stored as an (N, 2) array of doubles. This is
+# what pieces keep in their "points" key. Iterating gives (x, y) tuples.
+# The array, x and y, and np.asarray() of a PointBuffer are read-only views,
+# so that the points only change through the methods below, which keep
+# bounds() up to date.
+class PointBuffer(object):
+    __slots__ = ("_array", "extents")
+
+    @staticmethod
+    def from_vectors(vectors):
+        return PointBuffer([(v.x, v.y) for v in vectors])
+
+    def __init__(self, array):
+        self._array = np.array(array, dtype=np.float64).reshape(-1, 2)
+        # Cached result of bounds().
+        self.extents = None
+
+    def __len__(self):
+        return len(self._array)
+
+    def __iter__(self):
+        return iter(map(tuple, self._array.tolist()))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PointBuffer(self._array[index])
+        x, y = self._array[index]
+        return float(x), float(y)
+
+    # Lets np.asarray() take a PointBuffer directly.
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.array
+        return self._array.astype(dtype)
+
+    def __str__(self):
+        return "PointBuffer(%d points)" % len(self._array)
+
+    def __repr__(self):
+        return str(self)
+
+    @property
+    def array(self):
+        return read_only(self._array)
+
+    @property
+    def x(self):
+        return read_only(self._array[:, 0])
+
+    @property
+    def y(self):
+        return read_only(self._array[:, 1])
+
+    @property
+    def nbytes(self):
+        return self._array.nbytes
+
+    def copy(self):
+        return PointBuffer(self._array)
+
+    # Returns (min x, min y, max x, max y, largest distance from the origin).
+    # Computed the first time and kept until the points are modified.
+    def bounds(self):
+        if self.extents is None:
+            if len(self._array) == 0:
+                self.extents = (0.0, 0.0, 0.0, 0.0, 0.0)
+            else:
+                low = self._array.min(axis=0)
+                high = self._array.max(axis=0)
+                radius = np.sqrt((self._array*self._array).sum(axis=1).max())
+                self.extents = (float(low[0]), float(low[1]),
+                        float(high[0]), float(high[1]), float(radius))
+        return self.extents
+
+    # The following modify the points in place.
+
+    def translate(self, dx, dy):
+        self._array += (dx, dy)
+        self.extents = None
+
+    def scale(self, sx, sy=None):
+        self._array *= (sx, sx if sy is None else sy)
+        self.extents = None
+
+    # Angle is in radians.
+    def rotate(self, angle):
+        c = cos(angle)
+        s = sin(angle)
+        x = self._array[:, 0].copy()
+        y = self._array[:, 1]
+        self._array[:, 0] = x*c - y*s
+        self._array[:, 1] = x*s + y*c
+        self.extents = None
+
+    def to_JSON(self):
+        return self._array.tolist()
+
+def read_only(array):
+    view = array.view()
+    view.flags.writeable = False
+    return view
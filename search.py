@@ -0,0 +1,532 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Search for tooth counts of a gear train. A train is a list of stages, each
+# a driver gear and the driven gear it meshes with. The driven gear of one
+# stage shares an axle with the driver of the next. The speed of the train
+# is the product of driver/driven over all stages, relative to the hour hand.
+#
+# The search is a depth-first branch-and-bound over the stages, with exact
+# rational arithmetic for the ratios. It looks for trains under a budget of
+# total teeth and raises the budget until it has enough of them, so the
+# pruning on teeth stays tight. The first stages are spread across a process
+# pool. The result is a ranked list of trains that GearTrain.add_stages()
+# takes directly. For example, trains with the ratios and layout of the
+# clock's are found with:
+#
+#     python search.py --ratio 1440 --stages 7 --checkpoint 2:12 \
+#         --coaxial 0,1 --directions WEEEEES --czs 0,2,4,2,0,4,2
+#
+# This takes about 14 seconds on one core and finds trains of 456 teeth.
+# The clock's own train (config.GEAR_STAGES, 551 teeth) has the same ratios
+# but wasn't picked for the fewest teeth, so it's not among them.
+#
+# The module, gear spacing and frame padding are those of the clock, changed
+# with --config as for clock.py.
+
+import sys
+import json
+import argparse
+import collections
+import heapq
+import bisect
+import math
+import multiprocessing
+from fractions import Fraction
+
+from config import DPI, DEFAULT_CONFIG, DIRECTION_NAMES, make_config
+import train
+
+# Default range of tooth counts. Smaller gears don't leave room for the
+# separators (see config.SEPARATOR_RADIUS).
+MIN_TEETH = 16
+MAX_TEETH = 64
+
+# Relative slack on floating point bounds, so that rounding never prunes a
+# train that the exact check would accept.
+EPSILON = 1e-9
+
+# Everything the search needs to know. "ratio" is the speed of the last
+# driven gear relative to the first driver, and "checkpoints" maps a stage
+# count to the required speed after that many stages (e.g., {2: 12} for the
+# minute hand). "tolerance" is the allowed relative error of both.
+# "coaxial" is a list of (i, j) stage indices whose center distances must be
+# equal, so that stage j comes back to the axle that stage i left.
+# "directions" and "czs" give the layout of each stage; the size limits (in
+# inches) are checked against the axle positions the same way that
+# frame.generate() does. "module", "gear_spacing" and "frame_padding" (in
+# points) come from the config.ClockConfig the train is for.
+Spec = collections.namedtuple("Spec", [
+    "ratio", "stage_count", "min_teeth", "max_teeth", "checkpoints",
+    "tolerance", "coaxial", "directions", "czs", "module", "gear_spacing",
+    "frame_padding", "max_width", "max_height", "step_up_only", "limit"])
+
+# A train found by the search. "stages" is a tuple of (driver, driven)
+# tooth counts.
+Candidate = collections.namedtuple("Candidate", [
+    "error", "total_teeth", "width", "height", "stages", "ratio"])
+
+def make_spec(ratio, stage_count, min_teeth=MIN_TEETH, max_teeth=MAX_TEETH, checkpoints=None,
+        tolerance=0, coaxial=(), directions=None, czs=None, module=None,
+        max_width=None, max_height=None, step_up_only=True, limit=20,
+        config=DEFAULT_CONFIG):
+
+    if module is None:
+        module = config.module
+
+    if directions is None:
+        directions = [train.EAST]*stage_count
+    if czs is None:
+        czs = [0]*stage_count
+
+    return Spec(Fraction(ratio), stage_count, min_teeth, max_teeth,
+            dict((int(k), Fraction(v)) for k, v in (checkpoints or {}).items()),
+            Fraction(tolerance), [tuple(c) for c in coaxial],
+            list(directions), list(czs), module, config.gear_spacing,
+            config.frame_padding, max_width, max_height, step_up_only, limit)
+
+# Returns the list of stages of the candidate, with layout, in the form
+# GearTrain.add_stages() takes.
+def train_stages(spec, candidate):
+    return [(driver, driven, direction, cz) for (driver, driven), direction, cz
+            in zip(candidate.stages, spec.directions, spec.czs)]
+
+# Offset from the driver axle to the driven axle of a stage, in points.
+def stage_offset(spec, index, driver, driven):
+    distance = (driver + driven)/2.0*spec.module + spec.gear_spacing
+    direction = spec.directions[index]
+    if direction == train.NORTH:
+        return 0, -distance
+    elif direction == train.EAST:
+        return distance, 0
+    elif direction == train.SOUTH:
+        return 0, distance
+    else:
+        return -distance, 0
+
+def within(value, target, tolerance):
+    return abs(value - target) <= target*tolerance
+
+# Depth-first search from a partial train, for trains with at most "budget"
+# teeth in total. Keeps the best spec.limit candidates in "best", a heap
+# keyed on the negated ranking.
+class Searcher:
+    def __init__(self, spec, budget):
+        self.spec = spec
+        self.budget = budget
+        self.best = []
+        self.lowest_ratio = float(spec.ratio*(1 - spec.tolerance))
+
+        # Next checkpoint at or after each stage count. The final ratio is
+        # the last checkpoint.
+        checkpoints = dict(spec.checkpoints)
+        checkpoints[spec.stage_count] = spec.ratio
+        self.next_checkpoint = []
+        for count in range(spec.stage_count + 1):
+            c = min(c for c in checkpoints if c >= count)
+            self.next_checkpoint.append((c, checkpoints[c]))
+
+        self.ratio_ranges = [ratio_range(spec, count) for count in range(spec.stage_count + 1)]
+
+        # Earlier stage that each stage must be coaxial with.
+        self.coaxial_with = {}
+        for i, j in spec.coaxial:
+            self.coaxial_with[max(i, j)] = min(i, j)
+
+        # Whether each stage can swap with the previous one without changing
+        # anything we measure. For those we only look at one order, with
+        # the stages sorted in decreasing order.
+        self.constrained = constrained = set(i for pair in spec.coaxial for i in pair)
+        self.interchangeable = [False]
+        for index in range(1, spec.stage_count):
+            self.interchangeable.append(
+                    index not in constrained and index - 1 not in constrained and
+                    index not in checkpoints and
+                    spec.directions[index] == spec.directions[index - 1])
+
+        self.ratio_values, self.smallest_pairs = smallest_pairs(spec)
+
+        # Stages where the search can look up the last two stages before a
+        # checkpoint in a table instead of trying each pair in turn. That
+        # only works for exact ratios.
+        self.table_stages = set()
+        if spec.tolerance == 0:
+            for index in range(spec.stage_count - 1):
+                if (index not in constrained and index + 1 not in constrained and
+                        self.next_checkpoint[index + 1][0] == index + 2):
+                    self.table_stages.add(index)
+        self.table = two_stage_table(spec, self.smallest_pairs) if self.table_stages else None
+
+    # "options" overrides the (driver, driven) pairs to try for the next
+    # stage.
+    def search(self, stages, ratio, teeth, x, y, bounds, options=None):
+        spec = self.spec
+        index = len(stages)
+
+        if index == spec.stage_count:
+            self.add(stages, ratio, teeth, bounds)
+            return
+
+        if options is None:
+            if index in self.table_stages:
+                self.search_table(stages, ratio, teeth, x, y, bounds)
+                return
+            options = self.options(stages, ratio, teeth)
+
+        for driver, driven in options:
+            new_ratio = ratio*Fraction(driver, driven)
+            if not self.feasible(index + 1, new_ratio):
+                continue
+
+            dx, dy = stage_offset(spec, index, driver, driven)
+            nx = x + dx
+            ny = y + dy
+            new_bounds = (min(bounds[0], nx), min(bounds[1], ny),
+                          max(bounds[2], nx), max(bounds[3], ny))
+            if not self.fits(new_bounds):
+                continue
+
+            self.search(stages + ((driver, driven),), new_ratio,
+                    teeth + driver + driven, nx, ny, new_bounds)
+
+    # Finish the last two stages before a checkpoint by looking up the ratio
+    # they must make in the table.
+    def search_table(self, stages, ratio, teeth, x, y, bounds):
+        spec = self.spec
+        index = len(stages)
+        checkpoint, value = self.next_checkpoint[index + 2]
+        limit = self.teeth_limit()
+        remaining = spec.stage_count - checkpoint
+        lowest = self.lowest_ratio/float(value)
+
+        needed = value/ratio
+        for first, second in self.table.get((needed.numerator, needed.denominator), ()):
+            # Keep interchangeable stages in decreasing order.
+            if self.interchangeable[index] and first[0]*stages[-1][1] > stages[-1][0]*first[1]:
+                continue
+            if self.interchangeable[index + 1] and second[0]*first[1] > first[0]*second[1]:
+                continue
+            new_teeth = teeth + sum(first) + sum(second)
+            if remaining > 0 and self.teeth_bound(remaining, 1/lowest, new_teeth) > limit:
+                continue
+            if remaining == 0 and new_teeth > limit:
+                continue
+
+            new_x, new_y, new_bounds = x, y, bounds
+            for offset, (driver, driven) in enumerate((first, second)):
+                dx, dy = stage_offset(spec, index + offset, driver, driven)
+                new_x += dx
+                new_y += dy
+                new_bounds = (min(new_bounds[0], new_x), min(new_bounds[1], new_y),
+                              max(new_bounds[2], new_x), max(new_bounds[3], new_y))
+            if not self.fits(new_bounds):
+                continue
+
+            self.search(stages + (first, second), value, new_teeth, new_x, new_y, new_bounds)
+
+    # Possible (driver, driven) pairs for the next stage, limited to those
+    # that can still reach the next checkpoint and stay within the teeth
+    # limit. Floating point is only used to narrow the choices; feasible()
+    # makes the exact check.
+    def options(self, stages, ratio, teeth):
+        spec = self.spec
+        index = len(stages)
+        count = index + 1
+        checkpoint, value = self.next_checkpoint[count]
+        remaining = spec.stage_count - count
+        ratio = float(ratio)
+        limit = self.teeth_limit()
+
+        # Range of this stage's ratio that lets the stages after it reach
+        # the checkpoint.
+        low, high = self.ratio_ranges[checkpoint - count]
+        lowest = float(value*(1 - spec.tolerance)/high)/ratio*(1 - EPSILON)
+        highest = float(value*(1 + spec.tolerance)/low)/ratio*(1 + EPSILON)
+
+        if index in self.constrained:
+            # Coaxial stages need every pair, not just the smallest one for
+            # each ratio, since their center distances have to match.
+            for driver in range(spec.min_teeth, spec.max_teeth + 1):
+                if index in self.coaxial_with:
+                    partner = stages[self.coaxial_with[index]]
+                    drivens = [sum(partner) - driver]
+                else:
+                    first = max(spec.min_teeth, int(math.ceil(driver/highest)))
+                    last = min(spec.max_teeth, int(math.floor(driver/lowest)))
+                    drivens = range(first, last + 1)
+
+                for driven in drivens:
+                    if driven < spec.min_teeth or driven > spec.max_teeth:
+                        continue
+                    if spec.step_up_only and driven >= driver:
+                        continue
+                    # The bound only grows with the driven gear.
+                    if self.teeth_bound(remaining, ratio*driver/driven,
+                            teeth + driver + driven) > limit:
+                        break
+                    yield driver, driven
+        else:
+            # Other stages only need the smallest gears for each ratio, since
+            # larger gears with the same ratio would rank lower on every
+            # count. Interchangeable stages are kept in decreasing order.
+            if self.interchangeable[index]:
+                driver, driven = stages[-1]
+                highest = min(highest, float(driver)/driven*(1 + EPSILON))
+
+            begin = bisect.bisect_left(self.ratio_values, lowest)
+            end = bisect.bisect_right(self.ratio_values, highest)
+            for driver, driven in self.smallest_pairs[begin:end]:
+                if self.teeth_bound(remaining, ratio*driver/driven,
+                        teeth + driver + driven) <= limit:
+                    yield driver, driven
+
+    # Whether the checkpoints can still be reached after "count" stages.
+    def feasible(self, count, ratio):
+        spec = self.spec
+        checkpoint, value = self.next_checkpoint[count]
+        if checkpoint == count:
+            return within(ratio, value, spec.tolerance)
+        low, high = self.ratio_ranges[checkpoint - count]
+        return (ratio*low <= value*(1 + spec.tolerance) and
+                ratio*high >= value*(1 - spec.tolerance))
+
+    # Lower bound on the total teeth of a train with "remaining" stages left
+    # to go, given the ratio and teeth so far. A stage with ratio r has at
+    # least min_teeth*(1 + r) teeth (or min_teeth*(1 + 1/r) when stepping
+    # down), and for a given product of ratios that sum is smallest when all
+    # the ratios are equal.
+    def teeth_bound(self, remaining, ratio, teeth):
+        spec = self.spec
+        if remaining == 0:
+            return teeth
+        needed = self.lowest_ratio/ratio
+        if needed < 1:
+            needed = 1.0 if spec.step_up_only else 1/needed
+        return teeth + remaining*spec.min_teeth*(1 + needed**(1.0/remaining))*(1 - EPSILON)
+
+    # Most teeth a train can have and still make it into the list. Once the
+    # list is full of exact trains, they're ranked by teeth.
+    def teeth_limit(self):
+        if len(self.best) == self.spec.limit:
+            worst = self.best[0][1]
+            if worst.error == 0:
+                return min(self.budget, worst.total_teeth)
+        return self.budget
+
+    def fits(self, bounds):
+        spec = self.spec
+        width, height = frame_size(spec, bounds)
+        return ((spec.max_width is None or width <= spec.max_width) and
+                (spec.max_height is None or height <= spec.max_height))
+
+    def add(self, stages, ratio, teeth, bounds):
+        spec = self.spec
+        width, height = frame_size(spec, bounds)
+        error = abs(ratio - spec.ratio)/spec.ratio
+        candidate = Candidate(error, teeth, width, height, stages, ratio)
+        key = ranking(candidate)
+        item = (negate(key), candidate)
+        if len(self.best) < spec.limit:
+            heapq.heappush(self.best, item)
+        elif key < ranking(self.best[0][1]):
+            heapq.heapreplace(self.best, item)
+
+# Tables that only depend on the range of teeth, by (min_teeth, max_teeth,
+# step_up_only). Built once per process.
+PAIRS = {}
+TABLES = {}
+
+# Returns the ratios that one stage can make, sorted, as floats, and the
+# smallest (driver, driven) pair for each.
+def smallest_pairs(spec):
+    key = (spec.min_teeth, spec.max_teeth, spec.step_up_only)
+    if key not in PAIRS:
+        smallest = {}
+        for driver in range(spec.min_teeth, spec.max_teeth + 1):
+            for driven in range(spec.min_teeth, spec.max_teeth + 1):
+                if spec.step_up_only and driven >= driver:
+                    continue
+                r = Fraction(driver, driven)
+                if r not in smallest or driver + driven < sum(smallest[r]):
+                    smallest[r] = (driver, driven)
+        keys = sorted(smallest)
+        PAIRS[key] = ([float(r) for r in keys], [smallest[r] for r in keys])
+    return PAIRS[key]
+
+# Maps each ratio that two stages can make, as a (numerator, denominator)
+# tuple in lowest terms, to the list of (first, second) stages that make it.
+# "pairs" is the smallest pair of gears for each stage ratio.
+def two_stage_table(spec, pairs):
+    key = (spec.min_teeth, spec.max_teeth, spec.step_up_only)
+    if key not in TABLES:
+        table = collections.defaultdict(list)
+        for first in pairs:
+            for second in pairs:
+                numerator = first[0]*second[0]
+                denominator = first[1]*second[1]
+                divisor = math.gcd(numerator, denominator)
+                table[numerator//divisor, denominator//divisor].append((first, second))
+        TABLES[key] = dict(table)
+    return TABLES[key]
+
+# Ratio range that "count" more stages can give.
+def ratio_range(spec, count):
+    if spec.step_up_only:
+        low = Fraction(1)
+    else:
+        low = Fraction(spec.min_teeth, spec.max_teeth)
+    high = Fraction(spec.max_teeth, spec.min_teeth)
+    return low**count, high**count
+
+# Size in inches of the frame around the axles.
+def frame_size(spec, bounds):
+    min_x, min_y, max_x, max_y = bounds
+    return ((max_x - min_x + 2*spec.frame_padding)/DPI,
+            (max_y - min_y + 2*spec.frame_padding)/DPI)
+
+# Lower is better: exact ratios first, then fewer teeth (less material and
+# inertia), then smaller frames. The stages make the order total.
+def ranking(candidate):
+    return (candidate.error, candidate.total_teeth, candidate.width*candidate.height,
+            candidate.stages)
+
+# Turns the ranking into something that sorts the other way, so that the
+# heap's smallest item is the worst candidate.
+def negate(key):
+    error, total_teeth, area, stages = key
+    return (-error, -total_teeth, -area, tuple((-a, -b) for a, b in stages))
+
+# Search all trains whose first stage is "first". Runs in a worker process.
+def search_first_stage(args):
+    spec, budget, first = args
+    searcher = Searcher(spec, budget)
+    driver, driven = first
+    if searcher.teeth_bound(spec.stage_count - 1, float(driver)/driven,
+            driver + driven) > budget:
+        return []
+    searcher.search((), Fraction(1), 0, 0, 0, (0, 0, 0, 0), [first])
+    return [candidate for _, candidate in searcher.best]
+
+# Returns up to spec.limit candidates, best first. Searches for trains under
+# a budget of total teeth, starting at the lowest possible number and raising
+# it until enough trains are found. Trains with a lower error but more teeth
+# than the final budget are not considered.
+def search(spec, processes=None, out=None):
+    most_teeth = spec.stage_count*2*spec.max_teeth
+    searcher = Searcher(spec, most_teeth)
+    firsts = list(searcher.options((), Fraction(1), 0))
+    budget = int(searcher.teeth_bound(spec.stage_count, 1.0, 0))
+
+    if processes != 1:
+        pool = multiprocessing.Pool(processes)
+
+    while True:
+        jobs = [(spec, budget, first) for first in firsts]
+        if processes == 1:
+            results = map(search_first_stage, jobs)
+        else:
+            results = pool.imap_unordered(search_first_stage, jobs)
+
+        candidates = []
+        for result in results:
+            candidates.extend(result)
+        if out is not None:
+            out.write("Found %d trains with at most %d teeth.\n" % (len(candidates), budget))
+
+        if len(candidates) >= spec.limit or budget >= most_teeth:
+            break
+        budget = min(most_teeth, int(budget*1.05) + 1)
+
+    if processes != 1:
+        pool.close()
+        pool.join()
+
+    candidates.sort(key=ranking)
+    return candidates[:spec.limit]
+
+def main():
+    parser = argparse.ArgumentParser(description='Search for gear train tooth counts.')
+    parser.add_argument("--ratio", default="1440",
+            help="speed of the last gear relative to the first, e.g. 1440 or 2880/3")
+    parser.add_argument("--stages", type=int, default=7, help="number of stages")
+    parser.add_argument("--min-teeth", type=int, default=MIN_TEETH,
+            help="fewest teeth on a gear (default: %(default)s)")
+    parser.add_argument("--max-teeth", type=int, default=MAX_TEETH,
+            help="most teeth on a gear (default: %(default)s)")
+    parser.add_argument("--checkpoint", action="append", default=[], metavar="STAGES:RATIO",
+            help="required ratio after a number of stages, e.g. 2:12 for the minute hand")
+    parser.add_argument("--tolerance", default="0",
+            help="allowed relative error of the ratios (default: exact)")
+    parser.add_argument("--coaxial", action="append", default=[], metavar="I,J",
+            help="stages I and J must have the same center distance")
+    parser.add_argument("--directions", default=None,
+            help="direction of each stage, e.g. WEEEEES (default: all E)")
+    parser.add_argument("--czs", default=None, help="comma-separated cz of each stage")
+    parser.add_argument("--max-width", type=float, help="maximum frame width in inches")
+    parser.add_argument("--max-height", type=float, help="maximum frame height in inches")
+    parser.add_argument("--allow-step-down", action="store_true",
+            help="allow stages where the driven gear is larger than the driver")
+    parser.add_argument("--limit", type=int, default=10, help="number of trains to output")
+    parser.add_argument("--processes", type=int, default=None,
+            help="number of worker processes (default: one per core)")
+    parser.add_argument("--config", metavar="FILENAME",
+            help="JSON file of changes to the parameters in config.py, as for clock.py")
+    args = parser.parse_args()
+
+    params = {}
+    if args.config:
+        with open(args.config) as f:
+            params = json.load(f)
+    config = make_config(params)
+
+    directions = None
+    if args.directions is not None:
+        directions = [DIRECTION_NAMES[d] for d in args.directions.upper()]
+    czs = None
+    if args.czs is not None:
+        czs = [int(cz) for cz in args.czs.split(",")]
+
+    spec = make_spec(Fraction(args.ratio), args.stages,
+            min_teeth=args.min_teeth,
+            max_teeth=args.max_teeth,
+            checkpoints=dict(c.split(":") for c in args.checkpoint),
+            tolerance=Fraction(args.tolerance),
+            coaxial=[[int(i) for i in c.split(",")] for c in args.coaxial],
+            directions=directions,
+            czs=czs,
+            max_width=args.max_width,
+            max_height=args.max_height,
+            step_up_only=not args.allow_step_down,
+            limit=args.limit,
+            config=config)
+
+    candidates = search(spec, args.processes, sys.stderr)
+
+    results = []
+    for candidate in candidates:
+        results.append({
+            "stages": train_stages(spec, candidate),
+            "ratio": str(candidate.ratio),
+            "error": float(candidate.error),
+            "total_teeth": candidate.total_teeth,
+            "width": candidate.width,
+            "height": candidate.height,
+        })
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write("\n")
+    sys.stderr.write("Found %d trains.\n" % len(results))
+
+if __name__ == "__main__":
+    main()
@@ -13,22 +13,25 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-import math
+import numpy as np
 
 from config import TAU, SEPARATOR_RADIUS
-from vector import Vector
-
-# Closed circle.
-def generate_circle_points(x, y, r, n):
-    p = []
-
-    for i in range(n + 1):
-        t = float(i)/n*TAU
-        p.append(Vector(x + math.cos(t)*r, y + math.sin(t)*r))
-
-    return p
-
-def generate(x, y, hole_radius):
+from points import PointBuffer
+import draw
+import memo
+
+# Closed circle of "n" segments, or as many as needed to stay within
+# "tolerance" (in points) of the circle. See draw.add_bezier().
+def generate_circle_points(x, y, r, n, tolerance=None):
+    if tolerance is not None:
+        n = draw.arc_segment_count(r, TAU, tolerance)
+
+    t = np.arange(n + 1, dtype=float)/n*TAU
+    return PointBuffer(np.column_stack((x + np.cos(t)*r, y + np.sin(t)*r)))
+
+# "tolerance" is the draw.config_tolerance() of the config.
+@memo.cached
+def generate(x, y, hole_radius, radius=SEPARATOR_RADIUS, tolerance=None):
     piece = {
         "type": "separator",
         "cx": x,
@@ -36,8 +39,8 @@ def generate(x, y, hole_radius):
         "cz": 0,
         "color": "#FFFFFF",
         "hole_radius": hole_radius,
-        "outer_radius": SEPARATOR_RADIUS,
-        "points": generate_circle_points(0, 0, SEPARATOR_RADIUS, 100),
+        "outer_radius": radius,
+        "points": generate_circle_points(0, 0, radius, 100, tolerance),
         "speed": 0,
     }
     return piece
@@ -0,0 +1,357 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Static web server for the viewer. Files are read and gzipped once per
+# version (the viewer's files are gzipped when the server starts) and kept
+# in memory with a strong ETag, so a reload that has nothing new gets 304
+# responses without reading anything. Byte ranges are served from the
+# uncompressed file. Clients are handled concurrently by asyncio, and files
+# are loaded and compressed in a thread so that they don't hold up the
+# others. Run it in the directory of the viewer:
+#
+#     python serve.py
+
+import os
+import sys
+import gzip
+import time
+import asyncio
+import hashlib
+import argparse
+import collections
+import email.utils
+import urllib.parse
+
+DEFAULT_PORT = 8000
+
+# Content types by extension. Other files aren't served.
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+    ".json": "application/json",
+    ".bin": "application/octet-stream",
+    ".build": "text/plain; charset=utf-8",
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".css": "text/css; charset=utf-8",
+}
+
+# Types that are already compressed.
+INCOMPRESSIBLE = set([".png"])
+
+# Files smaller than this aren't worth compressing.
+MIN_COMPRESS_SIZE = 1024
+
+# Seconds to keep an idle connection open.
+KEEP_ALIVE_TIMEOUT = 15
+
+MAX_HEADERS = 100
+
+# Everything is revalidated on each load, since clock.py --watch can
+# replace the data at any time. The revalidation is a 304.
+CACHE_CONTROL = "no-cache"
+
+REASONS = {
+    200: "OK",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    416: "Range Not Satisfiable",
+}
+
+# One version of a file. "gzipped" is None if it's not worth compressing.
+Asset = collections.namedtuple("Asset", ["mtime", "size", "body", "gzipped", "etag", "content_type"])
+
+def load_asset(filename, st):
+    with open(filename, "rb") as f:
+        body = f.read()
+    extension = os.path.splitext(filename)[1]
+    gzipped = None
+    if extension not in INCOMPRESSIBLE and len(body) >= MIN_COMPRESS_SIZE:
+        gzipped = gzip.compress(body, 9, mtime=0)
+        if len(gzipped) >= len(body):
+            gzipped = None
+    etag = '"%s"' % hashlib.sha1(body).hexdigest()[:24]
+    return Asset(st.st_mtime_ns, len(body), body, gzipped, etag, CONTENT_TYPES[extension])
+
+# Assets by filename, loaded again when the file's modification time or
+# size changes.
+class AssetCache:
+    def __init__(self, directory):
+        self.directory = os.path.realpath(directory)
+        self.assets = {}
+        # Loads in progress, so that clients that ask at the same time
+        # share one.
+        self.loading = {}
+        self.loads = 0
+
+    # Filename for the URL path, or None if it's not one we serve.
+    def filename(self, path):
+        if path.endswith("/"):
+            path += "index.html"
+        filename = os.path.realpath(os.path.join(self.directory, path.lstrip("/")))
+        if os.path.dirname(filename) != self.directory:
+            return None
+        if os.path.splitext(filename)[1] not in CONTENT_TYPES:
+            return None
+        return filename
+
+    # Returns the Asset of the file, or None if there's no such file.
+    async def get(self, filename):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        asset = self.assets.get(filename)
+        if asset is not None and asset.mtime == st.st_mtime_ns and asset.size == st.st_size:
+            return asset
+
+        key = (filename, st.st_mtime_ns, st.st_size)
+        future = self.loading.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(None, load_asset, filename, st)
+            self.loading[key] = future
+            self.loads += 1
+        try:
+            asset = await future
+        except OSError:
+            return None
+        finally:
+            self.loading.pop(key, None)
+        self.assets[filename] = asset
+        return asset
+
+    # Load everything we'd serve in the directory.
+    async def preload(self):
+        names = sorted(os.listdir(self.directory))
+        filenames = [self.filename("/" + name) for name in names]
+        filenames = [filename for filename in filenames
+                if filename is not None and os.path.isfile(filename)]
+        await asyncio.gather(*[self.get(filename) for filename in filenames])
+        return filenames
+
+# Whether the Accept-Encoding header allows gzip.
+def accepts_gzip(header):
+    for item in header.split(","):
+        parts = [part.strip() for part in item.split(";")]
+        if parts[0].lower() in ("gzip", "*"):
+            for param in parts[1:]:
+                if param.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                    return False
+            return True
+    return False
+
+# Whether any of the ETags in an If-None-Match header is "etag", using the
+# weak comparison.
+def etag_matches(header, etag):
+    for item in header.split(","):
+        item = item.strip()
+        if item == "*" or item == etag or item == "W/" + etag:
+            return True
+    return False
+
+# Parses a Range header for a body of "size" bytes. Returns (start, end)
+# with "end" exclusive, "unsatisfiable", or None to ignore the header.
+# Only single ranges are supported; the whole body is sent for others.
+def parse_range(header, size):
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, dash, last = ranges.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if first == "":
+            # Suffix: the last "last" bytes.
+            length = int(last)
+            if length == 0:
+                return "unsatisfiable"
+            return (max(size - length, 0), size)
+        start = int(first)
+        end = int(last) + 1 if last != "" else size
+    except ValueError:
+        return None
+    if start >= size:
+        return "unsatisfiable"
+    if end <= start:
+        return None
+    return (start, min(end, size))
+
+class Server:
+    def __init__(self, cache, quiet=False):
+        self.cache = cache
+        self.quiet = quiet
+        self.requests = 0
+        self.bytes_sent = 0
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                headers = {}
+                for _ in range(MAX_HEADERS):
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                else:
+                    await self.send(writer, "GET", 400, {}, b"Too many headers\n", False)
+                    break
+
+                keep_alive = await self.respond(writer, request_line.decode("latin-1"), headers)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    # Answers one request. Returns whether to keep the connection open.
+    async def respond(self, writer, request_line, headers):
+        parts = request_line.split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            await self.send(writer, "GET", 400, {}, b"Bad request\n", False)
+            return False
+        method, target, version = parts
+
+        keep_alive = version != "HTTP/1.0"
+        connection = headers.get("connection", "").lower()
+        if connection == "close":
+            keep_alive = False
+        elif connection == "keep-alive":
+            keep_alive = True
+
+        if method not in ("GET", "HEAD"):
+            await self.send(writer, method, 405, {"Allow": "GET, HEAD"}, b"Method not allowed\n", keep_alive)
+            return keep_alive
+
+        path = urllib.parse.unquote(urllib.parse.urlsplit(target).path)
+        filename = self.cache.filename(path)
+        asset = await self.cache.get(filename) if filename is not None else None
+        if asset is None:
+            await self.send(writer, method, 404, {}, b"Not found\n", keep_alive)
+            self.log(method, target, 404, 0)
+            return keep_alive
+
+        response_headers = {
+            "Content-Type": asset.content_type,
+            "Cache-Control": CACHE_CONTROL,
+            "Accept-Ranges": "bytes",
+            "Last-Modified": email.utils.formatdate(asset.mtime/1e9, usegmt=True),
+        }
+        if asset.gzipped is not None:
+            response_headers["Vary"] = "Accept-Encoding"
+
+        # Ranges are served from the uncompressed body.
+        byte_range = None
+        if "range" in headers:
+            if_range = headers.get("if-range")
+            if if_range is None or if_range == asset.etag:
+                byte_range = parse_range(headers["range"], asset.size)
+
+        use_gzip = (asset.gzipped is not None and byte_range is None and
+                accepts_gzip(headers.get("accept-encoding", "")))
+        etag = asset.etag[:-1] + '-gzip"' if use_gzip else asset.etag
+        response_headers["ETag"] = etag
+
+        if "if-none-match" in headers and etag_matches(headers["if-none-match"], etag):
+            await self.send(writer, "HEAD", 304, response_headers, b"", keep_alive)
+            self.log(method, target, 304, 0)
+            return keep_alive
+
+        if byte_range == "unsatisfiable":
+            response_headers["Content-Range"] = "bytes */%d" % asset.size
+            await self.send(writer, method, 416, response_headers, b"", keep_alive)
+            self.log(method, target, 416, 0)
+            return keep_alive
+
+        if byte_range is not None:
+            start, end = byte_range
+            status = 206
+            body = asset.body[start:end]
+            response_headers["Content-Range"] = "bytes %d-%d/%d" % (start, end - 1, asset.size)
+        elif use_gzip:
+            status = 200
+            body = asset.gzipped
+            response_headers["Content-Encoding"] = "gzip"
+        else:
+            status = 200
+            body = asset.body
+
+        await self.send(writer, method, status, response_headers, body, keep_alive)
+        self.log(method, target, status, len(body))
+        return keep_alive
+
+    async def send(self, writer, method, status, headers, body, keep_alive):
+        lines = ["HTTP/1.1 %d %s" % (status, REASONS[status])]
+        lines.append("Date: %s" % email.utils.formatdate(usegmt=True))
+        lines.append("Server: clock-serve")
+        for name, value in headers.items():
+            lines.append("%s: %s" % (name, value))
+        if status != 304:
+            lines.append("Content-Length: %d" % len(body))
+        lines.append("Connection: %s" % ("keep-alive" if keep_alive else "close"))
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if method != "HEAD" and status != 304:
+            # memoryview so that a large body isn't copied.
+            writer.write(memoryview(body))
+            self.bytes_sent += len(body)
+        self.requests += 1
+        await writer.drain()
+
+    def log(self, method, target, status, length):
+        if not self.quiet:
+            sys.stderr.write("%s %s %s %d %d\n" % (time.strftime("%H:%M:%S"), method, target, status, length))
+
+async def serve(directory, host, port, quiet):
+    cache = AssetCache(directory)
+    start = time.perf_counter()
+    filenames = await cache.preload()
+    sys.stderr.write("Loaded %d files in %.2f seconds.\n" % (len(filenames), time.perf_counter() - start))
+
+    server = Server(cache, quiet)
+    listener = await asyncio.start_server(server.handle, host, port)
+    sys.stderr.write("Serving %s at http://localhost:%d/\n" % (cache.directory, port))
+    async with listener:
+        await listener.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the viewer.')
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+            help="port to listen on (default: %(default)d)")
+    parser.add_argument("--bind", metavar="ADDRESS", default=None,
+            help="address to listen on (default: all)")
+    parser.add_argument("--directory", default=os.path.dirname(os.path.abspath(__file__)),
+            help="directory to serve (default: the one this program is in)")
+    parser.add_argument("--quiet", action="store_true",
+            help="don't log each request")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.directory, args.bind, args.port, args.quiet))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Remove vertices from outlines that the laser can't tell apart anyway.
+
+import numpy as np
+
+from points import PointBuffer
+
+# Consecutive vertices closer than this (in points) are considered duplicates.
+DUPLICATE_DISTANCE = 1e-9
+
+# Tolerances in inches of the coarser outlines that add_levels() makes for
+# the viewer, from finest to coarsest.
+LEVEL_TOLERANCES = [0.002, 0.008, 0.032]
+
+# Distance from each point in the (N, 2) array "p" to the segment from "a"
+# to "b".
+def segment_distance(p, a, b):
+    ab = b - a
+    length2 = np.dot(ab, ab)
+    if length2 == 0:
+        return np.hypot(p[:, 0] - a[0], p[:, 1] - a[1])
+    t = np.clip(np.dot(p - a, ab)/length2, 0, 1)
+    closest = a + t[:, np.newaxis]*ab
+    return np.hypot(p[:, 0] - closest[:, 0], p[:, 1] - closest[:, 1])
+
+# Drop vertices that are the same as the previous one.
+def remove_duplicates(p):
+    if len(p) < 2:
+        return p
+    keep = np.ones(len(p), dtype=bool)
+    keep[1:] = np.hypot(*(p[1:] - p[:-1]).T) > DUPLICATE_DISTANCE
+    return p[keep]
+
+# Douglas-Peucker reduction of the (N, 2) array "p". The result never
+# strays more than "tolerance" from the original. The first and last points
+# are always kept, so closed outlines stay closed.
+def douglas_peucker(p, tolerance):
+    n = len(p)
+    if n < 3:
+        return p
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    # Ranges still to look at. Use our own stack, outlines can be long.
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        d = segment_distance(p[i + 1:j], p[i], p[j])
+        k = int(np.argmax(d))
+        if d[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+
+    return p[keep]
+
+# For each vertex of "p", the largest tolerance at which douglas_peucker()
+# keeps it, for tolerances of at least "tolerance". Vertices that are
+# dropped at "tolerance" get 0, and the first and last get infinity. A
+# vertex is kept at a tolerance only if it and every split above it are
+# farther than that, so one pass gives all the coarser results.
+def keep_tolerances(p, tolerance):
+    n = len(p)
+    result = np.zeros(n)
+    result[0] = result[-1] = np.inf
+
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        i, j, limit = stack.pop()
+        if j - i < 2:
+            continue
+        d = segment_distance(p[i + 1:j], p[i], p[j])
+        k = int(np.argmax(d))
+        if d[k] > tolerance:
+            value = min(d[k], limit)
+            k += i + 1
+            result[k] = value
+            stack.append((i, k, value))
+            stack.append((k, j, value))
+
+    return result
+
+def simplify(p, tolerance):
+    return douglas_peucker(remove_duplicates(p), tolerance)
+
+# Simplify the outline of every piece in place. "tolerance" is the maximum
+# deviation in inches. If "out" is specified, write the number of vertices
+# removed from each piece. Returns the total number removed.
+def simplify_pieces(data, tolerance, out=None):
+    tolerance *= data["dpi"]
+    total_before = 0
+    total_removed = 0
+
+    for piece_index, piece in enumerate(data["pieces"]):
+        before = np.asarray(piece["points"], dtype=float).reshape(-1, 2)
+        after = simplify(before, tolerance)
+        piece["points"] = PointBuffer(after)
+
+        removed = len(before) - len(after)
+        total_before += len(before)
+        total_removed += removed
+        if out is not None:
+            out.write("Simplified %s_%d from %d to %d vertices (%d removed).\n" % (
+                piece["type"], piece_index, len(before), len(after), removed))
+
+    if out is not None:
+        out.write("Simplification removed %d of %d vertices.\n" % (total_removed, total_before))
+
+    return total_removed
+
+# Give every piece a "levels" list of coarser versions of its outline for
+# the viewer, from finest to coarsest. Each is a dict with the "tolerance"
+# in inches and the "points" simplified to it from the piece's "points",
+# which stay the finest level. A level that doesn't have fewer vertices
+# than the one before it is left out. If "out" is specified, write the
+# total number of vertices of each level.
+def add_levels(data, tolerances=LEVEL_TOLERANCES, out=None):
+    dpi = data["dpi"]
+    totals = [0]*(len(tolerances) + 1)
+
+    for piece in data["pieces"]:
+        p = np.asarray(piece["points"], dtype=float).reshape(-1, 2)
+        totals[0] += len(p)
+        p = remove_duplicates(p)
+        keep = keep_tolerances(p, min(tolerances)*dpi) if len(p) >= 3 else np.full(len(p), np.inf)
+        levels = []
+        count = len(p)
+        for index, tolerance in enumerate(tolerances):
+            level = p[keep > tolerance*dpi]
+            if len(level) < count:
+                levels.append({
+                    "tolerance": tolerance,
+                    "points": PointBuffer(level),
+                })
+                count = len(level)
+            totals[index + 1] += count
+        piece["levels"] = levels
+
+    if out is not None:
+        out.write("Levels of detail have %s vertices.\n" % ", ".join(
+            ["%d" % totals[0]] + ["%d (%g inches)" % (total, tolerance)
+                for total, tolerance in zip(totals[1:], tolerances)]))
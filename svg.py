@@ -13,11 +13,74 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import re
+
+import numpy as np
+
 from config import SCALE
 
 # "Hairline" in AI.
 STROKE_WIDTH = 1.001
 
+# Number of characters to collect before writing to the real output.
+CHUNK_SIZE = 1024*1024
+
+# Trailing zeros after the decimal point, or the whole fraction if it's all
+# zeros.
+TRAILING_ZEROS_RE = re.compile(r"\.0+\b|(\.\d*?[1-9])0+\b")
+
+# Zero before the decimal point, which paths can do without.
+LEADING_ZERO_RE = re.compile(r"\b0\.")
+
+# Collects the many small writes of the functions below and passes them on to
+# "out" in large chunks. Call flush() when done.
+class BufferedWriter:
+    def __init__(self, out, chunk_size=CHUNK_SIZE):
+        self.out = out
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.size = 0
+
+    def write(self, s):
+        self.chunks.append(s)
+        self.size += len(s)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.out.write("".join(self.chunks))
+        self.out.flush()
+        self.chunks = []
+        self.size = 0
+
+# Round values to "precision" decimal places, always giving the same string
+# for the same input. With a precision of None uses %g.
+def format_number(value, precision=None):
+    if precision is None:
+        return "%g" % value
+    return strip_zeros("%.*f" % (precision, round_number(value, precision)))
+
+# Works on arrays too. Adding 0.0 turns -0.0 into 0.0.
+def round_number(value, precision):
+    return np.rint(value*10**precision)/10**precision + 0.0
+
+def strip_zeros(s):
+    return TRAILING_ZEROS_RE.sub(lambda m: m.group(1) or "", s)
+
+# Space-separated "x,y" pairs for an (N, 2) array, formatted in one go.
+def format_pairs(a, precision=None):
+    if len(a) == 0:
+        return ""
+    if precision is None:
+        pair = "%g,%g"
+    else:
+        pair = "%%.%df,%%.%df" % (precision, precision)
+        a = round_number(a, precision)
+    s = " ".join([pair]*len(a)) % tuple(a.ravel().tolist())
+    if precision is not None:
+        s = strip_zeros(s)
+    return s
+
 def header(out, width, height):
     out.write("""<?xml version="1.0" encoding="utf-8"?>
 <!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.0//EN"    "http://www.w3.org/TR/2001/REC-SVG-20010904/DTD/svg10.dtd" [
@@ -30,8 +93,12 @@ def header(out, width, height):
     <!-- <rect x="0" y="0" width="%g" height="%g" fill="none" stroke="#000000"/> -->
 """ % (width, height, SCALE, SCALE, width, height))
 
-def start_group(out, name, dx=0, dy=0):
-    out.write("""<g id="%s" transform="translate(%g,%g)">\n""" % (name, dx, dy))
+# The group is turned "angle" degrees clockwise, then moved by (dx, dy).
+def start_group(out, name, dx=0, dy=0, angle=0):
+    if angle:
+        out.write("""<g id="%s" transform="translate(%g,%g) rotate(%g)">\n""" % (name, dx, dy, angle))
+    else:
+        out.write("""<g id="%s" transform="translate(%g,%g)">\n""" % (name, dx, dy))
 
 def end_group(out):
     out.write("""</g>\n""")
@@ -39,14 +106,33 @@ def end_group(out):
 def draw_line(out, x1, y1, x2, y2):
     out.write("""        <line x1="%g" y1="%g" x2="%g" y2="%g" fill="none" stroke="#000000" stroke-width="%g"/>\n""" % (x1, y1, x2, y2, STROKE_WIDTH))
 
-def circle(out, cx, cy, r, color):
+def circle(out, cx, cy, r, color, precision=None):
+    if precision is None:
+        cx, cy, r = str(cx), str(cy), str(r)
+    else:
+        cx, cy, r = [format_number(v, precision) for v in (cx, cy, r)]
     out.write("""        <circle fill="none" stroke="%s" stroke-width="%g" cx="%s" cy="%s" r="%s"/>\n""" % (color, STROKE_WIDTH, cx, cy, r))
 
-def polyline(out, p, color):
-    out.write("""<polyline fill="none" stroke="%s" stroke-width="%g" points=" """ % (color, STROKE_WIDTH))
-    for x, y in p:
-        out.write(" %g,%g" % (x, y))
-    out.write(""" "/>\n""")
+def polyline(out, p, color, precision=None):
+    p = np.asarray(p, dtype=float).reshape(-1, 2)
+    out.write("""<polyline fill="none" stroke="%s" stroke-width="%g" points="  %s "/>\n""" % (
+        color, STROKE_WIDTH, format_pairs(p, precision)))
+
+# Compact alternative to polyline(). Coordinates are rounded to "precision"
+# decimal places, then all but the first are written relative to the
+# previous one. Rounding happens before taking differences, so the
+# relative steps add up exactly and don't drift.
+def path(out, p, color, precision=3):
+    p = np.asarray(p, dtype=float).reshape(-1, 2)
+    if len(p) == 0:
+        return
+    q = np.rint(p*10**precision)
+    d = "M" + format_pairs(q[:1]/10**precision, precision)
+    if len(p) > 1:
+        d += "l" + format_pairs(np.diff(q, axis=0)/10**precision, precision)
+    d = LEADING_ZERO_RE.sub(".", d)
+    out.write("""<path fill="none" stroke="%s" stroke-width="%g" d="%s"/>\n""" % (
+        color, STROKE_WIDTH, d))
 
 def footer(out):
     out.write("""    </g>
@@ -0,0 +1,265 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Build many variants of the clock from a JSON spec, in a pool of worker
+# processes. The spec changes fields of config.ClockConfig as in
+# config.make_config():
+#
+#     {
+#         "base": {"frame_padding": 0.75},
+#         "grid": {
+#             "module": [0.09, 0.10, 0.11],
+#             "esc_tooth_count": [15, 30]
+#         },
+#         "variants": [
+#             {"name": "short", "pendulum_bar_height": 13},
+#             {"name": "long", "pendulum_bar_height": 21}
+#         ]
+#     }
+#
+# Every variant is crossed with every combination of the grid, and "base"
+# applies to all of them. Either list may be left out.
+#
+# Each variant is written to OUTPUT/NAME.json. The results are appended to
+# OUTPUT/progress.jsonl as they come in, and variants that are already in it
+# with the same parameters are skipped, so an interrupted sweep picks up
+# where it stopped. OUTPUT/summary.tsv has one line per variant with the
+# frame size, vertex count, timing error and build time.
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import itertools
+import multiprocessing
+
+from config import DPI, make_config
+import clock
+import bounds
+import dynamics
+import jsonout
+import memo
+
+PROGRESS_FILENAME = "progress.jsonl"
+SUMMARY_FILENAME = "summary.tsv"
+
+# Columns of the summary after the name and parameters, as (heading, key in
+# the results, format).
+SUMMARY_COLUMNS = [
+    ("frame_width", "frame_width", "%.2f"),
+    ("frame_height", "frame_height", "%.2f"),
+    ("pieces", "pieces", "%d"),
+    ("vertices", "vertices", "%d"),
+    ("period", "period", "%.4f"),
+    ("required_period", "required_period", "%.4f"),
+    ("error_per_day", "error", "%+.1f"),
+    ("build_seconds", "build_seconds", "%.3f"),
+]
+
+# Returns the list of (name, parameters) of the spec, in a fixed order.
+def variants(spec):
+    base = spec.get("base", {})
+    grid = spec.get("grid", {})
+    keys = list(grid)
+    combinations = list(itertools.product(*[grid[key] for key in keys]))
+    explicit = spec.get("variants", [{}])
+
+    result = []
+    for index, (variant, combination) in enumerate(itertools.product(explicit, combinations)):
+        params = dict(base)
+        params.update(variant)
+        params.update(zip(keys, combination))
+        name = params.pop("name", None)
+        if name is None:
+            name = "variant-%05d" % index
+        elif len(combinations) > 1:
+            name = "%s-%05d" % (name, index % len(combinations))
+        result.append((name, params))
+
+    names = set()
+    for name, params in result:
+        if name in names:
+            raise ValueError("duplicate variant name %s" % name)
+        names.add(name)
+    return result
+
+# Returns the results of the variants already in the progress log, by name.
+# A line cut short by an interruption is ignored.
+def read_progress(filename):
+    done = {}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                done[entry["name"]] = entry
+    return done
+
+# Build one variant and write it out. Runs in a worker. Returns the entry
+# for the progress log.
+def build_variant(item):
+    name, params, output, precision = item
+    entry = {
+        "name": name,
+        "params": params,
+    }
+
+    # The modules write their progress to stderr, which would be a mess
+    # with many workers.
+    stderr = sys.stderr
+    sys.stderr = io.StringIO()
+    try:
+        config = make_config(params)
+        start = time.perf_counter()
+        data, _ = clock.build(config, processes=1)
+        build_seconds = time.perf_counter() - start
+
+        filename = os.path.join(output, name + ".json")
+        temp_filename = filename + ".tmp"
+        with open(temp_filename, "w") as f:
+            jsonout.write(data, f, precision, True)
+        os.replace(temp_filename, filename)
+
+        entry["results"] = summarize(data, config, build_seconds)
+    except Exception as e:
+        entry["error"] = "%s: %s" % (type(e).__name__, e)
+    finally:
+        sys.stderr = stderr
+
+    return entry
+
+# Figures of merit of a built clock.
+def summarize(data, config, build_seconds):
+    frame_box = None
+    for piece in data["pieces"]:
+        if piece["type"] == "frame":
+            frame_box = bounds.box(piece)
+            break
+
+    required, period, error = dynamics.simulate(data, config)
+
+    return {
+        "frame_width": (frame_box[2] - frame_box[0])/DPI if frame_box else 0,
+        "frame_height": (frame_box[3] - frame_box[1])/DPI if frame_box else 0,
+        "pieces": len(data["pieces"]),
+        "vertices": sum(len(piece["points"]) for piece in data["pieces"]),
+        "period": period,
+        "required_period": required,
+        "error": error,
+        "build_seconds": build_seconds,
+    }
+
+def init_worker(cache):
+    if cache:
+        memo.enable(cache)
+
+# Build all the variants that aren't done yet. Returns the progress log
+# entries of all variants, by name.
+def sweep(spec, output, processes=None, cache=None, precision=None, out=sys.stderr):
+    if not os.path.isdir(output):
+        os.makedirs(output)
+
+    all_variants = variants(spec)
+    progress_filename = os.path.join(output, PROGRESS_FILENAME)
+    done = read_progress(progress_filename)
+
+    todo = []
+    for name, params in all_variants:
+        entry = done.get(name)
+        if (entry is None or entry["params"] != params or "error" in entry or
+                not os.path.exists(os.path.join(output, name + ".json"))):
+            todo.append((name, params, output, precision))
+    out.write("%d variants, %d to build.\n" % (len(all_variants), len(todo)))
+
+    if todo:
+        if processes == 1:
+            pool = None
+            init_worker(cache)
+            results = map(build_variant, todo)
+        else:
+            pool = multiprocessing.Pool(processes, init_worker, (cache,))
+            results = pool.imap_unordered(build_variant, todo, chunksize=1)
+
+        try:
+            with open(progress_filename, "a") as f:
+                for count, entry in enumerate(results, 1):
+                    f.write(json.dumps(entry, sort_keys=True) + "\n")
+                    f.flush()
+                    done[entry["name"]] = entry
+                    if "error" in entry:
+                        out.write("%s failed: %s\n" % (entry["name"], entry["error"]))
+                    out.write("Built %d of %d.\r" % (count, len(todo)))
+            out.write("\n")
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    return dict((name, done[name]) for name, _ in all_variants if name in done)
+
+# One line per variant, tab-separated, with the parameters that vary.
+def write_summary(all_variants, done, out):
+    keys = []
+    for _, params in all_variants:
+        for key in params:
+            if key not in keys:
+                keys.append(key)
+
+    out.write("\t".join(["name"] + keys + [heading for heading, _, _ in SUMMARY_COLUMNS]) + "\n")
+    for name, params in all_variants:
+        entry = done.get(name)
+        row = [name] + [json.dumps(params[key]) if key in params else "" for key in keys]
+        if entry is None or "error" in entry:
+            row += [""]*len(SUMMARY_COLUMNS)
+        else:
+            results = entry["results"]
+            row += [fmt % results[key] for _, key, fmt in SUMMARY_COLUMNS]
+        out.write("\t".join(row) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description='Build variants of the clock.')
+    parser.add_argument("spec", help="JSON file of the variants to build")
+    parser.add_argument("--output", metavar="DIRECTORY",
+            help="where to write the variants and summary (default: the spec's name without .json)")
+    parser.add_argument("--processes", type=int, default=None,
+            help="number of processes that build variants (default: one per core)")
+    parser.add_argument("--cache", metavar="DIRECTORY",
+            help="share generated pieces between variants and runs through this directory")
+    parser.add_argument("--precision", type=int, default=None,
+            help="number of decimal places for point coordinates (default: full precision)")
+    args = parser.parse_args()
+
+    spec = json.load(open(args.spec))
+    output = args.output
+    if output is None:
+        output = os.path.splitext(args.spec)[0]
+
+    start = time.perf_counter()
+    done = sweep(spec, output, args.processes, args.cache, args.precision)
+
+    summary_filename = os.path.join(output, SUMMARY_FILENAME)
+    with open(summary_filename, "w") as f:
+        write_summary(variants(spec), done, f)
+
+    failed = sum(1 for entry in done.values() if "error" in entry)
+    sys.stderr.write("Wrote %s in %.1f seconds (%d failed).\n" % (
+        summary_filename, time.perf_counter() - start, failed))
+
+if __name__ == "__main__":
+    main()
@@ -13,10 +13,50 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import io
+import os
+import math
+import sys
+import json
 import argparse
+import threading
+import tracemalloc
 
-from config import WIDTH, HEIGHT
+import numpy as np
+import pytest
+
+from config import (DPI, WIDTH, HEIGHT, LOOSE_LARGE_BOLT_RADIUS, BEARING_RADIUS,
+        DEFAULT_CONFIG, NORTH, EAST, WEST, TAU, make_config)
+from points import PointBuffer
+from vector import Vector
+import config
+import svg
+import watch
+import sweep
+import kinematics
+import frame
+import bounds
+import jsonout
+import gear
+import train
+import jobs
+import cut
+import lru
+import memo
+import packed
+import search
+import separator
 import draw
+import escapement
+import simplify
+import serve
+import dynamics
+import instrument
+import bench
+import clock
+import mesh
+import nest
+import toolpath
 
 def main():
     out = sys.stdout
@@ -28,27 +68,30 @@ def main():
 
     color = "#000000"
 
-    draw.header(out, WIDTH, HEIGHT)
+    # Pieces made by the gear trains below.
+    data = {"dpi": DPI, "pieces": []}
+
+    svg.header(out, WIDTH, HEIGHT)
 
     # Parts of clock for cutting. Spool.
     if args.command == "spool":
         # Inside.
-        draw.circle(out, 5*DPI, 5*DPI, LOOSE_SLIP_HOLE_RADIUS, color)
-        draw.circle(out, 5*DPI, 5*DPI, 0.80*DPI, color)
+        svg.circle(out, 5*DPI, 5*DPI, LOOSE_LARGE_BOLT_RADIUS, color)
+        svg.circle(out, 5*DPI, 5*DPI, 0.80*DPI, color)
 
         # Outside.
-        draw.circle(out, 10*DPI, 5*DPI, LOOSE_SLIP_HOLE_RADIUS, color)
-        draw.circle(out, 10*DPI, 5*DPI, 1.25*DPI, color)
+        svg.circle(out, 10*DPI, 5*DPI, LOOSE_LARGE_BOLT_RADIUS, color)
+        svg.circle(out, 10*DPI, 5*DPI, 1.25*DPI, color)
         # Hole for wire.
-        draw.circle(out, 10*DPI + 0.85*DPI, 5*DPI, 0.05*DPI, color)
+        svg.circle(out, 10*DPI + 0.85*DPI, 5*DPI, 0.05*DPI, color)
 
         # Outside.
-        draw.circle(out, 15*DPI, 5*DPI, LOOSE_SLIP_HOLE_RADIUS, color)
-        draw.circle(out, 15*DPI, 5*DPI, 1.25*DPI, color)
+        svg.circle(out, 15*DPI, 5*DPI, LOOSE_LARGE_BOLT_RADIUS, color)
+        svg.circle(out, 15*DPI, 5*DPI, 1.25*DPI, color)
 
     # Low tooth-count test.
     if args.command == "low_tooth_count":
-        gear_train = train.GearTrain(out, WIDTH/4, HEIGHT*3/5, 40)
+        gear_train = train.GearTrain(data, WIDTH/4, HEIGHT*3/5, 40)
         hole_radius = 0.1*DPI
 
         gear_train.add_gear(6, None, hole_radius)
@@ -56,7 +99,7 @@ def main():
 
     # Laser test.
     if args.command == "laser_test":
-        gear_train = train.GearTrain(out, WIDTH/4, HEIGHT*3/5, 5)
+        gear_train = train.GearTrain(data, WIDTH/4, HEIGHT*3/5, 5)
         hole_radius = 0.1*DPI
 
         gear_train.add_gear(64, None, hole_radius)
@@ -65,7 +108,7 @@ def main():
 
     # Output for cover of Graphics Engine book.
     if args.command == "ge_book":
-        gear_train = train.GearTrain(out, 0, 0, 5)
+        gear_train = train.GearTrain(data, 0, 0, 5)
         gear_train.set_angle_offset(-2)
         hole_radius = 0.05*DPI
 
@@ -90,7 +133,7 @@ def main():
         if False:
             r = 0.25*DPI
             for i in range(5):
-                draw.circle(out, cx, cy, r, "#000000")
+                svg.circle(out, cx, cy, r, "#000000")
                 cx += DPI*0.75
                 r += 0.001*DPI
 
@@ -98,27 +141,718 @@ def main():
             r = 0.255*DPI
             r2 = 0.40*DPI
             for i in range(3):
-                draw.circle(out, cx, cy, r, "#000000")
-                draw.circle(out, cx, cy, r2, "#000000")
+                svg.circle(out, cx, cy, r, "#000000")
+                svg.circle(out, cx, cy, r2, "#000000")
                 cx += DPI*0.95
                 r += 0.001*DPI
 
         if True:
             r = 0.394*DPI
             for i in range(5):
-                draw.circle(out, cx, cy, r, "#000000")
+                svg.circle(out, cx, cy, r, "#000000")
                 cx += DPI*0.95
                 r += 0.001*DPI
 
     # Gear for inlay.
     if args.command == "inlay":
-        gear_train = train.GearTrain(out, 50, 50, 20)
+        gear_train = train.GearTrain(data, 50, 50, 20)
         gear_train.set_angle_offset(0)
         hole_radius = 0.3*DPI
 
         gear_train.add_gear(18, None, hole_radius)
 
-    draw.footer(out)
+    jobs.run(data, 1)
+    for index, piece in enumerate(data["pieces"]):
+        cut.write_piece(out, piece, "%s_%d" % (piece["type"], index), piece["cx"], piece["cy"],
+                False, None)
+
+    svg.footer(out)
+
+# Tests, run with "python -m pytest". The commands of main() above write
+# SVGs to check by eye and aren't run by pytest.
+
+# Outline of a gear computed one point at a time, the way gear.generate()
+# did before it used NumPy.
+def scalar_gear_points(z, angle_offset, module):
+    alpha = 20*(math.pi/180)
+    h = math.pi/4
+    b = 1.25
+    e = 0.38
+    v_c = e - b
+    u_c = h + e/math.cos(alpha) - v_c*math.tan(alpha)
+    R = z/2.0
+    R0 = R*math.cos(alpha)
+    r_a = R + 1
+    r_b = R - b
+    inv_alpha = math.tan(alpha) - alpha
+    psi_min = math.tan(alpha) + (e*(1 - math.sin(alpha)) - b)/(R0*math.sin(alpha))
+    gamma = h/R + inv_alpha
+    phi_min = psi_min - alpha - gamma
+    psi_max = math.sqrt((r_a/R0)**2 - 1)
+    phi_max = -(h + e/math.cos(alpha) + (b - e)*math.tan(alpha))/R
+    n = gear.NUM_POINTS
+
+    p = []
+    for i in range(n[0]):
+        theta = -math.pi/z + (phi_max + math.pi/z)*i/(n[0] - 1)
+        p.append((math.sin(theta)*r_b, math.cos(theta)*r_b))
+    for i in range(n[1]):
+        phi = phi_max + (phi_min - phi_max)*i/(n[1] - 1)
+        Lambda = 1 + e/math.sqrt((R*phi + u_c)**2 + v_c**2)
+        X = Lambda*(R*phi + u_c)
+        Y = R + Lambda*v_c
+        p.append((-(X*math.cos(phi) - Y*math.sin(phi)), X*math.sin(phi) + Y*math.cos(phi)))
+    for i in range(n[2]):
+        psi = psi_min + (psi_max - psi_min)*i/(n[2] - 1)
+        r = R0*math.sqrt(1 + psi**2)
+        theta = gamma + math.atan(psi) - psi
+        p.append((-math.sin(theta)*r, math.cos(theta)*r))
+    top = -(gamma + math.atan(psi_max) - psi_max)
+    for i in range(n[3]):
+        theta = top - top*i/(n[3] - 1)
+        p.append((math.sin(theta)*r_a, math.cos(theta)*r_a))
+    p.extend(reversed([(-x, y) for x, y in p]))
+
+    P = []
+    for tooth in range(z):
+        phi = -2*(tooth*math.pi + angle_offset)/z
+        for x, y in p:
+            P.append(((x*math.cos(phi) - y*math.sin(phi))*module,
+                     -(x*math.sin(phi) + y*math.cos(phi))*module))
+    return P
+
+@pytest.mark.parametrize("z", [16, 21, 64])
+def test_gear_matches_scalar_outline(z):
+    piece = gear.generate(0, 0, z, 10, 0.3, "#000000", 0.1*DPI)
+    expected = np.array(scalar_gear_points(z, 0.3, 0.1*DPI))
+    assert np.asarray(piece["points"]).shape == expected.shape
+    assert np.allclose(piece["points"], expected, rtol=0, atol=1e-9)
+    assert piece["outer_radius"] == pytest.approx((z/2.0 + 1)*0.1*DPI)
+
+# Largest distance from the points "p" to the polyline "q", which may have
+# repeated points.
+def polyline_distance(p, q):
+    a = q[:-1][np.newaxis]
+    ab = q[1:][np.newaxis] - a
+    ap = p[:, np.newaxis] - a
+    t = np.clip((ap*ab).sum(axis=2)/np.maximum((ab*ab).sum(axis=2), 1e-300), 0, 1)
+    return np.sqrt(((ap - ab*t[:, :, np.newaxis])**2).sum(axis=2)).min(axis=1).max()
+
+@pytest.mark.parametrize("z", [16, 64])
+def test_adaptive_gear_stays_within_max_error(z):
+    max_error = 0.001
+    p, error = gear.tooth_profile(z, max_error)
+    assert error <= max_error
+    dense, _ = gear.tooth_profile(z, None, (500, 500, 500, 500))
+    assert polyline_distance(dense, p) <= max_error*1.01
+
+    # Tighter bounds need more points, and the piece reports the error in
+    # inches.
+    assert len(gear.tooth_profile(z, max_error/10)[0]) > len(p)
+    piece = gear.generate(0, 0, z, 10, 0, "#000000", 0.1*DPI, max_error=0.0005)
+    assert 0 < piece["max_error"] <= 0.0005
+
+def test_bezier_flattening_stays_within_tolerance():
+    p1, p2, p3, p4 = Vector(0, 0), Vector(100, -200), Vector(50, 300), Vector(300, 0)
+    dense = draw.bezier_points(p1, p2, p3, p4, np.linspace(0, 1, 5000))
+    counts = []
+    for tolerance in (1.0, 0.1, 0.01):
+        p = []
+        draw.add_bezier(p, p1, p2, p3, p4, 100, tolerance)
+        q = np.array([tuple(v) for v in p])
+        assert polyline_distance(dense, q) <= tolerance
+        assert tuple(q[0]) == (0, 0) and tuple(q[-1]) == (300, 0)
+        counts.append(len(q))
+    assert counts == sorted(counts) and counts[0] < 100
+
+    fixed = []
+    draw.add_bezier(fixed, p1, p2, p3, p4, 100)
+    assert len(fixed) == 100
+
+def test_corners_and_circles_stay_within_tolerance():
+    radius = 0.25*DPI
+    tolerance = 0.01
+    square = [Vector(0, 0), Vector(100, 0), Vector(100, 100), Vector(0, 100)]
+    p = np.asarray(draw.round_corners(square, radius, 32, tolerance))
+    t = np.linspace(0, TAU/4, 1000)
+    arc = np.column_stack((100 - radius + np.sin(t)*radius, radius - np.cos(t)*radius))
+    assert polyline_distance(arc, p) <= tolerance
+    assert len(p) < len(np.asarray(draw.round_corners(square, radius, 32)))
+
+    circle = np.asarray(separator.generate_circle_points(0, 0, radius, 100, tolerance))
+    t = np.linspace(0, TAU, 5000)
+    assert polyline_distance(np.column_stack((np.cos(t), np.sin(t)))*radius, circle) <= tolerance
+    assert tuple(circle[0]) == pytest.approx(tuple(circle[-1]))
+
+def test_point_buffer_bounds_follow_changes():
+    p = PointBuffer([(0, 0), (3, 4)])
+    assert p.bounds() == (0, 0, 3, 4, 5)
+    p.translate(1, 2)
+    assert p.bounds()[:4] == (1, 2, 4, 6)
+    p.scale(2)
+    assert p.bounds()[:4] == (2, 4, 8, 12)
+
+def test_point_buffer_views_are_read_only():
+    p = PointBuffer([(0, 0), (3, 4)])
+    p.bounds()
+    for view in (p.array, p.x, p.y, np.asarray(p)):
+        with pytest.raises(ValueError):
+            view[0] = 10
+    assert p.bounds()[2:4] == (3, 4)
+
+def test_frame_merges_axles_within_tolerance():
+    edge = frame.AXLE_TOLERANCE*1000
+    def round_piece(cx, cy, outer_radius):
+        # No points, so that the frame must use the outer radius.
+        return {"type": "gear", "cx": cx, "cy": cy, "cz": 0, "outer_radius": outer_radius,
+                "points": None}
+    data = {"pieces": [
+        round_piece(100, 100, 50),
+        round_piece(100 + 1e-9, 100 - 1e-9, 20),
+        round_piece(edge - 1e-9, 100, 30),
+        round_piece(edge + 1e-9, 100, 30),
+        round_piece(300, 100, 40),
+    ]}
+    frame.generate(data, "#00FF00")
+    front = data["pieces"][-2]
+    # One hole per axle, and the one in the lower-left.
+    assert [(hole["cx"], hole["cy"]) for hole in front["holes"]] == [
+            (100, 100), (edge - 1e-9, 100), (300, 100), (edge - 1e-9, 100)]
+    # The bounds come from the outer radius.
+    assert bounds.box(data["pieces"][0]) == (50, 50, 150, 150)
+    assert np.asarray(front["points"])[:, 1].max() == pytest.approx(100 + DEFAULT_CONFIG.frame_padding)
+
+def test_lru_evicts_least_recently_used():
+    value_size = lru.sizeof(np.zeros(100)) + sys.getsizeof(1)
+    cache = lru.LruCache("Test", 2*value_size)
+    cache.get(1, lambda: np.zeros(100))
+    cache.get(2, lambda: np.zeros(100))
+    cache.get(1, lambda: np.zeros(100))
+    cache.get(3, lambda: np.zeros(100))
+    assert list(cache.entries) == [1, 3]
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 3, 1)
+    assert cache.size <= cache.max_bytes
+
+def test_lru_values_are_frozen_and_huge_ones_not_kept():
+    cache = lru.LruCache("Test", 1000)
+    value = cache.get(1, lambda: np.zeros(1000))
+    assert not value.flags.writeable
+    assert len(cache.entries) == 0
+
+def test_lru_counters_add_up():
+    before = lru.counters()
+    lru.add_counters({"Outline": (1, 2, 3)})
+    increase = jobs.counter_increase(lru.counters(), before)
+    assert increase["Outline"] == (1, 2, 3)
+    assert increase["Tooth profile"] == (0, 0, 0)
+
+def test_jobs_pool_keeps_order_and_counts_worker_cache():
+    def make(processes):
+        data = {"pieces": []}
+        gear_train = train.GearTrain(data, 0, 0)
+        gear_train.add_stages([(32, 16, NORTH, 0), (32, 16, EAST, 2)], BEARING_RADIUS)
+        lru.clear()
+        before = lru.counters()
+        jobs.run(data, processes)
+        return data, jobs.counter_increase(lru.counters(), before)
+
+    serial, serial_counts = make(1)
+    pooled, pooled_counts = make(2)
+    assert [piece["type"] for piece in pooled["pieces"]] == [piece["type"] for piece in serial["pieces"]]
+    for a, b in zip(serial["pieces"], pooled["pieces"]):
+        assert np.array_equal(np.asarray(a["points"]), np.asarray(b["points"]))
+    # Gears with the same teeth share a profile in one worker.
+    assert pooled_counts == serial_counts
+
+def test_jobs_makes_few_pieces_here(monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("started a pool")
+    monkeypatch.setattr(jobs.multiprocessing, "Pool", no_pool)
+
+    data = {"pieces": []}
+    gear_train = train.GearTrain(data, 0, 0)
+    gear_train.add_stages([(32, 16, NORTH, 0), (32, 16, EAST, 2)], BEARING_RADIUS)
+    assert len(data["pieces"]) < jobs.MIN_POOL_PIECES
+    lru.clear()
+    jobs.run(data)
+    assert not any(isinstance(piece, jobs.Deferred) for piece in data["pieces"])
+    assert len(lru.OUTLINE_CACHE.entries) > 0
+
+@pytest.fixture
+def disk_cache(tmp_path):
+    memo.enable(str(tmp_path))
+    yield memo.CACHE
+    memo.disable()
+
+def test_memo_hits_on_same_arguments(disk_cache):
+    first = separator.generate(0, 0, 10)
+    second = separator.generate(0, 0, 10)
+    separator.generate(0, 0, 11)
+    assert (disk_cache.hits, disk_cache.misses) == (1, 2)
+    assert np.array_equal(np.asarray(first["points"]), np.asarray(second["points"]))
+
+def test_memo_key_is_stable_and_follows_constants(monkeypatch):
+    function = separator.generate.__wrapped__
+    key = memo.make_key(function, (0, 0, 10), {})
+    memo.FINGERPRINTS.clear()
+    assert memo.make_key(function, (0, 0, 10), {}) == key
+
+    monkeypatch.setattr(separator, "SEPARATOR_RADIUS", separator.SEPARATOR_RADIUS + 1)
+    monkeypatch.setattr(memo, "FINGERPRINTS", {})
+    assert memo.make_key(function, (0, 0, 10), {}) != key
+
+def test_memo_rebuilds_nothing_for_an_unrelated_constant(disk_cache, tmp_path, monkeypatch):
+    clock.build(processes=1)
+    assert disk_cache.misses > 0
+
+    # Edit FRAME_PADDING in config.py. The frame isn't cached, so no piece
+    # should be made again.
+    with open(config.__file__) as f:
+        source = f.read()
+    assert "\nFRAME_PADDING = 1*DPI\n" in source
+    edited = tmp_path / "config.py"
+    edited.write_text(source.replace("\nFRAME_PADDING = 1*DPI\n", "\nFRAME_PADDING = 2*DPI\n"))
+    monkeypatch.setattr(config, "__file__", str(edited))
+    changed = DEFAULT_CONFIG._replace(frame_padding=2*DPI)
+    for module in list(sys.modules.values()):
+        if getattr(module, "DEFAULT_CONFIG", None) is DEFAULT_CONFIG:
+            monkeypatch.setattr(module, "DEFAULT_CONFIG", changed)
+    monkeypatch.setattr(memo, "FINGERPRINTS", {})
+
+    misses = disk_cache.misses
+    clock.build(changed, processes=1)
+    assert disk_cache.misses == misses
+
+def test_memo_key_uses_exact_values():
+    function = separator.generate.__wrapped__
+    assert (memo.make_key(function, (Vector(0.1, 0), 0, 10), {}) !=
+            memo.make_key(function, (Vector(0.1 + 1e-15, 0), 0, 10), {}))
+    assert (memo.make_key(function, (0, 0, 10), {"radius": 1}) ==
+            memo.make_key(function, (0, 0, 10), {"radius": 1}))
+
+def test_memo_trim_removes_least_recently_used(tmp_path):
+    cache = memo.DiskCache(str(tmp_path), max_bytes=10**9)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.get(key, lambda: "x"*1000)
+        os.utime(cache.filename(key), (i, i))
+    cache.max_bytes = 2500
+    cache.trim()
+    assert not os.path.exists(cache.filename("a"))
+    assert os.path.exists(cache.filename("b")) and os.path.exists(cache.filename("c"))
+    assert cache.evictions == 1
+
+def test_memo_ignores_lists_of_objects():
+    assert memo.is_constant((1, "a", [2.0, None]))
+    assert not memo.is_constant([object()])
+
+def test_search_finds_the_minute_hand_stages():
+    spec = search.make_spec(12, 2, coaxial=[(0, 1)], limit=5)
+    candidates = search.search(spec, 1)
+    assert sorted(candidate.stages for candidate in candidates) == [
+            ((60, 20), (64, 16)), ((64, 16), (60, 20))]
+    assert all(candidate.ratio == 12 and candidate.total_teeth == 160
+            for candidate in candidates)
+    assert search.train_stages(spec, candidates[0])[0][2:] == (EAST, 0)
+
+def test_watch_reloads_changed_modules_and_their_importers(tmp_path, monkeypatch):
+    monkeypatch.setattr(memo, "SOURCE_DIR", str(tmp_path))
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    sources = {
+        "watched_a": "VALUE = 1\n",
+        "watched_b": "import watched_a\ndef value():\n    return watched_a.VALUE*10\n",
+        "watched_c": "VALUE = 3\n",
+    }
+    for name, source in sources.items():
+        (tmp_path / (name + ".py")).write_text(source)
+    try:
+        import watched_b, watched_c
+        mtimes = watch.snapshot(watch.source_files())
+        memo.FINGERPRINTS["watched_b"] = "old"
+
+        # Change the file after wait_for_change() has started polling.
+        filename = str(tmp_path / "watched_a.py")
+        timer = threading.Timer(0.3, lambda: (tmp_path / "watched_a.py").write_text("VALUE = 22\n"))
+        timer.start()
+        _, changed = watch.wait_for_change(mtimes, [])
+        timer.join()
+        assert changed == set([filename])
+
+        assert watch.reload_modules(changed) == ["watched_a", "watched_b"]
+        assert watched_b.value() == 220
+        assert sys.modules["watched_c"] is watched_c
+        assert "watched_b" not in memo.FINGERPRINTS
+    finally:
+        for name in sources:
+            sys.modules.pop(name, None)
+
+def test_packed_round_trip(tmp_path):
+    points = PointBuffer([(0, 0), (1.5, 2.25), (-3, 4)])
+    data = {
+        "dpi": DPI,
+        "pieces": [
+            {"type": "gear", "cx": 1, "cy": 2, "points": points,
+                "levels": [{"tolerance": 0.01, "points": points[:2]}]},
+            {"type": "frame", "cx": 0, "cy": 0, "points": PointBuffer([])},
+        ],
+    }
+    filename = str(tmp_path / "clock.bin")
+    with open(filename, "wb") as f:
+        packed.write(data, f, "float64")
+    assert packed.is_packed(filename)
+
+    result = packed.read(filename)
+    assert result["dpi"] == DPI
+    assert [piece["type"] for piece in result["pieces"]] == ["gear", "frame"]
+    assert np.array_equal(result["pieces"][0]["points"], np.asarray(points))
+    assert np.array_equal(result["pieces"][0]["levels"][0]["points"], np.asarray(points)[:2])
+    assert result["pieces"][0]["levels"][0]["tolerance"] == 0.01
+    assert len(result["pieces"][1]["points"]) == 0
+
+def test_simplify_stays_within_tolerance():
+    t = np.linspace(0, 2*np.pi, 500)
+    p = np.column_stack((100*np.cos(t), 100*np.sin(t)))
+    for tolerance in (0.1, 1, 5):
+        q = simplify.simplify(p, tolerance)
+        assert len(q) < len(p)
+        assert np.array_equal(q[0], p[0]) and np.array_equal(q[-1], p[-1])
+        distance = np.min([simplify.segment_distance(p, q[i], q[i + 1])
+            for i in range(len(q) - 1)], axis=0)
+        assert distance.max() <= tolerance
+
+def test_levels_match_douglas_peucker():
+    t = np.linspace(0, 2*np.pi, 300)
+    p = np.column_stack((100*np.cos(t) + 5*np.cos(7*t), 100*np.sin(t)))
+    keep = simplify.keep_tolerances(p, 0.1)
+    for tolerance in (0.1, 0.5, 2):
+        assert np.array_equal(p[keep >= tolerance], simplify.douglas_peucker(p, tolerance))
+
+def test_make_config():
+    changed = make_config({
+        "module": 0.12,
+        "esc_tooth_count": 30,
+        "stages": [[64, 16, 3, 0], [60, 20, "e", 2]],
+    })
+    assert changed.module == 0.12*DPI
+    assert changed.esc_tooth_count == 30
+    assert changed.stages == ((64, 16, WEST, 0), (60, 20, EAST, 2))
+    assert changed.frame_padding == DEFAULT_CONFIG.frame_padding
+    assert make_config({}) == DEFAULT_CONFIG
+
+def test_make_config_errors():
+    with pytest.raises(ValueError):
+        make_config({"no_such_field": 1})
+    with pytest.raises(ValueError):
+        make_config({"stages": [[64, 16, 7, 0]]})
+    with pytest.raises(ValueError):
+        make_config({"stages": [[64, 16, "X", 0]]})
+
+def test_curve_tolerance_comes_from_config():
+    coarse = DEFAULT_CONFIG._replace(curve_tolerance=0.01)
+    assert draw.config_tolerance(DEFAULT_CONFIG) is None
+    assert draw.config_tolerance(coarse) == 0.01*DPI
+
+    esc_center = Vector(0, 0)
+    verge_center = Vector(0, DEFAULT_CONFIG.verge_distance)
+    verge, offset = escapement.generate_verge("#FF0000", verge_center, esc_center, 1,
+            BEARING_RADIUS, 0, escapement.verge_params(DEFAULT_CONFIG))
+    coarse_verge, coarse_offset = escapement.generate_verge("#FF0000", verge_center,
+            esc_center, 1, BEARING_RADIUS, 0, escapement.verge_params(coarse))
+    assert len(coarse_verge["points"]) < len(verge["points"])
+    assert coarse_offset == offset
+
+def test_serve_only_serves_top_level_files(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "index.html").write_text("hi")
+    (tmp_path.parent / "outside.json").write_text("{}")
+    os.symlink(str(tmp_path.parent / "outside.json"), str(tmp_path / "link.json"))
+    cache = serve.AssetCache(str(tmp_path))
+    directory = os.path.realpath(str(tmp_path))
+
+    assert cache.filename("/") == os.path.join(directory, "index.html")
+    assert cache.filename("/clock.json") == os.path.join(directory, "clock.json")
+    assert cache.filename("/../outside.json") is None
+    assert cache.filename("/sub/../../outside.json") is None
+    assert cache.filename("/sub/clock.json") is None
+    assert cache.filename("/link.json") is None
+    assert cache.filename("/serve.py") is None
+    assert cache.filename("/sub/") is None
+
+def test_serve_parse_range():
+    assert serve.parse_range("bytes=0-9", 100) == (0, 10)
+    assert serve.parse_range("bytes=90-", 100) == (90, 100)
+    assert serve.parse_range("bytes=-10", 100) == (90, 100)
+    assert serve.parse_range("bytes=50-500", 100) == (50, 100)
+    assert serve.parse_range("bytes=100-", 100) == "unsatisfiable"
+    assert serve.parse_range("bytes=-0", 100) == "unsatisfiable"
+    assert serve.parse_range("bytes=0-1,5-6", 100) is None
+    assert serve.parse_range("lines=0-1", 100) is None
+    assert serve.parse_range("bytes=x-1", 100) is None
+
+def test_serve_etags_and_encoding():
+    assert serve.etag_matches('"a", "b"', '"b"')
+    assert serve.etag_matches('W/"b"', '"b"')
+    assert serve.etag_matches("*", '"b"')
+    assert not serve.etag_matches('"a"', '"b"')
+    assert serve.accepts_gzip("deflate, gzip;q=0.5")
+    assert not serve.accepts_gzip("gzip;q=0")
+    assert not serve.accepts_gzip("identity")
+
+def test_sweep_builds_each_variant_once(tmp_path):
+    spec = {
+        "grid": {"module": [0.09, 0.1]},
+        "variants": [
+            {"name": "short", "pendulum_bar_height": 13},
+            {"name": "long", "pendulum_bar_height": 21},
+            {"name": "bad", "no_such_field": 1},
+        ],
+    }
+    output = str(tmp_path)
+    out = io.StringIO()
+    done = sweep.sweep(spec, output, processes=1, out=out)
+    assert out.getvalue().startswith("6 variants, 6 to build.")
+    assert sorted(done) == ["bad-00000", "bad-00001", "long-00000", "long-00001",
+            "short-00000", "short-00001"]
+    assert "error" in done["bad-00000"] and "error" not in done["short-00000"]
+    with open(os.path.join(output, "long-00001.json")) as f:
+        assert len(json.load(f)["pieces"]) == done["long-00001"]["results"]["pieces"]
+    assert (done["long-00000"]["results"]["period"] >
+            done["short-00000"]["results"]["period"])
+
+    # Only the failed variants are built again.
+    out = io.StringIO()
+    assert sweep.sweep(spec, output, processes=1, out=out) == done
+    assert out.getvalue().startswith("6 variants, 2 to build.")
+
+    summary = io.StringIO()
+    sweep.write_summary(sweep.variants(spec), done, summary)
+    rows = [line.split("\t") for line in summary.getvalue().splitlines()]
+    assert rows[0][:4] == ["name", "pendulum_bar_height", "module", "no_such_field"]
+    assert len(rows) == 7 and all(len(row) == len(rows[0]) for row in rows)
+    assert rows[1][:3] == ["short-00000", "13", "0.09"]
+    assert rows[5][4:] == [""]*len(sweep.SUMMARY_COLUMNS)
+
+def test_moments_move_with_parallel_axis():
+    square = [(-1, -1), (2, -1), (2, 1), (-1, 1)]
+    dx, dy = 3.0, -2.0
+    moved = [(x + dx, y + dy) for x, y in square]
+    assert np.allclose(dynamics.translate_moments(dynamics.polygon_moments(square), dx, dy),
+            dynamics.polygon_moments(moved))
+
+def test_profiling_keeps_callers_trace():
+    args = argparse.Namespace(profile=None, tracemalloc=False, cprofile=None)
+    tracemalloc.start()
+    try:
+        with instrument.profiling(args, "test"):
+            pass
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+def test_profile_stage_counts_allocations():
+    out = io.StringIO()
+    instrument.enable(out, "test", [], trace_memory=True)
+    try:
+        with instrument.stage("make"):
+            kept = [[i] for i in range(1000)]
+    finally:
+        instrument.disable()
+    assert not tracemalloc.is_tracing()
+
+    event = json.loads(out.getvalue().splitlines()[-1])
+    assert event["event"] == "stage" and event["name"] == "make"
+    assert event["allocations"] >= 1000
+    assert event["allocated"] >= sys.getsizeof(kept[0])*1000
+
+def test_bench_flags_regressions_and_keeps_other_baselines(tmp_path, monkeypatch, capsys):
+    old = {"time": 1.0, "peak": 90, "size": 5}
+    assert bench.regressions({"time": 1.3, "peak": 100, "size": 5}, old, 0.2) == ["time"]
+    assert bench.regressions({"time": 1.3, "peak": 100, "size": 5}, {}, 0.2) == []
+
+    def tiny():
+        return len([i for i in range(1000)])
+    monkeypatch.setattr(bench, "BENCHMARKS", [("tiny", tiny), ("left out", tiny)])
+    monkeypatch.setattr(bench, "MIN_TIME", 0)
+    baseline = tmp_path / "bench.json"
+    baseline.write_text(json.dumps({"other": old}))
+    argv = ["bench.py", "--baseline", str(baseline), "--repeat", "1", "--filter", "tiny"]
+    monkeypatch.setattr(sys, "argv", argv + ["--save"])
+    bench.main()
+    saved = json.loads(baseline.read_text())
+    assert sorted(saved) == ["other", "tiny"]
+    assert saved["tiny"]["size"] == 1000
+
+    # Against a baseline a hundred times faster, it's a regression.
+    saved["tiny"]["time"] /= 100
+    baseline.write_text(json.dumps(saved))
+    capsys.readouterr()
+    monkeypatch.setattr(sys, "argv", argv)
+    with pytest.raises(SystemExit) as e:
+        bench.main()
+    assert e.value.code == 1
+    assert "REGRESSION (time)" in capsys.readouterr().out
+
+def test_macro_benchmark_peak_is_not_zero():
+    result = bench.measure(bench.bench_clock, 1)
+    assert result["peak"] > 0
+    assert result["size"] > 0
+
+@pytest.fixture(scope="module")
+def clock_data():
+    data, gear_train = clock.build(processes=1)
+    return data, gear_train
+
+def test_clock_gears_mesh_without_collisions(clock_data):
+    data, gear_train = clock_data
+    results = mesh.check(data, gear_train.meshes)
+    assert results
+    assert all(result["collisions"] == 0 for result in results)
+
+def test_clock_keeps_time(clock_data):
+    data, _ = clock_data
+    required, period, _ = dynamics.simulate(data)
+    assert required == 2.0
+    assert 0 < period < 2*required
+
+def test_svg_path_steps_add_up_to_rounded_points():
+    p = np.array([[0.123456, -5.0], [10.5, 0.25], [10.5049, 0.2549], [-3, 100.001]])
+    out = io.StringIO()
+    svg.path(out, p, "#000000", precision=2)
+    d = out.getvalue().split(' d="')[1].split('"')[0]
+    assert d.startswith("M")
+    first, steps = d[1:].split("l")
+    pairs = [first] + steps.split()
+    q = np.cumsum([[float(v) for v in pair.split(",")] for pair in pairs], axis=0)
+    assert np.allclose(q, np.round(p, 2), rtol=0, atol=1e-9)
+    assert " 0." not in d and ",0." not in d and "-0" not in d
+
+def test_cut_writes_compact_paths_at_precision(clock_data, tmp_path, capsys):
+    data, _ = clock_data
+    filename = str(tmp_path / "clock.json")
+    with open(filename, "w") as f:
+        jsonout.write(data, f)
+
+    outputs = []
+    for argv in (["--compact", "--precision", "1"], ["--compact", "--precision", "1"], []):
+        cut.main(argv + [filename])
+        outputs.append(capsys.readouterr().out)
+    compact, again, full = outputs
+    assert compact == again
+    assert "<polyline" not in compact and "<path" in compact
+    assert "<path" not in full and "<polyline" in full
+    assert len(compact) < len(full)/2
+    for d in compact.split(' d="')[1:]:
+        numbers = d.split('"')[0][1:].replace("l", " ").replace(",", " ").split()
+        assert all(len(number.split(".")[1]) <= 1 for number in numbers if "." in number)
+
+def test_streamed_json_matches_json_dumps(clock_data):
+    data, _ = clock_data
+    expected = json.loads(json.dumps(data, default=lambda obj: obj.to_JSON()))
+    for compact in (False, True):
+        out = io.StringIO()
+        jsonout.write(data, out, compact=compact)
+        assert json.loads(out.getvalue()) == expected
+    assert len(out.getvalue().splitlines()) == len(data["pieces"]) + 2
+
+    out = io.StringIO()
+    jsonout.write(data, out, precision=2)
+    rounded = json.loads(out.getvalue())
+    for piece, original in zip(rounded["pieces"], expected["pieces"]):
+        assert np.allclose(piece["points"], original["points"], rtol=0, atol=0.005)
+        assert piece["cx"] == original["cx"]
+
+# The angle of a piece at time "t" as clock.js computes it without tracks.
+def viewer_angle(piece, t):
+    if piece["type"] in ("verge", "pendulum"):
+        span = math.sin(t/2*TAU + 0.6)/2 + 0.5
+        left = piece["left_full_in_angle"]*TAU/360
+        right = piece["right_full_in_angle"]*TAU/360
+        return span*(left - right) + right
+    integer = math.floor(t)
+    escaped = integer + max(0, (t - integer)*16 - 15)
+    return (escaped - 0.4)*TAU/43200*piece["speed"]
+
+def test_tracks_match_the_viewer(clock_data):
+    data, _ = clock_data
+    pieces = data["pieces"]
+    times = np.concatenate((np.random.RandomState(0).uniform(0, 100, 200),
+            np.arange(0, 5, 1/64.0)))
+    expected = np.array([[viewer_angle(piece, t) for t in times] for piece in pieces])
+
+    direct = kinematics.angles(pieces, times)
+    from_tracks = kinematics.evaluate_tracks(data["animation"], len(pieces), times)
+    swinging = np.array([piece["type"] in ("verge", "pendulum") for piece in pieces])
+    assert swinging.any()
+    assert np.allclose(direct, expected, rtol=1e-9, atol=1e-12)
+    assert np.allclose(from_tracks[~swinging], expected[~swinging], rtol=1e-9, atol=1e-12)
+    # Swings are interpolated between keyframes, so they're off by at most
+    # the sagitta of a sine wave over one keyframe.
+    swing = math.radians(DEFAULT_CONFIG.right_full_in_angle - DEFAULT_CONFIG.left_full_in_angle)
+    sagitta = swing/2*(1 - math.cos(TAU/kinematics.SWING_KEYFRAMES/2))
+    assert np.abs(from_tracks[swinging] - expected[swinging]).max() <= sagitta*1.001
+
+def test_levels_get_coarser_and_cut_uses_the_finest(clock_data, tmp_path, capsys):
+    data, _ = clock_data
+    data = dict(data, pieces=[dict(piece) for piece in data["pieces"]])
+    plain = str(tmp_path / "plain.json")
+    with open(plain, "w") as f:
+        jsonout.write(data, f)
+
+    simplify.add_levels(data)
+    checked = set()
+    for piece in data["pieces"]:
+        p = simplify.remove_duplicates(np.asarray(piece["points"]))
+        counts = [len(piece["points"])]
+        for level in piece["levels"]:
+            q = np.asarray(level["points"])
+            assert len(q) < counts[-1]
+            counts.append(len(q))
+            # Measuring the distance is slow, so only for one of each type.
+            if piece["type"] not in checked:
+                assert polyline_distance(p, q) <= level["tolerance"]*DPI
+        checked.add(piece["type"])
+    assert any(len(piece["levels"]) == len(simplify.LEVEL_TOLERANCES) for piece in data["pieces"])
+
+    leveled = str(tmp_path / "leveled.json")
+    with open(leveled, "w") as f:
+        jsonout.write(data, f)
+    cut.main([plain])
+    expected = capsys.readouterr().out
+    cut.main([leveled])
+    assert capsys.readouterr().out == expected
+
+def test_nest_places_pieces_apart_on_the_sheet(clock_data):
+    data, _ = clock_data
+    pieces = [piece for piece in data["pieces"] if piece["type"] != "frame"]
+    sheets, unplaced = nest.nest(pieces)
+    assert not unplaced
+    assert sum(len(sheet) for sheet in sheets) == len(pieces)
+    for sheet in sheets:
+        boxes = []
+        for placement in sheet:
+            p = toolpath.transform(placement, placement.piece["points"])
+            box = (p[:, 0].min(), p[:, 1].min(), p[:, 0].max(), p[:, 1].max())
+            assert box[0] >= 0 and box[1] >= 0
+            assert box[2] <= nest.SHEET_WIDTH and box[3] <= nest.SHEET_HEIGHT
+            for other in boxes:
+                assert (box[2] <= other[0] or other[2] <= box[0] or
+                        box[3] <= other[1] or other[3] <= box[1])
+            boxes.append(box)
+
+def test_toolpath_cuts_holes_before_outlines(clock_data):
+    data, _ = clock_data
+    placements = [nest.Placement(piece, piece["cx"], piece["cy"], 0) for piece in data["pieces"]]
+    all_cuts = toolpath.cuts(placements)
+    ordered = toolpath.order(placements, all_cuts)
+    assert sorted((cut.item, cut.suffix, cut.index) for cut in ordered) == \
+            sorted((cut.item, cut.suffix, cut.index) for cut in all_cuts)
+    cut_bodies = set()
+    for cut in ordered:
+        if cut.suffix == "_body":
+            cut_bodies.add(cut.item)
+        else:
+            assert cut.item not in cut_bodies
+    assert toolpath.travel(placements, ordered) <= toolpath.travel(placements, all_cuts)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,222 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Order of the cuts for the laser. The laser cuts in the order of the SVG, so
+# the order decides how far the head moves between cuts ("rapid travel").
+# The holes inside a piece are always cut before the piece's outline, since
+# the piece can shift once it's cut free. Within that rule the cuts are put
+# in nearest-neighbor order, improved with 2-opt, and each outline is started
+# at the vertex that's closest to the cuts before and after it. Circles
+# always start at their rightmost point, as in SVG.
+
+import math
+import collections
+
+import numpy as np
+
+# Two outline vertices closer than this (in points) are the same vertex.
+CLOSE_DISTANCE = 1e-6
+
+# Largest number of passes of 2-opt.
+MAX_PASSES = 20
+
+# Circle in a piece's coordinates.
+Circle = collections.namedtuple("Circle", ["x", "y", "r"])
+
+# One closed shape to cut. "item" is the index of the placement of its
+# piece, "suffix" and "index" name it within the piece, and "shape" is an
+# (N, 2) array of points or a Circle. Outlines are cut starting at vertex
+# "start".
+Cut = collections.namedtuple("Cut", ["item", "suffix", "index", "shape", "start"])
+
+# Parts of a piece to cut, as a list of (suffix, list of shapes). Shapes are
+# the outline of the body, as points, or a Circle. The body is first and
+# everything else is inside it.
+def parts(piece):
+    result = [("_body", [piece["points"]])]
+    if "hole_radius" in piece:
+        result.append(("_hole", [Circle(0, 0, piece["hole_radius"])]))
+    if "bind" in piece:
+        bind = piece["bind"]
+        result.append(("_bind", [Circle(center[0], center[1], bind["hole_radius"])
+            for center in bind["centers"]]))
+    if "holes" in piece:
+        result.append(("_holes", [Circle(hole["cx"], hole["cy"], hole["r"])
+            for hole in piece["holes"]]))
+    return result
+
+# All the cuts of the placements (see nest.Placement), in the order of the
+# pieces and with the body of each piece first.
+def cuts(placements):
+    result = []
+    for item, placement in enumerate(placements):
+        for suffix, shapes in parts(placement.piece):
+            for index, shape in enumerate(shapes):
+                if not isinstance(shape, Circle):
+                    shape = ring(shape)
+                result.append(Cut(item, suffix, index, shape, 0))
+    return result
+
+# The points of a closed outline without the repeated last vertex.
+def ring(points):
+    p = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(p) > 1 and np.hypot(*(p[-1] - p[0])) < CLOSE_DISTANCE:
+        p = p[:-1]
+    return p
+
+# Points of a closed outline starting at vertex "start" and ending back at it.
+def rotate_ring(p, start):
+    return np.vstack((p[start:], p[:start + 1]))
+
+# Move points from the piece's coordinates to the sheet's.
+def transform(placement, p):
+    t = math.radians(placement.angle)
+    c = math.cos(t)
+    s = math.sin(t)
+    p = np.asarray(p, dtype=float).reshape(-1, 2)
+    return np.column_stack((p[:, 0]*c - p[:, 1]*s + placement.x,
+                            p[:, 0]*s + p[:, 1]*c + placement.y))
+
+# The points where a cut can start (and end), on the sheet.
+def entry_points(placements, cut):
+    placement = placements[cut.item]
+    if isinstance(cut.shape, Circle):
+        return transform(placement, [(cut.shape.x + cut.shape.r, cut.shape.y)])
+    return transform(placement, cut.shape)
+
+# Total distance that the head moves between cuts, in points, starting at
+# the origin.
+def travel(placements, cuts):
+    position = np.zeros(2)
+    total = 0.0
+    for cut in cuts:
+        entry = entry_points(placements, cut)[cut.start]
+        total += np.hypot(*(entry - position))
+        position = entry
+    return total
+
+# Returns the cuts in a better order, with the start vertex of outlines set.
+def order(placements, cuts):
+    n = len(cuts)
+    if n == 0:
+        return []
+    points = [entry_points(placements, cut) for cut in cuts]
+    inner = [cut.suffix != "_body" for cut in cuts]
+
+    # Bounding circles of the entry points, for a lower bound on the
+    # distance to a cut.
+    centers = np.array([(p.min(axis=0) + p.max(axis=0))/2 for p in points])
+    radii = np.array([np.hypot(*(p - c).T).max() for p, c in zip(points, centers)])
+
+    # Number of inner cuts left for each placement. A body is available
+    # once it's zero.
+    waiting = collections.Counter(cut.item for cut, i in zip(cuts, inner) if i)
+    available = np.array([i or waiting[cut.item] == 0 for cut, i in zip(cuts, inner)])
+    bodies = collections.defaultdict(list)
+    for k, cut in enumerate(cuts):
+        if not inner[k]:
+            bodies[cut.item].append(k)
+
+    # Nearest neighbor.
+    sequence = []
+    starts = [0]*n
+    position = np.zeros(2)
+    for step in range(n):
+        candidates = np.nonzero(available)[0]
+        bounds = np.maximum(np.hypot(*(centers[candidates] - position).T) - radii[candidates], 0)
+        best = None
+        for o in np.argsort(bounds, kind="stable"):
+            if best is not None and bounds[o] >= best[0]:
+                break
+            k = candidates[o]
+            d = np.hypot(*(points[k] - position).T)
+            start = int(np.argmin(d))
+            if best is None or d[start] < best[0]:
+                best = (d[start], k, start)
+
+        _, k, start = best
+        sequence.append(k)
+        starts[k] = start
+        position = points[k][start]
+        available[k] = False
+        if inner[k]:
+            item = cuts[k].item
+            waiting[item] -= 1
+            if waiting[item] == 0:
+                for body in bodies[item]:
+                    available[body] = True
+
+    sequence = two_opt(sequence, [points[k][starts[k]] for k in range(n)], inner, cuts)
+
+    # Start each outline at the vertex closest to the cuts on either side.
+    position = np.zeros(2)
+    for i, k in enumerate(sequence):
+        if len(points[k]) > 1:
+            d = np.hypot(*(points[k] - position).T)
+            if i + 1 < len(sequence):
+                following = sequence[i + 1]
+                d = d + np.hypot(*(points[k] - points[following][starts[following]]).T)
+            starts[k] = int(np.argmin(d))
+        position = points[k][starts[k]]
+
+    return [cuts[k]._replace(start=starts[k]) for k in sequence]
+
+# Improve the sequence by reversing runs of it, as long as that doesn't put
+# an inner cut after the body of its piece. Each cut starts and ends at
+# "entries[k]".
+def two_opt(sequence, entries, inner, cuts):
+    n = len(sequence)
+    for _ in range(MAX_PASSES):
+        improved = False
+        changed = True
+        for i in range(n - 1):
+            if changed:
+                # Entry points with the origin first, so that cut m is at
+                # m + 1, and the position of the body of each inner cut's
+                # piece (n for bodies).
+                p = np.vstack(([0, 0], [entries[k] for k in sequence]))
+                body_position = {}
+                for m, k in enumerate(sequence):
+                    if not inner[k]:
+                        body_position[cuts[k].item] = m
+                limit = np.array([body_position[cuts[k].item] if inner[k] else n
+                    for k in sequence])
+                changed = False
+
+            # Reversing i..j is allowed while no inner cut in it has the
+            # body of its piece in it too.
+            j = np.arange(i + 1, n)
+            j = j[j < np.minimum.accumulate(limit[i:])[1:]]
+            if len(j) == 0:
+                continue
+
+            # Change in travel from reversing i..j.
+            before = p[i]
+            first = p[i + 1]
+            last = p[j + 1]
+            after = p[np.minimum(j + 2, n)]
+            d = np.hypot(*(before - last).T) - np.hypot(*(before - first))
+            d += np.where(j + 1 < n,
+                    np.hypot(*(first - after).T) - np.hypot(*(last - after).T), 0)
+
+            best = int(np.argmin(d))
+            if d[best] < -1e-9:
+                end = j[best]
+                sequence[i:end + 1] = sequence[i:end + 1][::-1]
+                improved = True
+                changed = True
+        if not improved:
+            break
+    return sequence
@@ -15,15 +15,13 @@
 
 import math, sys, collections
 
-from config import GEAR_SPACING, TAU, DPI
+from config import TAU, DPI, DEFAULT_CONFIG, NORTH, EAST, SOUTH, WEST
 import gear
+import draw
 import separator
 import bind
-
-NORTH = 0
-EAST = 1
-SOUTH = 2
-WEST = 3
+import jobs
+import instrument
 
 # How much to shrink the radius of the separator holes, in inches.
 # 1/4 inch is too much. 1/8 would probably work fine too.
@@ -40,9 +38,13 @@ COLORS = [
 ]
 
 class GearTrain:
-    # module is distance between teeth divided by pi.
-    def __init__(self, data, cx, cy, module):
+    # module is distance between teeth divided by pi. If None, it's the one
+    # in "config" (a config.ClockConfig).
+    def __init__(self, data, cx, cy, module=None, config=DEFAULT_CONFIG):
+        if module is None:
+            module = config.module
         self.data = data
+        self.config = config
         self.cx = cx
         self.cy = cy
         self.last_teeth_count = 0
@@ -53,6 +55,13 @@ class GearTrain:
         self.angle_offset = 0
         # Teeth to count.
         self.gear_count = collections.defaultdict(lambda: 0)
+        # Teeth to largest chordal error, in inches, for adaptive sampling.
+        self.max_error = {}
+        # Index in data["pieces"] of the last gear, or None if suppressed.
+        self.last_index = None
+        # Meshing pairs of (driver index, driven index, driver teeth, driven
+        # teeth), for mesh.check().
+        self.meshes = []
 
     def set_angle_offset(self, angle_offset):
         "Rotate all gears by this much, where pi means an entire tooth on a one-tooth gear."
@@ -67,16 +76,17 @@ class GearTrain:
             start_cz = min(next_cz, self.last_cz) + 1
             stop_cz = max(next_cz, self.last_cz) - 1
             for cz in range(start_cz, stop_cz + 1):
-                piece = separator.generate(self.cx, self.cy, hole_radius)
+                piece = jobs.Deferred(separator.generate, self.cx, self.cy, hole_radius,
+                        self.config.separator_radius, draw.config_tolerance(self.config))
                 piece["cz"] = cz
                 piece["speed"] = self.speed
-                bind.add_bind_info(piece)
+                bind.add_bind_info(piece, self.config)
                 self.data["pieces"].append(piece)
 
     def add_gear(self, teeth_count, direction, hole_radius, cz=1, suppress=False):
         self.gear_count[teeth_count] += 1
 
-        distance = (self.last_teeth_count + teeth_count)/2.0*self.module + GEAR_SPACING
+        distance = (self.last_teeth_count + teeth_count)/2.0*self.module + self.config.gear_spacing
 
         x = self.cx
         y = self.cy
@@ -117,21 +127,49 @@ class GearTrain:
         else:
             angle = self.angle_offset
 
-        piece = gear.generate(x, y, teeth_count,
-                hole_radius, angle, COLORS[self.color_index], self.module)
-
-        piece["speed"] = self.speed
-        piece["cz"] = cz
-        bind.add_bind_info(piece)
+        # The gear itself is made later by jobs.run().
         if not suppress:
+            config = self.config
+            piece = jobs.Deferred(gear.generate, x, y, teeth_count,
+                    hole_radius, angle, COLORS[self.color_index], self.module,
+                    config.gear_max_error, (config.num_points_root, config.num_points_fillet,
+                        config.num_points_flank, config.num_points_top))
+            piece["speed"] = self.speed
+            piece["cz"] = cz
+            bind.add_bind_info(piece, config)
+            piece.add_callback(lambda piece: self.record_max_error(teeth_count, piece))
+            # Gears with the same teeth share their tooth profile.
+            piece.group = ("gear", teeth_count, self.module)
             self.data["pieces"].append(piece)
+            index = len(self.data["pieces"]) - 1
+            if direction is not None and self.last_index is not None:
+                self.meshes.append((self.last_index, index, self.last_teeth_count, teeth_count))
+            self.last_index = index
+        else:
+            self.last_index = None
 
         self.cx = x
         self.cy = y
         self.last_teeth_count = teeth_count
         self.last_cz = cz
 
+    def record_max_error(self, teeth_count, piece):
+        if "max_error" in piece:
+            self.max_error[teeth_count] = max(self.max_error.get(teeth_count, 0), piece["max_error"])
+
+    # Add a list of stages, each a tuple of (driver teeth, driven teeth,
+    # direction, cz). The driver goes on the current axle and the driven gear
+    # is placed in the direction from it.
+    def add_stages(self, stages, hole_radius):
+        for driver, driven, direction, cz in stages:
+            self.add_gear(driver, None, hole_radius, cz=cz)
+            self.add_gear(driven, direction, hole_radius, cz=cz)
+
     def dump_statistics(self, out):
+        instrument.record("gears", counts=dict(self.gear_count), max_error=self.max_error)
         for teeth_count in sorted(self.gear_count.keys()):
-            out.write("%d gears with %d teeth.\n" % (self.gear_count[teeth_count], teeth_count))
+            out.write("%d gears with %d teeth" % (self.gear_count[teeth_count], teeth_count))
+            if teeth_count in self.max_error:
+                out.write(" (max error %.5f inches)" % self.max_error[teeth_count])
+            out.write(".\n")
 
@@ -16,7 +16,9 @@
 from math import sqrt, sin, cos, atan2
 
 # 2D vector class.
-class Vector:
+class Vector(object):
+    __slots__ = ("x", "y")
+
     @staticmethod
     def circle(t):
         return Vector(cos(t), sin(t))
@@ -43,9 +45,14 @@ class Vector:
     def __mul__(self, other):
         return Vector(self.x*other, self.y*other)
 
-    def __div__(self, other):
+    def __truediv__(self, other):
         return Vector(self.x/other, self.y/other)
 
+    # Allow unpacking as "x, y", like the rows of a point array.
+    def __iter__(self):
+        yield self.x
+        yield self.y
+
     def length(self):
         return sqrt(self.x**2 + self.y**2)
 
@@ -0,0 +1,196 @@
+
+#   Copyright 2015 Lawrence Kesteloot
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Build again whenever one of our source files or a spec file changes,
+# without starting a new interpreter. Changed modules are reloaded in
+# place, along with the modules that import them, and the disk cache
+# (memo.py) means that only the pieces whose code or inputs changed are
+# made again. Files are polled, since there's no inotify in the standard
+# library. The main script and this file can't be reloaded while they run,
+# so the process starts over when they change.
+#
+# Outputs are replaced atomically so that a reader never sees half a file.
+# After each build a build id, one more than the last one, is written next
+# to the output (clock.build for clock.json). The viewer polls it and
+# reloads the clock when it changes.
+
+import os
+import ast
+import sys
+import glob
+import time
+import tempfile
+import importlib
+import traceback
+
+import lru
+import memo
+
+# Seconds between checks of the files.
+POLL_INTERVAL = 0.1
+
+BUILD_ID_SUFFIX = ".build"
+
+# Write a file by calling write() with a temporary file and renaming it
+# over "filename".
+def atomic_write(filename, write, mode="w"):
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_filename = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.chmod(temp_filename, 0o644)
+        os.replace(temp_filename, filename)
+    except:
+        os.remove(temp_filename)
+        raise
+
+def build_id_filename(output):
+    return os.path.splitext(output)[0] + BUILD_ID_SUFFIX
+
+# Returns the id in the file, or 0 if there's none.
+def read_build_id(filename):
+    try:
+        with open(filename) as f:
+            return int(f.read())
+    except (IOError, OSError, ValueError):
+        return 0
+
+def source_files():
+    return sorted(glob.glob(os.path.join(memo.SOURCE_DIR, "*.py")))
+
+# Modification time of each file, or None if it's missing.
+def snapshot(filenames):
+    mtimes = {}
+    for filename in filenames:
+        try:
+            mtimes[filename] = os.stat(filename).st_mtime_ns
+        except OSError:
+            mtimes[filename] = None
+    return mtimes
+
+# Names of the modules that the source of "module" imports.
+def imports(module):
+    with open(module.__file__) as f:
+        tree = ast.parse(f.read(), module.__file__)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            names.add(node.module)
+    return names
+
+# Reload our modules whose files are in "changed" and the modules that
+# import them, directly or not, each after the modules it imports.
+def reload_modules(changed):
+    # The main script is also in there as "__mp_main__" once multiprocessing
+    # is used.
+    modules = dict((name, module) for name, module in list(sys.modules.items())
+            if module.__name__ == name and name not in ("__main__", __name__) and
+                memo.is_ours(module))
+    uses = dict((name, imports(module) & set(modules)) for name, module in modules.items())
+
+    stale = set(name for name, module in modules.items()
+            if os.path.abspath(module.__file__) in changed)
+    growing = True
+    while growing:
+        growing = False
+        for name in modules:
+            if name not in stale and uses[name] & stale:
+                stale.add(name)
+                growing = True
+
+    done = set()
+    def reload(name):
+        if name in done:
+            return
+        done.add(name)
+        for other in sorted(uses[name] & stale):
+            reload(other)
+        importlib.reload(modules[name])
+    for name in sorted(stale):
+        reload(name)
+
+    # Entries made by the old code.
+    memo.FINGERPRINTS.clear()
+    lru.clear()
+
+    return sorted(stale)
+
+# Waits until some of the files change and stop changing. Returns the new
+# modification times and the files that changed.
+def wait_for_change(mtimes, extra):
+    while True:
+        time.sleep(POLL_INTERVAL)
+        current = snapshot(source_files() + extra)
+        if current != mtimes:
+            # Editors sometimes write a file in more than one step.
+            while True:
+                time.sleep(POLL_INTERVAL)
+                settled = snapshot(source_files() + extra)
+                if settled == current:
+                    break
+                current = settled
+            changed = set(filename for filename in current
+                    if current[filename] != mtimes.get(filename))
+            return current, changed
+
+# Calls build() now and again after every change to our source files or
+# to the "extra" files, then bumps the build id of "output". Never returns.
+def run(build, output, extra=(), out=sys.stderr):
+    extra = [os.path.abspath(filename) for filename in extra]
+    restart_files = set([os.path.abspath(sys.modules["__main__"].__file__),
+        os.path.abspath(__file__)])
+    id_filename = build_id_filename(output)
+    build_id = read_build_id(id_filename)
+    mtimes = snapshot(source_files() + extra)
+
+    # Changed sources that haven't been reloaded yet.
+    pending = set()
+    ready = True
+    while True:
+        if ready:
+            start = time.perf_counter()
+            try:
+                build()
+            except Exception:
+                traceback.print_exc(file=out)
+                out.write("Build failed, keeping the last output.\n")
+            else:
+                build_id += 1
+                atomic_write(id_filename, lambda f: f.write("%d\n" % build_id))
+                out.write("Build %d done in %.2f seconds.\n" % (build_id, time.perf_counter() - start))
+            out.write("Watching for changes.\n")
+            out.flush()
+
+        mtimes, changed = wait_for_change(mtimes, extra)
+        out.write("Changed: %s\n" % ", ".join(sorted(os.path.basename(f) for f in changed)))
+
+        if changed & restart_files:
+            out.write("Starting over.\n")
+            out.flush()
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+
+        ready = True
+        pending.update(filename for filename in changed if filename.endswith(".py"))
+        if pending:
+            try:
+                out.write("Reloaded %s.\n" % ", ".join(reload_modules(pending)))
+                pending = set()
+            except Exception:
+                traceback.print_exc(file=out)
+                out.write("Reload failed, waiting for a fix.\n")
+                ready = False